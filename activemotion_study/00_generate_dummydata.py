@@ -1,38 +1,52 @@
 import os
+import shutil
 import nibabel as nib
 import numpy as np
-from scipy.ndimage import affine_transform
-from scipy.spatial.transform import Rotation as R
 from pathlib import Path
+from timing_files import read_timing_file
+from dummy_motion import (simulate_run, load_volume, iter_stationary_volumes, write_stationary_run,
+                          write_moving_run)
 
 # Paths to data
 nifti_path = '/data/elevchenko/MinMo_movements/activemotion_study/raw_data/241031DC_nii/20035_MinMo_test_20241031_120047_241031_115636_func-bold_cond-01_movt_run-01_20241031120048_4.nii'
 save_path = '/data/elevchenko/MinMo_movements/activemotion_study/dummydata/dummydata_nii'
 stim_path = Path('/data/elevchenko/MinMo_movements/activemotion_study/stimuli_tent')
 
-# Load EPI data
+low_memory = 0  # 1 - stream float32 volumes into on-disk NIfTIs instead of holding the 4D runs in memory
+
+# Load EPI data (the data stays on disk behind the array proxy)
 print('Reading EPI file...')
 img = nib.load(nifti_path)
-data = img.get_fdata()
 affine = img.affine
-n = data.shape[-1]  # Number of volumes
+n = img.shape[-1]  # Number of volumes
 
 # Prepare dummy stationary EPI
 vol_idx = 13  # Select a volume where no motion occurred
-single_vol = data[..., vol_idx]
-non_moving_epi = np.repeat(single_vol[..., np.newaxis], n, axis=3)
+single_vol = load_volume(img, vol_idx, dtype=np.float64)  # Stored as float32 in low-memory mode
 
 # Add small random noise to stationary EPI
-np.random.seed(42)  # For reproducibility
+rng = np.random.default_rng(42)  # One generator for the noise and the motion parameters, in both modes
 noise_mean = 0
 noise_std = 0.5
-non_moving_epi += np.random.normal(loc=noise_mean, scale=noise_std, size=non_moving_epi.shape)
 
-# Save stationary dummy EPI for 3 runs
-for run_i in range(1, 4):
-    save_path_stationary = os.path.join(save_path, f'task-movt_stationary_dummy_{run_i}.nii')
-    print(f'Saving stationary dummy data, run-{run_i}')
-    nib.save(nib.Nifti1Image(non_moving_epi, affine), save_path_stationary)
+save_path_stationary = os.path.join(save_path, 'task-movt_stationary_dummy_1.nii')
+if low_memory == 1:
+    # Same volumes as the in-memory mode, written one by one as float32; runs 2 and 3 are copies of run 1
+    print('Saving stationary dummy data, run-1')
+    write_stationary_run(save_path_stationary, single_vol, n, affine, noise_mean, noise_std, rng)
+    for run_i in range(2, 4):
+        print(f'Saving stationary dummy data, run-{run_i}')
+        shutil.copyfile(save_path_stationary, os.path.join(save_path, f'task-movt_stationary_dummy_{run_i}.nii'))
+else:
+    # Volumes are kept contiguous (Fortran order, as in the NIfTI file) for the per-volume resampling
+    non_moving_epi = np.empty(single_vol.shape + (n,), dtype=single_vol.dtype, order='F')
+    for vol_i, volume in enumerate(iter_stationary_volumes(single_vol, n, noise_mean, noise_std, rng)):
+        non_moving_epi[..., vol_i] = volume
+
+    # Save stationary dummy EPI for 3 runs
+    for run_i in range(1, 4):
+        print(f'Saving stationary dummy data, run-{run_i}')
+        nib.save(nib.Nifti1Image(non_moving_epi, affine), os.path.join(save_path, f'task-movt_stationary_dummy_{run_i}.nii'))
 
 # Load movement timestamps from .1D files
 print('Loading movement timestamps...')
@@ -43,15 +57,10 @@ n_spare_trs, tr_duration = 10, 0.8
 spare_secs = int(n_spare_trs * tr_duration) # timing files don't take into account spare TRs which
 # makes sense for AFNI but not for dummy data generation
 
-for line_idx in range(sum(1 for _ in open(file_paths[0]))):
-    row = []
-    for file in file_paths:
-        try:
-            value = np.loadtxt(file, skiprows=line_idx, max_rows=1)
-            row.append(value.flatten())
-        except Exception as e:
-            print(f"Error reading {file}: {e}")
-            continue
+timing_files = [read_timing_file(file) for file in file_paths]  # Each file is parsed once
+
+for line_idx in range(timing_files[0].n_runs):
+    row = [timing.run(line_idx)[0] for timing in timing_files if line_idx < timing.n_runs]
 
     row = np.concatenate(row)
     row = sorted([int(number)+spare_secs for number in row])
@@ -59,45 +68,37 @@ for line_idx in range(sum(1 for _ in open(file_paths[0]))):
 
 # Movement parameters
 max_timestamps = max(len(run) for run in data_lines)
-rotation_angles = np.random.uniform(-2, 2, size=(max_timestamps, 3))
-translations = np.random.uniform(-1, 1, size=(max_timestamps, 3))
+rotation_angles = rng.uniform(-2, 2, size=(max_timestamps, 3))
+translations = rng.uniform(-1, 1, size=(max_timestamps, 3))
 
 # Define window movements size
 window_size = 5  # TR = 0.8 seconds (6 * 0.8 = 4.8)
 window_volumes = int(window_size / tr_duration)  # Number of volumes in the window
 
 for run_i, run_timestamps in enumerate(data_lines[3:], 4):
-    # Reset epi_to_move for each run
-    epi_to_move = non_moving_epi.copy()
-
-    for ts_i, timestamp in enumerate(run_timestamps):
-        # Convert timestamp (seconds) to TR index
-        # Round to nearest TR index+2 (+2 - to make sure transform isn't applied on before onset intervals)
-        tr_index = int(round(timestamp / tr_duration)) + 2
-
-        for offset in range(window_volumes):
-            vol_to_transform = tr_index + offset
-            if vol_to_transform < 0 or vol_to_transform >= n:  # Check bounds
-                continue
-
-            # Generate rotation and translation matrices
-            rotation = R.from_euler('xyz', rotation_angles[ts_i], degrees=True).as_matrix()
-            affine_transform_matrix = np.eye(4)
-            affine_transform_matrix[:3, :3] = rotation
-            affine_transform_matrix[:3, 3] = translations[ts_i]
-
-            # Apply transformation
-            epi_to_move[..., vol_to_transform] = affine_transform(
-                non_moving_epi[..., vol_to_transform],
-                matrix=affine_transform_matrix[:3, :3],
-                offset=affine_transform_matrix[:3, 3],
-                mode='constant',
-                cval=0  # Fill missing data with 0
-            )
+    # Convert timestamps (seconds) to TR indices
+    # Round to nearest TR index+2 (+2 - to make sure transform isn't applied on before onset intervals)
+    window_starts = [int(round(timestamp / tr_duration)) + 2 for timestamp in run_timestamps]
 
-    # Save transformed data
     save_path_move = os.path.join(save_path, f'task-movt_moving_dummy_{run_i}.nii')
+
+    if low_memory == 1:
+        # Copy of the stationary run on disk, windows are moved in place one event at a time
+        print(f'Saving moving dummy data, run-{run_i}')
+        write_moving_run(save_path_move, save_path_stationary, window_starts, window_volumes, rotation_angles, translations)
+        continue
+
+    # One transform per event, the volumes of its window resampled one by one
+    moved_idx, moved_vols = simulate_run(non_moving_epi, window_starts, window_volumes, rotation_angles, translations)
+
+    # Swap the moved volumes into the stationary series for saving, then restore it for the next run
+    stationary_vols = non_moving_epi[..., moved_idx]
+    non_moving_epi[..., moved_idx] = moved_vols
+
+    # Save transformed data
     print(f'Saving moving dummy data, run-{run_i}')
-    nib.save(nib.Nifti1Image(epi_to_move, affine), save_path_move)
+    nib.save(nib.Nifti1Image(non_moving_epi, affine), save_path_move)
+
+    non_moving_epi[..., moved_idx] = stationary_vols
 
 print("Dummy data generation complete!")
@@ -1,31 +1,39 @@
 import os
 import nibabel as nib
 import numpy as np
-from scipy.ndimage import affine_transform
-from scipy.spatial.transform import Rotation as R
+from dummy_motion import (simulate_run, load_volume, iter_stationary_volumes, write_stationary_run,
+                          write_moving_run)
 
 # Paths
 nifti_path = '/data/elevchenko/MinMo_movements/activemotion_study/raw_data/241031DC_nii/20035_MinMo_test_20241031_120047_241031_115636_func-bold_cond-01_film_run-01_20241031120048_16.nii.gz'
 save_path = '/data/elevchenko/MinMo_movements/activemotion_study/dummydata/dummydata_nii'
 
-# Load EPI
+low_memory = 0  # 1 - stream float32 volumes into on-disk NIfTIs instead of holding the 4D runs in memory
+
+# Load EPI (the data stays on disk behind the array proxy)
 print('Reading EPI file...')
 img = nib.load(nifti_path)
-data = img.get_fdata()
 affine = img.affine
-n_vols = data.shape[-1]
+n_vols = img.shape[-1]
 
 # Create stationary base
 vol_idx = 13
-single_vol = data[..., vol_idx]
-non_moving_epi = np.repeat(single_vol[..., np.newaxis], n_vols, axis=3)
+single_vol = load_volume(img, vol_idx, dtype=np.float64)  # Stored as float32 in low-memory mode
 
 # Add noise
-np.random.seed(42)
-non_moving_epi += np.random.normal(loc=0, scale=0.5, size=non_moving_epi.shape)
-
-# Save stationary dummy movie
-nib.save(nib.Nifti1Image(non_moving_epi, affine), os.path.join(save_path, 'task-film_stationary_dummy_1.nii'))
+rng = np.random.default_rng(42)  # One generator for the noise and the motion parameters, in both modes
+stationary_path = os.path.join(save_path, 'task-film_stationary_dummy_1.nii')
+if low_memory == 1:
+    # Same volumes as the in-memory mode, written one by one as float32
+    write_stationary_run(stationary_path, single_vol, n_vols, affine, 0, 0.5, rng)
+else:
+    # Volumes are kept contiguous (Fortran order, as in the NIfTI file) for the per-volume resampling
+    non_moving_epi = np.empty(single_vol.shape + (n_vols,), dtype=single_vol.dtype, order='F')
+    for vol_i, volume in enumerate(iter_stationary_volumes(single_vol, n_vols, 0, 0.5, rng)):
+        non_moving_epi[..., vol_i] = volume
+
+    # Save stationary dummy movie
+    nib.save(nib.Nifti1Image(non_moving_epi, affine), stationary_path)
 
 # --- Simulate low-frequency involuntary motion ---
 # Sparse motion events (e.g., every ~20 TRs)
@@ -36,32 +44,19 @@ window_vols = int(window_size_secs / tr_duration)
 
 # Generate motion timestamps
 motion_timestamps = list(range(10, n_vols - window_vols, motion_every_n_trs))
-rotation_angles = np.random.uniform(-2, 2, size=(len(motion_timestamps), 3))
-translations = np.random.uniform(-1, 1, size=(len(motion_timestamps), 3))
-
-epi_to_move = non_moving_epi.copy()
-
-for i, tr_start in enumerate(motion_timestamps):
-    for offset in range(window_vols):
-        vol_idx = tr_start + offset
-        if vol_idx >= n_vols:
-            continue
-
-        # Apply motion
-        rot = R.from_euler('xyz', rotation_angles[i], degrees=True).as_matrix()
-        aff_mat = np.eye(4)
-        aff_mat[:3, :3] = rot
-        aff_mat[:3, 3] = translations[i]
-
-        epi_to_move[..., vol_idx] = affine_transform(
-            non_moving_epi[..., vol_idx],
-            matrix=aff_mat[:3, :3],
-            offset=aff_mat[:3, 3],
-            mode='constant',
-            cval=0
-        )
-
-# Save moving dummy data
-nib.save(nib.Nifti1Image(epi_to_move, affine), os.path.join(save_path, 'task-film_moving_dummy_2.nii'))
+rotation_angles = rng.uniform(-2, 2, size=(len(motion_timestamps), 3))
+translations = rng.uniform(-1, 1, size=(len(motion_timestamps), 3))
+
+moving_path = os.path.join(save_path, 'task-film_moving_dummy_2.nii')
+if low_memory == 1:
+    # Copy of the stationary run on disk, windows are moved in place one event at a time
+    write_moving_run(moving_path, stationary_path, motion_timestamps, window_vols, rotation_angles, translations)
+else:
+    # One transform per event, the volumes of its window resampled one by one
+    moved_idx, moved_vols = simulate_run(non_moving_epi, motion_timestamps, window_vols, rotation_angles, translations)
+    non_moving_epi[..., moved_idx] = moved_vols  # The stationary run is already saved, move it in place
+
+    # Save moving dummy data
+    nib.save(nib.Nifti1Image(non_moving_epi, affine), moving_path)
 
 print("Dummy passive movie data generation complete!")
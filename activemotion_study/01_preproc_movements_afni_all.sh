@@ -6,6 +6,9 @@
 export dummydata=0
 max_jobs=8 # Set maximum number of parallel jobs
 
+# Folder of this script, where the python helpers (timing_files.py) are
+script_dir="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
+
 # Paths
 if [[ "$dummydata" -eq 1 ]]; then
   echo "Running the pipeline on DUMMY DATA! dummydata=$dummydata"
@@ -39,20 +42,16 @@ echo "${subjects_sequence[@]}"
 
 # Function to slice specific rows from a .1D file
 # This function limits to 3 rows per condition
+# The timing file is parsed by the shared timing_files.py module (same parser as the python scripts):
+# rows count runs, i.e. the lines that are not '#' comments (as AFNI reads timing files)
 slice_1D_file() {
     input_file="$1"
     output_file="$2"
     rows=("${!3}") # Rows to extract
     start_index="$4" # Starting index (0 for first 3 rows, 3 for the next 3 rows)
 
-    # Empty the output file before adding rows
-    : > "$output_file"
-
     # Extract 3 rows based on the start_index
-    for ((i=0; i<3; i++)); do
-        row_index=$((start_index + i))
-        sed -n "${rows[$row_index]}p" "$input_file" >> "$output_file"
-    done
+    python "$script_dir/timing_files.py" "$input_file" "$output_file" "${rows[@]:$start_index:3}"
 }
 
 # Define the bad subjects
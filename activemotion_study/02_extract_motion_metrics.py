@@ -1,58 +1,43 @@
+import argparse
 import numpy as np
 import pandas as pd
 from pathlib import Path
-
-# Function to load motion and timing data
-def load_motion_and_timing(motion_file, timing_file):
+from epochs import onset_indices, extract_epochs, summarize_epochs
+from trial_store import save_trials, load_trials, trial_store_paths
+from timing_files import read_timing_file
+from parallel import map_subjects
+from manifest import Manifest, manifest_path, merge_rows
+from catalog import load_catalog
+
+# Function to load a single motion file
+def load_motion_file(motion_file):
     """
-    Load motion data and timing data from files, skipping header lines in motion files.
+    Load motion data from a file as a 2D array (n_trs x n_columns), skipping header lines.
     """
     # Check if the motion file exists
     if not motion_file.exists():
         print(f"Motion file not found: {motion_file.name}. Skipping...")
-        return None, None
+        return None
 
-    # Load motion data, skipping header lines
-    with open(motion_file, 'r') as file:
-        motion_data = np.array([
-            list(map(float, line.strip().split())) for line in file if not line.startswith('#')
-        ])
+    return np.loadtxt(motion_file, comments='#', ndmin=2)
 
-    # Load timing data
-    if not timing_file.exists():
-        print(f"Timing file not found: {timing_file}. Skipping...")
-        return None, None
-    with open(timing_file, 'r') as file:
-        timing_content = file.readlines()
-
-    return motion_data, timing_content
-
-# Function to adjust timing for global run lengths
-def adjust_timing_for_global(onset_times, run_lengths, sampling_interval=0.8):
-    adjusted_timings = []
-    cumulative_time = 0
-    for run_idx, run_onsets in enumerate(onset_times):
-        run_adjusted = [(onset + cumulative_time) for onset in run_onsets]
-        adjusted_timings.extend(run_adjusted)
-        cumulative_time += run_lengths[run_idx] * sampling_interval
-    return adjusted_timings
-
-# Function to extract trials and averages for a metric
-def get_post_onset_metrics(motion_data, onset_times, col_idx, sampling_interval=0.8, post_onset_duration=5):
-    trials, averages, averages_abs = [], [], []
+# Function to load all metric files of one subject/condition run
+def load_run_metrics(metric_files):
+    """
+    Parse every metric file of a subject/condition once, so the arrays can be reused for all movements.
+    """
+    return {metric_name: load_motion_file(motion_file) for metric_name, motion_file in metric_files.items()}
+
+# Function to extract trials and summary statistics for all columns of a metric
+def get_post_onset_metrics(motion_data, onset_times, sampling_interval=0.8, post_onset_duration=5):
     post_onset_duration_idx = int(post_onset_duration / sampling_interval)
+    onset_idx = onset_indices(onset_times, sampling_interval)
 
-    for onset in onset_times:
-        onset_idx = int(onset / sampling_interval)
-        end_idx = onset_idx + post_onset_duration_idx
-        trial = motion_data[onset_idx:end_idx, col_idx]
-        avg = np.mean(trial)
-        avg_abs = np.mean(np.abs(trial))
-        trials.append(trial)
-        averages.append(avg)
-        averages_abs.append(avg_abs)
+    # One (n_trials x window x n_columns) gather, statistics reduced along the window axis
+    epochs, valid = extract_epochs(motion_data, onset_idx, 0, post_onset_duration_idx)
+    stats = summarize_epochs(epochs, valid)
 
-    return trials, averages, averages_abs
+    return epochs, valid, stats
 
 # Paths
 root_fldr = Path('/data/elevchenko/MinMo_movements/activemotion_study')
@@ -61,114 +46,166 @@ stim_fldr = Path(root_fldr / 'stimuli')
 
 run_lengths = [505, 505, 505]  # Run lengths
 
-# Load subject and condition sequences
-sequence_file = Path(root_fldr / 'Sequences of conditions and runs.csv')
-sequence_df = pd.read_csv(sequence_file)
+# Subjects and condition sequences (study catalog, cached)
+catalog = load_catalog(root_fldr, deriv_fldr)
 
 dummydata = 0
 
 # Exclude dummy data
 if dummydata == 1:
-    subjects = sequence_df[sequence_df['Subj #'] == 'dummydata_nii']['Subj #']
+    subjects = ['dummydata_nii']
 else:
-    subjects = sequence_df[sequence_df['Subj #'] != 'dummydata_nii']['Subj #']
+    subjects = catalog.subject_ids()
 
-# Results list
-results = []
+movement_types = ['cough', 'crosslegsleftontop', 'crosslegsrightontop', 'raiselefthip', 'raiserighthip', 'lefthandtorightthigh',
+                  'righthandtoleftthigh', 'sayHellotheremum', 'scratchleftcheek', 'scratchrightcheek']
 
-# Process each subject and condition
-for subj_id in subjects:
-    condition_sequence = sequence_df.loc[sequence_df['Subj #'] == subj_id, 'Conditions'].values[0].split(' ')
+# Timing files are shared by all subjects, read each of them once
+timing_files = {}
+for movement_type in movement_types:
+    timing_file = stim_fldr / f'condition-{movement_type}_run-all.1D'
+    if not timing_file.exists():
+        print(f"Timing file not found: {timing_file}. Skipping...")
+        continue
+    timing_files[movement_type] = read_timing_file(timing_file)
+
+# Function to get the condition order of a subject
+def get_condition_sequence(subj_id):
+    return catalog.conditions(subj_id)
+
+# Function to define the metric files of a subject/condition
+def get_metric_files(subj_id, cond_name):
+    cond_folder = catalog.results_folder(subj_id, 'mvts', cond_name)
+    return {
+        "enorm": cond_folder / f"motion_{subj_id}_enorm.1D",
+        "mm": cond_folder / "mm_rall",
+        "mm_delt": cond_folder / "mm_delt_rall",
+        "outliers": cond_folder / "outcount_rall.1D",
+        "dfile": cond_folder / "dfile_rall.1D",
+    }
+
+# Function to list every input file the rows of a subject depend on
+def get_input_files(subj_id):
+    input_files = [stim_fldr / f'condition-{movement_type}_run-all.1D' for movement_type in movement_types]
+    for cond_name in get_condition_sequence(subj_id):
+        input_files.extend(get_metric_files(subj_id, cond_name).values())
+    return input_files
+
+# Function to extract the metrics of one subject (all conditions and movements)
+def process_subject(subj_id):
+    # Results list (trial time series are kept aside, one per row, for the binary trial store)
+    results = []
+    trials = []
+
+    condition_sequence = get_condition_sequence(subj_id)
 
     for cond_i, cond_name in enumerate(condition_sequence):
-        cond_folder = Path(deriv_fldr / f'sub-{subj_id}/sub-{subj_id}_task-mvts_cond-{cond_name}/sub-{subj_id}_task-mvts_cond-{cond_name}.results')
-
         # Define metric files
-        metric_files = {
-            "enorm": cond_folder / f"motion_{subj_id}_enorm.1D",
-            "mm": cond_folder / "mm_rall",
-            "mm_delt": cond_folder / "mm_delt_rall",
-            "outliers": cond_folder / "outcount_rall.1D",
-            "dfile": cond_folder / "dfile_rall.1D",
-        }
-
-        for movement_type in ['cough', 'crosslegsleftontop', 'crosslegsrightontop', 'raiselefthip', 'raiserighthip', 'lefthandtorightthigh',
-                              'righthandtoleftthigh', 'sayHellotheremum', 'scratchleftcheek', 'scratchrightcheek']:
-
-            # Timing file
-            timing_file = stim_fldr / f'condition-{movement_type}_run-all.1D'
-
-            # Parse timing data
-            _, timing_content = load_motion_and_timing(metric_files["enorm"], timing_file)
-            if timing_content is None:
+        metric_files = get_metric_files(subj_id, cond_name)
+
+        # Skip runs without preprocessing outputs
+        if not metric_files["enorm"].exists():
+            print(f"Motion file not found: {metric_files['enorm'].name}. Skipping...")
+            continue
+
+        # Parse all metric files of this run once and reuse them for every movement
+        run_metrics = load_run_metrics(metric_files)
+
+        for movement_type in movement_types:
+
+            # Parsed timing data
+            if movement_type not in timing_files:
                 continue
+            timing = timing_files[movement_type]
 
             # Split and adjust timing content
             if cond_i == 0:
-                timing_content = timing_content[:3]
+                timing = timing.select_runs(range(min(3, timing.n_runs)))
             elif cond_i == 1:
-                timing_content = timing_content[3:]
+                timing = timing.select_runs(range(3, timing.n_runs))
 
-            onset_times = []
-            for line in timing_content:
-                trials = line.strip().split()
-                run_onsets = [float(trial.split(':')[0]) for trial in trials]
-                onset_times.append(run_onsets)
-
-            onset_times = adjust_timing_for_global(onset_times, run_lengths)
+            onset_times = timing.global_onsets(run_lengths)
 
             # Process each metric
-            for metric_name, motion_file in metric_files.items():
-
-                motion_data, _ = load_motion_and_timing(motion_file, timing_file)
+            for metric_name, motion_data in run_metrics.items():
+                if motion_data is None:
+                    continue
 
                 if metric_name == "dfile":
                     # Extract six motion parameters
-                    motion_params = ["roll", "pitch", "yaw", "dS", "dL", "dP"]
-                    for col_idx, param in enumerate(motion_params):
-                        trials, averages, averages_abs = get_post_onset_metrics(motion_data, onset_times, col_idx)
-                        for trial, avg, avg_abs in zip(trials, averages, averages_abs):
-                            results.append({
-                                "subject": subj_id,
-                                "condition": cond_name,
-                                "movement": movement_type,
-                                "metric": param,
-                                "trial": trial.tolist(),
-                                "N": len(trial),
-                                "avg": avg,
-                                "avg_abs": avg_abs,
-                                "med": np.median(trial),
-                                "max": np.max(trial),
-                                "min": np.min(trial)
-                            })
+                    param_names = ["roll", "pitch", "yaw", "dS", "dL", "dP"]
                 else:
-                    trials, averages, averages_abs = get_post_onset_metrics(motion_data, onset_times, col_idx=0)
-                    for trial, avg, avg_abs in zip(trials, averages, averages_abs):
-                        results.append({
-                            "subject": subj_id,
-                            "condition": cond_name,
-                            "movement": movement_type,
-                            "metric": metric_name,
-                            "trial": trial.tolist(),
-                            "N": len(trial),
-                            "avg": avg,
-                            "avg_abs": avg_abs,
-                            "med": np.median(trial),
-                            "max": np.max(trial),
-                            "min": np.min(trial)
-                        })
-
-# Save to CSV
-df = pd.DataFrame(results)
-
-# Ensure the output directory exists
-(deriv_fldr / 'group_analysis').mkdir(parents=True, exist_ok=True)
-
-if dummydata == 1:
-    df.to_csv(deriv_fldr / 'group_analysis'/ "df_motion_metrics_all_dummydata.csv", index=False)
-    print("Metrics saved to df_motion_metrics_all_dummydata.csv")
-else:
-    df.to_csv(deriv_fldr / 'group_analysis'/ "df_motion_metrics_all.csv", index=False)
-    print("Metrics saved to df_motion_metrics_all.csv")
-
-
+                    param_names = [metric_name]
+
+                epochs, valid, stats = get_post_onset_metrics(motion_data[:, :len(param_names)], onset_times)
+                for col_idx, param in enumerate(param_names):
+                    results.append(pd.DataFrame({
+                        "subject": subj_id,
+                        "condition": cond_name,
+                        "movement": movement_type,
+                        "metric": param,
+                        "N": stats["N"][:, col_idx],
+                        "avg": stats["avg"][:, col_idx],
+                        "avg_abs": stats["avg_abs"][:, col_idx],
+                        "med": stats["med"][:, col_idx],
+                        "max": stats["max"][:, col_idx],
+                        "min": stats["min"][:, col_idx]
+                    }))
+                    trials.extend(epochs[i, valid[i], col_idx] for i in range(len(epochs)))
+
+    return results, trials
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extract post-onset motion metrics for every subject and condition.')
+    parser.add_argument('--jobs', type=int, default=1, help='number of subjects processed in parallel')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only recompute subjects whose input files changed and merge them into the existing CSV')
+    args = parser.parse_args()
+
+    if dummydata == 1:
+        output_csv = deriv_fldr / 'group_analysis' / "df_motion_metrics_all_dummydata.csv"
+    else:
+        output_csv = deriv_fldr / 'group_analysis' / "df_motion_metrics_all.csv"
+
+    # Subjects whose inputs (or condition order) changed since the last run
+    subjects = list(subjects)
+    manifest = Manifest(manifest_path(output_csv))
+    # Only merge into a previous run whose CSV, trial store and manifest are all there
+    incremental = (args.incremental and output_csv.exists() and manifest.path.exists()
+                   and all(path.exists() for path in trial_store_paths(output_csv)))
+    if args.incremental and not incremental:
+        print("No complete previous run (CSV, trial store and manifest), recomputing all subjects")
+    if incremental:
+        stale_subjects = [subj_id for subj_id in subjects
+                          if not manifest.is_current(subj_id, get_input_files(subj_id), get_condition_sequence(subj_id))]
+        print(f"Recomputing {len(stale_subjects)} of {len(subjects)} subjects")
+    else:
+        stale_subjects = subjects
+
+    # Process each subject, results are merged in subject order
+    results = []
+    trials = []
+    for subject_results, subject_trials in map_subjects(process_subject, stale_subjects, args.jobs):
+        results.extend(subject_results)
+        trials.extend(subject_trials)
+
+    # Save to CSV
+    df = pd.concat(results, ignore_index=True) if results else pd.DataFrame()
+
+    # Merge the new rows with the rows of unchanged subjects from the previous run
+    if incremental:
+        old_trials = load_trials(output_csv)
+        df, source = merge_rows(pd.read_csv(output_csv, dtype={'subject': str}), df, subjects, stale_subjects)
+        trials = [np.array(old_trials[i]) if i < len(old_trials) else trials[i - len(old_trials)] for i in source]
+
+    # Ensure the output directory exists
+    (deriv_fldr / 'group_analysis').mkdir(parents=True, exist_ok=True)
+
+    # Trial time series go to the binary trial store, aligned with the CSV rows
+    df.to_csv(output_csv, index=False)
+    save_trials(output_csv, trials)
+    print(f"Metrics saved to {output_csv.name}")
+
+    for subj_id in stale_subjects:
+        manifest.update(subj_id, get_input_files(subj_id), get_condition_sequence(subj_id))
+    manifest.save()
@@ -1,34 +1,45 @@
+import argparse
 import pandas as pd
-import matplotlib.pyplot as plt
 import numpy as np
-from scipy.stats import ttest_ind, shapiro, levene, mannwhitneyu
+from test_selection import select_and_test
 from statsmodels.stats.multitest import fdrcorrection
 from pathlib import Path
-from scipy.stats import gaussian_kde
-import matplotlib.patheffects as path_effects
+from kde import binned_kde
+from histogram_plots import histogram_job, render_histograms
+
+parser = argparse.ArgumentParser(description='Plot the motion metric distributions and test MinMo < NoMinMo.')
+parser.add_argument('--jobs', type=int, default=1, help='number of processes rendering the histograms')
+parser.add_argument('--preview', action='store_true', help='render the histograms at low dpi for a quick check')
+args = parser.parse_args()
 
 # Paths
 root_fldr = Path('/egor2/egor/MinMo_movements/activemotion_study')
 deriv_fldr = Path(root_fldr / 'derivatives' / 'group_analysis')
 stim_fldr = Path(root_fldr / 'stimuli')
 
-# Read data
-df_mot_metrics = pd.read_csv(deriv_fldr / 'df_motion_metrics_all.csv')
+# Read data (label columns as categoricals)
+df_mot_metrics = pd.read_csv(deriv_fldr / 'df_motion_metrics_all.csv',
+                             dtype={'subject': 'category', 'condition': 'category', 'movement': 'category',
+                                    'metric': 'category'})
+
+# Partition the rows by metric and condition once
+metric_groups = df_mot_metrics.groupby(['metric', 'condition'], observed=True)
 
 # Metrics to analyze
 metrics_to_analyze = ['mm', 'mm_delt', 'enorm', 'outliers', 'roll', 'pitch', 'yaw', 'dS', 'dL', 'dP']
 
 # Initialize a results list for descriptive statistics and p-values
 descriptive_results = []
-p_values = []
+test_pairs = []
+histogram_jobs = []
 
 # Loop through each metric
 for metric in metrics_to_analyze:
     print(f"\n--- Analyzing Metric: {metric} ---\n")
 
-    # Separate data by condition and metric
-    nominmo_data = df_mot_metrics[(df_mot_metrics['condition'] == 'NoMinMo') & (df_mot_metrics['metric'] == metric)]
-    minmo_data = df_mot_metrics[(df_mot_metrics['condition'] == 'MinMo') & (df_mot_metrics['metric'] == metric)]
+    # Rows of the metric in each condition
+    nominmo_data = metric_groups.get_group((metric, 'NoMinMo'))
+    minmo_data = metric_groups.get_group((metric, 'MinMo'))
 
     for statistic in ['max', 'min', 'avg']:
         # Extract statistic
@@ -43,102 +54,54 @@ for metric in metrics_to_analyze:
         # Shared binning
         combined_series = pd.concat([nominmo_series, minmo_series])
         bin_edges = np.arange(combined_series.min(), combined_series.max() + 0.1, 0.1)
-        bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
-        bar_width = (bin_edges[1] - bin_edges[0]) * 0.4
 
         # Compute histogram counts
         nominmo_counts, _ = np.histogram(nominmo_series, bins=bin_edges)
         minmo_counts, _ = np.histogram(minmo_series, bins=bin_edges)
 
-        # --------- Save Overlapped Histogram ---------
-        plt.figure(figsize=(10, 6))
-        plt.hist(nominmo_series, bins=bin_edges, alpha=0.6, color='blue', label='NoMinMo', edgecolor='black')
-        plt.hist(minmo_series, bins=bin_edges, alpha=0.6, color='orange', label='MinMo', edgecolor='black')
-        plt.title(f'Distribution of {statistic} for {metric}')
+        # Label of the x axis
         if metric in ['mm', 'mm_delt', 'dS', 'dL', 'dP', 'enorm']:
-            plt.xlabel('Millimetres')
+            xlabel = 'Millimetres'
         elif metric in ['roll', 'pitch', 'yaw']:
-            plt.xlabel('Degrees')
+            xlabel = 'Degrees'
         elif metric in ['outliers']:
-            plt.xlabel('Percentages')
+            xlabel = 'Percentages'
 
-        plt.ylabel('Count')
-        plt.legend()
-        plt.grid(True)
-
-        # KDE smoothing
-        kde_nominmo = gaussian_kde(nominmo_series)
-        kde_minmo = gaussian_kde(minmo_series)
-        x_vals = np.linspace(bin_edges.min(), bin_edges.max(), 1000)
+        # KDE smoothing on the histogram grid (scaled to counts)
         bin_width = bin_edges[1] - bin_edges[0]
-        plt.plot(x_vals, kde_nominmo(x_vals) * len(nominmo_series) * bin_width, color='blue', lw=2, path_effects=[path_effects.withStroke(linewidth=3, foreground='black')])
-        plt.plot(x_vals, kde_minmo(x_vals) * len(minmo_series) * bin_width, color='orange', lw=2, path_effects=[path_effects.withStroke(linewidth=3, foreground='black')])
+        kde_curves = []
+        for series in (nominmo_series, minmo_series):
+            x_vals, density = binned_kde(series, bin_edges)
+            kde_curves.append((x_vals, density * len(series) * bin_width))
 
-        # Save the plot
+        # --------- Overlapped Histogram ---------
         plot_output_path = deriv_fldr / f'plots_movements/distribution_{metric}_{statistic}_nominmo_vs_minmo.png'
-        plot_output_path.parent.mkdir(parents=True, exist_ok=True)
-        plt.savefig(plot_output_path, dpi=300, bbox_inches='tight')
-        plt.close()
-        print(f"Overlapped plot saved to {plot_output_path}")
-
-        # --------- Save Grouped Histogram ---------
-        plt.figure(figsize=(10, 6))
-        plt.bar(bin_centers - bar_width / 2, nominmo_counts, width=bar_width, color='blue', label='NoMinMo')
-        plt.bar(bin_centers + bar_width / 2, minmo_counts, width=bar_width, color='orange', label='MinMo')
+        histogram_jobs.append(histogram_job(
+            'overlap', bin_edges, [nominmo_counts, minmo_counts], ['NoMinMo', 'MinMo'], plot_output_path,
+            alpha=0.6, edgecolor='black', curves=kde_curves,
+            title=f'Distribution of {statistic} for {metric}', xlabel=xlabel,
+            message=f"Overlapped plot saved to {plot_output_path}"))
+
+        # --------- Grouped Histogram ---------
         if statistic == 'avg':
             statistic_name = 'averages'
         else:
             statistic_name = statistic
-        plt.title(f'Distribution of {statistic_name} for {metric} metric', fontsize=24)
-        if metric in ['mm', 'mm_delt', 'dS', 'dL', 'dP', 'enorm']:
-            plt.xlabel('Millimetres', fontsize=18)
-        elif metric in ['roll', 'pitch', 'yaw']:
-            plt.xlabel('Degrees', fontsize=18)
-        elif metric in ['outliers']:
-            plt.xlabel('Percentages', fontsize=18)
-        plt.ylabel('Count', fontsize=18)
-        plt.xticks(fontsize=18)
-        plt.yticks(fontsize=18)
-        plt.legend(fontsize=18)
-        plt.grid(True)
-
-        # Same KDE overlay for grouped
-        #plt.plot(x_vals, kde_nominmo(x_vals) * len(nominmo_series) * bin_width, color='blue', lw=2, path_effects=[path_effects.withStroke(linewidth=3, foreground='black')])
-        #plt.plot(x_vals, kde_minmo(x_vals) * len(minmo_series) * bin_width, color='orange', lw=2, path_effects=[path_effects.withStroke(linewidth=3, foreground='black')])
-
-        # Line connecting peaks of bars
-        plt.plot(bin_centers, nominmo_counts, color='blue', lw=2, path_effects=[path_effects.withStroke(linewidth=3, foreground='black')], label='NoMinMo')
-        plt.plot(bin_centers, minmo_counts, color='orange', lw=2, path_effects=[path_effects.withStroke(linewidth=3, foreground='black')], label='MinMo')
-
         plot_output_path = deriv_fldr / f'plots_movements_grouped/distribution_{metric}_{statistic}_grouped.png'
-        plot_output_path.parent.mkdir(parents=True, exist_ok=True)
-        plt.savefig(plot_output_path, dpi=300, bbox_inches='tight')
-        plt.close()
-        print(f"Grouped bar plot saved to {plot_output_path}")
+        histogram_jobs.append(histogram_job(
+            'grouped', bin_edges, [nominmo_counts, minmo_counts], ['NoMinMo', 'MinMo'], plot_output_path,
+            peak_lines=True, title=f'Distribution of {statistic_name} for {metric} metric', xlabel=xlabel,
+            title_fontsize=24, label_fontsize=18, tick_fontsize=18, legend_fontsize=18,
+            message=f"Grouped bar plot saved to {plot_output_path}"))
 
         if metric in ['enorm', 'mm_delt', 'outliers']:
-            # Plot histograms
-            plt.figure(figsize=(10, 6))
-            plt.hist(np.log1p(nominmo_series), bins=60, alpha=0.6, color='blue', label='NoMinMo', edgecolor='black')
-            plt.hist(np.log1p(minmo_series), bins=60, alpha=0.6, color='orange', label='MinMo', edgecolor='black')
-            plt.title(f'Distribution of {statistic} for {metric}, log transformed')
-            if metric in ['mm', 'mm_delt', 'dS', 'dL', 'dP', 'enorm']:
-                plt.xlabel('Millimetres')
-            elif metric in ['roll', 'pitch', 'yaw']:
-                plt.xlabel('Degrees')
-            elif metric in ['outliers']:
-                plt.xlabel('Percentages')
-
-            plt.ylabel('Count')
-            plt.legend()
-            plt.grid(True)
-
-            # Save the plot
+            # Log-transformed histograms, 60 bins over each condition's own range
+            log_counts, log_edges = zip(*(np.histogram(np.log1p(series), bins=60) for series in (nominmo_series, minmo_series)))
             plot_output_path = deriv_fldr / f'plots_movements/distribution_{metric}_{statistic}_log_transformed_nominmo_vs_minmo.png'
-            plot_output_path.parent.mkdir(parents=True, exist_ok=True)
-            plt.savefig(plot_output_path, dpi=300, bbox_inches='tight')
-            plt.close()
-            print(f"Plot saved to {plot_output_path}")
+            histogram_jobs.append(histogram_job(
+                'overlap', list(log_edges), list(log_counts), ['NoMinMo', 'MinMo'], plot_output_path,
+                alpha=0.6, edgecolor='black', title=f'Distribution of {statistic} for {metric}, log transformed',
+                xlabel=xlabel, message=f"Plot saved to {plot_output_path}"))
 
     # Descriptive statistics
     nominmo_stats = nominmo_series.describe()
@@ -156,25 +119,8 @@ for metric in metrics_to_analyze:
         "max": minmo_series.max()
     }
 
-    # Check normality with the Shapiro-Wilk test
-    shapiro_nominmo = shapiro(nominmo_series)
-    shapiro_minmo = shapiro(minmo_series)
-
-    # Check equality of variances with Levene's test
-    levene_test = levene(nominmo_series, minmo_series)
-
-    # Perform hypothesis test based on assumptions
-    if shapiro_nominmo.pvalue > 0.05 and shapiro_minmo.pvalue > 0.05 and levene_test.pvalue > 0.05:
-        t_test = ttest_ind(minmo_series, nominmo_series, alternative='less')
-        test_name = "One-tailed T-test (MinMo < NoMinMo)"
-        test_pvalue = t_test.pvalue
-    else:
-        u_test = mannwhitneyu(minmo_series, nominmo_series, alternative='less')
-        test_name = "One-tailed Mann-Whitney U (MinMo < NoMinMo)"
-        test_pvalue = u_test.pvalue
-
-    # Append p-value for FDR correction
-    p_values.append(test_pvalue)
+    # Series tested (MinMo < NoMinMo) once all metrics are collected
+    test_pairs.append((minmo_series, nominmo_series))
 
     # Append descriptive statistics and test results
     descriptive_results.append({
@@ -189,16 +135,32 @@ for metric in metrics_to_analyze:
         "MinMo_median": minmo_additional_stats["median"],
         "MinMo_min": minmo_additional_stats["min"],
         "MinMo_max": minmo_additional_stats["max"],
-        "normality_NoMinMo_p": shapiro_nominmo.pvalue,
-        "normality_MinMo_p": shapiro_minmo.pvalue,
-        "levene_p": levene_test.pvalue,
-        "test": test_name,
-        "test_pvalue": test_pvalue,
+        "normality_NoMinMo_p": np.nan,  # Placeholders, filled in by the batched tests
+        "normality_MinMo_p": np.nan,
+        "levene_p": np.nan,
+        "test": None,
+        "test_pvalue": np.nan,
         "significant": False  # Placeholder, will be updated after FDR correction
     })
 
+# Render all histograms in one batch
+render_histograms(histogram_jobs, args.jobs, args.preview)
+
+# Normality (Shapiro-Wilk, D'Agostino beyond 5000 samples) and Levene screening, then the one-tailed
+# T-test or Mann-Whitney U of all metrics in one batch
+test_results = select_and_test(test_pairs)
+for i, test in test_results.iterrows():
+    descriptive_results[i]["normality_NoMinMo_p"] = test["normality_y_p"]
+    descriptive_results[i]["normality_MinMo_p"] = test["normality_x_p"]
+    descriptive_results[i]["levene_p"] = test["levene_p"]
+    if test["parametric"]:
+        descriptive_results[i]["test"] = "One-tailed T-test (MinMo < NoMinMo)"
+    else:
+        descriptive_results[i]["test"] = "One-tailed Mann-Whitney U (MinMo < NoMinMo)"
+    descriptive_results[i]["test_pvalue"] = test["pvalue"]
+
 # Apply FDR correction
-_, corrected_p_values = fdrcorrection(p_values, alpha=0.05)
+_, corrected_p_values = fdrcorrection(test_results["pvalue"], alpha=0.05)
 for i, corrected_p in enumerate(corrected_p_values):
     descriptive_results[i]["corrected_pvalue"] = corrected_p
     descriptive_results[i]["significant"] = corrected_p < 0.05
@@ -1,6 +1,11 @@
+import argparse
 import numpy as np
 import pandas as pd
 from pathlib import Path
+from trial_store import save_trials, load_trials, trial_store_paths
+from parallel import map_subjects
+from manifest import Manifest, manifest_path, merge_rows
+from catalog import load_catalog
 
 # Function to load motion data
 
@@ -21,34 +26,44 @@ def load_motion_data(motion_file, skip_lines=0):
 root_fldr = Path('/data/elevchenko/MinMo_movements/activemotion_study')
 deriv_fldr = Path(root_fldr / 'derivatives')
 
-# Load subject list
-sequence_file = Path(root_fldr / 'Sequences of conditions and runs.csv')
-sequence_df = pd.read_csv(sequence_file)
+# Load subject list (study catalog, cached)
+catalog = load_catalog(root_fldr, deriv_fldr)
 
 dummydata = 0
 
 # Exclude dummy data
 if dummydata == 1:
-    subjects = sequence_df[sequence_df['Subj #'] == 'dummydata_nii']['Subj #']
+    subjects = ['dummydata_nii']
 else:
-    subjects = sequence_df[sequence_df['Subj #'] != 'dummydata_nii']['Subj #']
+    subjects = catalog.subject_ids()
 
-# Results list
-results = []
+conditions = ['MinMo', 'NoMinMo']
 
-# Process each subject and condition
-for subj_id in subjects:
-    for condition in ['MinMo', 'NoMinMo']:
-        cond_folder = Path(deriv_fldr / f'sub-{subj_id}/sub-{subj_id}_task-movies_cond-{condition}/sub-{subj_id}_task-movies_cond-{condition}.results')
+# Function to define the metric files (and header lines to skip) of a subject/condition
+def get_metric_files(subj_id, condition):
+    cond_folder = catalog.results_folder(subj_id, 'movies', condition)
+    return {
+        "enorm": (cond_folder / f"motion_{subj_id}_enorm.1D", 0),
+        "mm": (cond_folder / "mm.r01", 2),  # Skip first 2 lines
+        "mm_delt": (cond_folder / "mm.r01_delt", 2),  # Skip first 2 lines
+        "outliers": (cond_folder / "outcount_rall.1D", 0),
+        "dfile": (cond_folder / "dfile_rall.1D", 0),
+    }
 
+# Function to list every input file the rows of a subject depend on
+def get_input_files(subj_id):
+    return [motion_file for condition in conditions
+            for motion_file, _ in get_metric_files(subj_id, condition).values()]
+
+# Function to extract the metrics of one subject (both conditions)
+def process_subject(subj_id):
+    # Results list (time series are kept aside, one per row, for the binary trial store)
+    results = []
+    trials = []
+
+    for condition in conditions:
         # Define metric files
-        metric_files = {
-            "enorm": (cond_folder / f"motion_{subj_id}_enorm.1D", 0),
-            "mm": (cond_folder / "mm.r01", 2),  # Skip first 2 lines
-            "mm_delt": (cond_folder / "mm.r01_delt", 2),  # Skip first 2 lines
-            "outliers": (cond_folder / "outcount_rall.1D", 0),
-            "dfile": (cond_folder / "dfile_rall.1D", 0),
-        }
+        metric_files = get_metric_files(subj_id, condition)
 
         # Process each metric
         for metric_name, (motion_file, skip_lines) in metric_files.items():
@@ -65,7 +80,6 @@ for subj_id in subjects:
                         "subject": subj_id,
                         "condition": condition,
                         "metric": param,
-                        "trial": motion_data[:, col_idx].tolist(),
                         "N": len(motion_data[:, col_idx]),
                         "avg": avg,
                         "avg_abs": np.mean(np.abs(motion_data[:, col_idx])),
@@ -73,13 +87,13 @@ for subj_id in subjects:
                         "max": np.max(motion_data[:, col_idx]),
                         "min": np.min(motion_data[:, col_idx])
                     })
+                    trials.append(motion_data[:, col_idx])
             else:
                 avg = np.mean(motion_data[:, 0])
                 results.append({
                     "subject": subj_id,
                     "condition": condition,
                     "metric": metric_name,
-                    "trial": motion_data[:, 0].tolist(),
                     "N": len(motion_data[:, 0]),
                     "avg": avg,
                     "avg_abs": np.mean(np.abs(motion_data[:, 0])),
@@ -87,14 +101,59 @@ for subj_id in subjects:
                     "max": np.max(motion_data[:, 0]),
                     "min": np.min(motion_data[:, 0])
                 })
+                trials.append(motion_data[:, 0])
 
-# Save to CSV
-df = pd.DataFrame(results)
-(deriv_fldr / 'group_analysis').mkdir(parents=True, exist_ok=True)
+    return results, trials
 
-if dummydata == 1:
-    df.to_csv(deriv_fldr / 'group_analysis'/ "df_motion_metrics_movies_dummydata.csv", index=False)
-    print("Metrics saved to df_motion_metrics_movies_dummydata.csv")
-else:
-    df.to_csv(deriv_fldr / 'group_analysis' / "df_motion_metrics_movies.csv", index=False)
-    print("Metrics saved to df_motion_metrics_movies.csv")
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Extract movie-watching motion metrics for every subject and condition.')
+    parser.add_argument('--jobs', type=int, default=1, help='number of subjects processed in parallel')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only recompute subjects whose input files changed and merge them into the existing CSV')
+    args = parser.parse_args()
+
+    if dummydata == 1:
+        output_csv = deriv_fldr / 'group_analysis' / "df_motion_metrics_movies_dummydata.csv"
+    else:
+        output_csv = deriv_fldr / 'group_analysis' / "df_motion_metrics_movies.csv"
+
+    # Subjects whose inputs changed since the last run
+    subjects = list(subjects)
+    manifest = Manifest(manifest_path(output_csv))
+    # Only merge into a previous run whose CSV, trial store and manifest are all there
+    incremental = (args.incremental and output_csv.exists() and manifest.path.exists()
+                   and all(path.exists() for path in trial_store_paths(output_csv)))
+    if args.incremental and not incremental:
+        print("No complete previous run (CSV, trial store and manifest), recomputing all subjects")
+    if incremental:
+        stale_subjects = [subj_id for subj_id in subjects
+                          if not manifest.is_current(subj_id, get_input_files(subj_id), conditions)]
+        print(f"Recomputing {len(stale_subjects)} of {len(subjects)} subjects")
+    else:
+        stale_subjects = subjects
+
+    # Process each subject, results are merged in subject order
+    results = []
+    trials = []
+    for subject_results, subject_trials in map_subjects(process_subject, stale_subjects, args.jobs):
+        results.extend(subject_results)
+        trials.extend(subject_trials)
+
+    # Save to CSV
+    df = pd.DataFrame(results)
+    (deriv_fldr / 'group_analysis').mkdir(parents=True, exist_ok=True)
+
+    # Merge the new rows with the rows of unchanged subjects from the previous run
+    if incremental:
+        old_trials = load_trials(output_csv)
+        df, source = merge_rows(pd.read_csv(output_csv, dtype={'subject': str}), df, subjects, stale_subjects)
+        trials = [np.array(old_trials[i]) if i < len(old_trials) else trials[i - len(old_trials)] for i in source]
+
+    # Time series go to the binary trial store, aligned with the CSV rows
+    df.to_csv(output_csv, index=False)
+    save_trials(output_csv, trials)
+    print(f"Metrics saved to {output_csv.name}")
+
+    for subj_id in stale_subjects:
+        manifest.update(subj_id, get_input_files(subj_id), conditions)
+    manifest.save()
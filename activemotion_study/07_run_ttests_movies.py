@@ -1,10 +1,16 @@
+import argparse
 import pandas as pd
-import matplotlib.pyplot as plt
-from scipy.stats import ttest_ind, shapiro, levene, mannwhitneyu, gaussian_kde
 from statsmodels.stats.multitest import fdrcorrection
 from pathlib import Path
 import numpy as np
-import matplotlib.patheffects as path_effects
+from trial_store import load_trials
+from test_selection import select_and_test
+from histogram_plots import histogram_job, render_histograms
+
+parser = argparse.ArgumentParser(description='Plot the movie-watching motion distributions and test MinMo < NoMinMo.')
+parser.add_argument('--jobs', type=int, default=1, help='number of processes rendering the histograms')
+parser.add_argument('--preview', action='store_true', help='render the histograms at low dpi for a quick check')
+args = parser.parse_args()
 
 # Paths
 root_fldr = Path('/egor2/egor/MinMo_movements/activemotion_study')
@@ -14,16 +20,21 @@ dummydata = 0
 
 # Read movie-watching data
 if dummydata == 1:
-    df_mot_metrics = pd.read_csv(deriv_fldr / 'df_motion_metrics_movies_dummydata.csv')
+    metrics_csv = deriv_fldr / 'df_motion_metrics_movies_dummydata.csv'
 else:
-    df_mot_metrics = pd.read_csv(deriv_fldr / 'df_motion_metrics_movies.csv')
+    metrics_csv = deriv_fldr / 'df_motion_metrics_movies.csv'
+df_mot_metrics = pd.read_csv(metrics_csv)
+
+# Memory-mapped time series, one per row of df_mot_metrics
+trial_store = load_trials(metrics_csv)
 
 # Metrics to analyze
 metrics_to_analyze = ['mm', 'mm_delt', 'enorm', 'outliers', 'roll', 'pitch', 'yaw', 'dS', 'dL', 'dP']
 
 # Initialize a results list for descriptive statistics and p-values
 descriptive_results = []
-p_values = []
+test_pairs = []
+histogram_jobs = []
 
 # Loop through each metric
 for metric in metrics_to_analyze:
@@ -33,9 +44,9 @@ for metric in metrics_to_analyze:
     nominmo_data = df_mot_metrics[(df_mot_metrics['condition'] == 'NoMinMo') & (df_mot_metrics['metric'] == metric)]
     minmo_data = df_mot_metrics[(df_mot_metrics['condition'] == 'MinMo') & (df_mot_metrics['metric'] == metric)]
 
-    # Convert stringified lists into actual arrays and concatenate
-    nominmo_series = np.concatenate(nominmo_data['trial'].apply(eval).to_list())
-    minmo_series = np.concatenate(minmo_data['trial'].apply(eval).to_list())
+    # Gather the time series of the selected rows from the trial store
+    nominmo_series = trial_store.concat(nominmo_data.index)
+    minmo_series = trial_store.concat(minmo_data.index)
 
     # Apply absolute value to specific metrics
     if metric in ['dL', 'dP', 'dS', 'roll', 'pitch', 'yaw']:
@@ -46,75 +57,34 @@ for metric in metrics_to_analyze:
     combined_series = np.concatenate([nominmo_series, minmo_series])
     bin_width = 0.1
     bin_edges = np.arange(combined_series.min(), combined_series.max() + bin_width, bin_width)
-    bin_centers = bin_edges[:-1] + bin_width / 2
 
     # Histogram counts
     nominmo_counts, _ = np.histogram(nominmo_series, bins=bin_edges)
     minmo_counts, _ = np.histogram(minmo_series, bins=bin_edges)
 
-    # KDE (optional, not plotted here)
-    kde_nominmo = gaussian_kde(nominmo_series)
-    kde_minmo = gaussian_kde(minmo_series)
-    x_vals = np.linspace(bin_edges.min(), bin_edges.max(), 1000)
-
-    # --------- Save Grouped Histogram ---------
-    plt.figure(figsize=(10, 6))
-    bar_width = bin_width * 0.45
-    plt.bar(bin_centers - bar_width / 2, nominmo_counts, width=bar_width, color='blue', label='NoMinMo')
-    plt.bar(bin_centers + bar_width / 2, minmo_counts, width=bar_width, color='orange', label='MinMo')
-
     # Axis labels based on metric type
     if metric in ['mm', 'mm_delt', 'dS', 'dL', 'dP', 'enorm']:
-        plt.xlabel('Millimetres', fontsize=18)
+        xlabel = 'Millimetres'
     elif metric in ['roll', 'pitch', 'yaw']:
-        plt.xlabel('Degrees', fontsize=18)
+        xlabel = 'Degrees'
     elif metric == 'outliers':
-        plt.xlabel('Percentages', fontsize=18)
+        xlabel = 'Percentages'
     else:
-        plt.xlabel(metric)
-
-    plt.title(f'Distribution of {metric} metric', fontsize=22)
-    plt.ylabel('Count', fontsize=18)
-    plt.xticks(fontsize=18)
-    plt.yticks(fontsize=18)
-    plt.legend(fontsize=18)
-    plt.grid(True)
-
-    # Line connecting peaks of bars
-    plt.plot(bin_centers, nominmo_counts, color='blue', lw=2,
-             path_effects=[path_effects.withStroke(linewidth=3, foreground='black')])
-    plt.plot(bin_centers, minmo_counts, color='orange', lw=2,
-             path_effects=[path_effects.withStroke(linewidth=3, foreground='black')])
-
-    # Save the grouped plot
+        xlabel = metric
+
+    # --------- Grouped Histogram ---------
     if dummydata == 1:
         plot_grouped_path = deriv_fldr / f'plots_movies_dummydata_grouped/distribution_{metric}_grouped.png'
     else:
         plot_grouped_path = deriv_fldr / f'plots_movies_grouped/distribution_{metric}_grouped.png'
-    plot_grouped_path.parent.mkdir(parents=True, exist_ok=True)
-    plt.savefig(plot_grouped_path, dpi=300, bbox_inches='tight')
-    plt.close()
-    print(f"Grouped bar plot saved to {plot_grouped_path}")
-
-    # Normality test (Shapiro-Wilk)
-    shapiro_nominmo = shapiro(nominmo_series)
-    shapiro_minmo = shapiro(minmo_series)
-
-    # Variance equality test (Levene's test)
-    levene_test = levene(nominmo_series, minmo_series)
-
-    # Select appropriate test based on normality and variance
-    if shapiro_nominmo.pvalue > 0.05 and shapiro_minmo.pvalue > 0.05 and levene_test.pvalue > 0.05:
-        t_test = ttest_ind(minmo_series, nominmo_series, alternative='less')
-        test_name = "One-tailed T-test (MinMo < NoMinMo)"
-        test_pvalue = t_test.pvalue
-    else:
-        u_test = mannwhitneyu(minmo_series, nominmo_series, alternative='less')
-        test_name = "One-tailed Mann-Whitney U (MinMo < NoMinMo)"
-        test_pvalue = u_test.pvalue
+    histogram_jobs.append(histogram_job(
+        'grouped', bin_edges, [nominmo_counts, minmo_counts], ['NoMinMo', 'MinMo'], plot_grouped_path,
+        bar_width=0.45, peak_lines=True, title=f'Distribution of {metric} metric', xlabel=xlabel,
+        title_fontsize=22, label_fontsize=18, tick_fontsize=18, legend_fontsize=18,
+        message=f"Grouped bar plot saved to {plot_grouped_path}"))
 
-    # Append p-value for FDR correction
-    p_values.append(test_pvalue)
+    # Series tested (MinMo < NoMinMo) once all metrics are collected
+    test_pairs.append((minmo_series, nominmo_series))
 
     # Append descriptive statistics and test results
     descriptive_results.append({
@@ -129,16 +99,32 @@ for metric in metrics_to_analyze:
         "MinMo_median": np.median(minmo_series),
         "MinMo_min": np.min(minmo_series),
         "MinMo_max": np.max(minmo_series),
-        "normality_NoMinMo_p": shapiro_nominmo.pvalue,
-        "normality_MinMo_p": shapiro_minmo.pvalue,
-        "levene_p": levene_test.pvalue,
-        "test": test_name,
-        "test_pvalue": test_pvalue,
+        "normality_NoMinMo_p": np.nan,  # Placeholders, filled in by the batched tests
+        "normality_MinMo_p": np.nan,
+        "levene_p": np.nan,
+        "test": None,
+        "test_pvalue": np.nan,
         "significant": False  # Placeholder, will be updated after FDR correction
     })
 
+# Render all histograms in one batch
+render_histograms(histogram_jobs, args.jobs, args.preview)
+
+# Normality (Shapiro-Wilk, D'Agostino beyond 5000 samples) and Levene screening, then the one-tailed
+# T-test or Mann-Whitney U of all metrics in one batch
+test_results = select_and_test(test_pairs)
+for i, test in test_results.iterrows():
+    descriptive_results[i]["normality_NoMinMo_p"] = test["normality_y_p"]
+    descriptive_results[i]["normality_MinMo_p"] = test["normality_x_p"]
+    descriptive_results[i]["levene_p"] = test["levene_p"]
+    if test["parametric"]:
+        descriptive_results[i]["test"] = "One-tailed T-test (MinMo < NoMinMo)"
+    else:
+        descriptive_results[i]["test"] = "One-tailed Mann-Whitney U (MinMo < NoMinMo)"
+    descriptive_results[i]["test_pvalue"] = test["pvalue"]
+
 # Apply FDR correction
-_, corrected_p_values = fdrcorrection(p_values, alpha=0.05)
+_, corrected_p_values = fdrcorrection(test_results["pvalue"], alpha=0.05)
 for i, corrected_p in enumerate(corrected_p_values):
     descriptive_results[i]["corrected_pvalue"] = corrected_p
     descriptive_results[i]["significant"] = corrected_p < 0.05
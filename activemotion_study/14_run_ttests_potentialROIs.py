@@ -1,10 +1,12 @@
 from pathlib import Path
 import pandas as pd
 import numpy as np
-from scipy.stats import ttest_1samp
 import statsmodels.stats.multitest as smm
-import re
-from collections import defaultdict
+from roistats import parse_subbrick_labels
+from voxel_store import load_voxels
+from voxel_stats import grouped_ttest_table, ttest_from_moments
+from accumulators import RunningStats
+from catalog import load_catalog
 
 # Define paths
 root = Path("/data/elevchenko/MinMo_movements/activemotion_study")
@@ -12,9 +14,8 @@ derivatives = root / "derivatives"
 group_analysis_dir = derivatives / "group_analysis"
 group_analysis_dir.mkdir(exist_ok=True)
 
-subjects = [folder.name for folder in derivatives.iterdir()
-            if folder.is_dir() and folder.name.startswith("sub-")
-            and folder.name.endswith("_nii") and folder.name != "sub-dummydata_nii"]
+# Subject folders of the derivatives (study catalog, cached)
+subjects = load_catalog(root, derivatives).subject_folders()
 
 # Load ROI labels
 roi_labels_path = root / 'labels_csurfmaps.csv'
@@ -27,11 +28,15 @@ target_rois = ['3b_face', '3b_hand', '3b_foot', '3a_face', '3a_hand', '3a_foot',
 # Match IDs for all ROIs (not just target ones)
 roi_name_to_id = roi_labels.set_index("name")["id"].to_dict()
 
+# ROI id -> name (first match), restricted to the target ROIs
+roi_id_to_name = roi_labels.drop_duplicates("id").set_index("id")["name"]
+target_roi_ids = roi_id_to_name[roi_id_to_name.isin(target_rois)].index.values
+
 # Prepare output dataframe for subject-level
 results_subject_level = []
 
-# For collecting group-level data
-group_voxels = defaultdict(list)
+# For collecting group-level data: count, mean and M2 of the voxels per (hemi, cond, roi, movement)
+group_stats = RunningStats()
 
 # Loop over hemispheres and conditions
 for hemi in ['lh', 'rh']:
@@ -42,83 +47,56 @@ for hemi in ['lh', 'rh']:
             voxel_file = subj_dir / f"voxels_masked_{hemi}_cond-{cond}.csv"
             label_file = subj_dir / f"voxels_labels_{hemi}_cond-{cond}.csv"
 
-            # Load roistats just to extract sub-brick names
+            # Sub-brick names come from the roistats table of the same stats file
             roistats_path = subj_dir / f'roistats_{hemi}_cond-{cond}.csv'
 
-            roistats_df = pd.read_csv(roistats_path, sep='\t')
-            subbrick_names = roistats_df['Sub-brick'].tolist()
-
-            # Filter only sub-brick names with *_overall#0_Coef
-            valid_indices = [i for i, name in enumerate(subbrick_names)
-                             if re.search(r'overall#0_Coef', name)]
-
-            # Load data
-            voxel_data = pd.read_csv(voxel_file, delim_whitespace=True, header=None)
-            label_data = pd.read_csv(label_file, delim_whitespace=True, header=None)
-
-            roi_indices = label_data.iloc[:, -1].values
-            betas = voxel_data.values[:, 3:]
-
-            # For each unique ROI
-            for roi_id in np.unique(roi_indices):
-                roi_name = roi_labels[roi_labels["id"] == roi_id]["name"].values
-                if roi_name.size == 0:
-                    continue
-                roi_name = roi_name[0]
-
-                if roi_name not in target_rois:
-                    continue
-
-                mask = roi_indices == roi_id
-                roi_betas = betas[mask]
-
-                for col_idx in valid_indices:
-                    movement = subbrick_names[col_idx]
-                    betas_1d = roi_betas[:, col_idx]
-
-                    # Subject-level t-test
-                    t_stat, p_val = ttest_1samp(betas_1d, 0, alternative='greater')
-                    results_subject_level.append({
-                        "subject": subj,
-                        "hemi": hemi,
-                        "cond": cond,
-                        "roi_name": roi_name,
-                        "roi_id": roi_id,
-                        "movement": movement,
-                        "t_stat": t_stat,
-                        "p_val": p_val,
-                        "n_voxels": len(betas_1d)
-                    })
-
-                    # Group-level: collect voxels
-                    key = (hemi, cond, roi_name, movement)
-                    group_voxels[key].extend(betas_1d)
+            # Load data (binary voxel store, converted from the text dumps on first use)
+            betas, roi_indices, subbrick_names = load_voxels(voxel_file, label_file, roistats_path)
+            subbrick_names = pd.Series(subbrick_names)
+
+            # Filter only sub-brick names with *_overall#0_Coef (not the *_overall_GLT#0_Coef ones)
+            subbrick_info = parse_subbrick_labels(subbrick_names)
+            valid = (subbrick_info['overall'] & (subbrick_info['glt'] == '') & (subbrick_info['tent'] == 0).fillna(False)
+                     & (subbrick_info['stat'] == 'Coef'))
+            valid_indices = np.flatnonzero(valid.to_numpy(dtype=bool))
+            subbrick_names = subbrick_names.values[valid_indices]
+
+            # Keep the voxels of the target ROIs and the valid sub-bricks
+            in_target = np.isin(roi_indices, target_roi_ids)
+            roi_indices = roi_indices[in_target]
+            roi_betas = betas[in_target][:, valid_indices]
+
+            # Subject-level t-tests of all ROIs x sub-bricks at once
+            df_tests = grouped_ttest_table(roi_betas, roi_indices, subbrick_names, alternative='greater')
+            results_subject_level.append(pd.DataFrame({
+                "subject": subj,
+                "hemi": hemi,
+                "cond": cond,
+                "roi_name": roi_id_to_name.loc[df_tests["label"]].values,
+                "roi_id": df_tests["label"],
+                "movement": df_tests["column"],
+                "t_stat": df_tests["t_stat"],
+                "p_val": df_tests["p_val"],
+                "n_voxels": df_tests["n_voxels"]
+            }))
+
+            # Group-level: merge the voxel statistics of this subject
+            for roi_id, movement, n_voxels, mean, m2 in df_tests[["label", "column", "n_voxels", "mean", "m2"]].itertuples(index=False):
+                group_stats.add_moments((hemi, cond, roi_id_to_name[roi_id], movement), n_voxels, mean, m2)
 
 # Create subject-level results DataFrame
-df_subject = pd.DataFrame(results_subject_level)
+df_subject = pd.concat(results_subject_level, ignore_index=True)
 df_subject["p_fdr"] = smm.multipletests(df_subject["p_val"], method="fdr_bh")[1]
 df_subject["significant"] = df_subject["p_fdr"] < 0.1
 df_subject.to_csv(group_analysis_dir / "df_potentialROIs_subject_level_ttests.csv", index=False)
 
 
-# Group-level t-tests
-group_results = []
-for (hemi, cond, roi_name, movement), values in group_voxels.items():
-    values = np.array(values)
-    if len(values) < 3:
-        continue
-    t_stat, p_val = ttest_1samp(values, 0, alternative='greater')
-    group_results.append({
-        "hemi": hemi,
-        "cond": cond,
-        "roi_name": roi_name,
-        "movement": movement,
-        "t_stat": t_stat,
-        "p_val": p_val,
-        "n_voxels": len(values)
-    })
-
-df_group = pd.DataFrame(group_results)
+# Group-level t-tests from the pooled voxel statistics
+df_group = group_stats.to_frame(["hemi", "cond", "roi_name", "movement"])
+df_group = df_group[df_group["count"] >= 3].rename(columns={"count": "n_voxels"})
+df_group["t_stat"], df_group["p_val"] = ttest_from_moments(df_group["n_voxels"].values, df_group["mean"].values,
+                                                           df_group["m2"].values, alternative='greater')
+df_group = df_group[["hemi", "cond", "roi_name", "movement", "t_stat", "p_val", "n_voxels"]].reset_index(drop=True)
 df_group["p_fdr"] = smm.multipletests(df_group["p_val"], method="fdr_bh")[1]
 df_group["significant"] = df_group["p_fdr"] < 0.1
 df_group.to_csv(group_analysis_dir / "df_potentialROIs_group_level_ttests.csv", index=False)
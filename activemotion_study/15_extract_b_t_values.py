@@ -1,5 +1,9 @@
+import argparse
 from pathlib import Path
 import pandas as pd
+from manifest import Manifest, manifest_path, merge_rows
+from roistats import read_roistats
+from catalog import load_catalog
 
 # Paths
 root_fldr = Path('/egor2/egor/MinMo_movements/activemotion_study')
@@ -18,9 +22,7 @@ conditions = ["MinMo", "NoMinMo"]
 hemis = ["lh", "rh"]
 
 # Load subjects
-subjects = sorted([folder.name for folder in deriv_fldr.iterdir()
-            if folder.is_dir() and folder.name.startswith("sub-")
-            and folder.name.endswith("_nii") and folder.name != "sub-dummydata_nii"])
+subjects = load_catalog(root_fldr, deriv_fldr).subject_folders()
 
 # Load ROI labels
 roi_labels = pd.read_csv(root_fldr / "labels_csurfmaps.csv")
@@ -43,64 +45,87 @@ movement_roi_map = {
     "raiserighthip": ['3b_foot', '3a_foot', '1_foot', '4_foot'],
 }
 
-# Collect all beta and t-values
-df_b_t_values_rois = pd.DataFrame()
+# Function to get the ROI stats files of a subject
+def get_stats_files(subject):
+    return [deriv_fldr / subject / f'{subject}_task-mvts_cond-{cond}' / f'{subject}_task-mvts_cond-{cond}.results' /
+            f'roistats_{hemi}_cond-{cond}.csv' for cond in conditions for hemi in hemis]
+
+# Function to collect the beta and t-values of one subject
+def extract_subject(subject):
+    subject_rows = []
 
-for subject in subjects:
     print(f'{subject} processing...')
     for cond in conditions:
+        # Read the ROI stats of each hemisphere once
+        hemi_stats = {}
+        for hemi in hemis:
+            stats_file = (deriv_fldr / subject / f'{subject}_task-mvts_cond-{cond}' /
+                          f'{subject}_task-mvts_cond-{cond}.results' / f'roistats_{hemi}_cond-{cond}.csv')
+
+            if not stats_file.exists():
+                print(f"Missing file: {stats_file}")
+                continue
+
+            roistats = read_roistats(stats_file)
+            rename_dict = {roi_map[roi]: roi for roi in rois if roi_map[roi] in roistats.columns}
+            hemi_stats[hemi] = roistats.rename(columns=rename_dict)
+
         for movement in movements:
-            for hemi in hemis:
-                subj_fldr = (deriv_fldr / subject / f'{subject}_task-mvts_cond-{cond}' /
-                             f'{subject}_task-mvts_cond-{cond}.results')
-
-                stats_file = subj_fldr / f'roistats_{hemi}_cond-{cond}.csv'
-
-                if not stats_file.exists():
-                    print(f"Missing file: {stats_file}")
-                    continue
-
-                roistats = pd.read_csv(stats_file, delimiter="\t")
-                roistats.columns = roistats.columns.str.strip()
-
-                selected_columns = ['File', 'Sub-brick'] + [col for col in roi_map.values() if col in roistats.columns]
-                roistats_targetrois = roistats[selected_columns]
-
-                rename_dict = {roi_map[roi]: roi for roi in rois if roi_map[roi] in roistats.columns}
-                roistats_targetrois = roistats_targetrois.rename(columns=rename_dict)
-
-                # Match betas
-                beta_rows = roistats_targetrois[roistats_targetrois['Sub-brick'].str.contains(fr".*{movement}.*overall.*Coef.*", regex=True, na=False)]
-                # Match t-values
-                tval_rows = roistats_targetrois[roistats_targetrois['Sub-brick'].str.contains(fr".*{movement}.*overall.*Tstat.*", regex=True, na=False)]
-
-                if not beta_rows.empty:
-                    for _, row in beta_rows.iterrows():
-                        for roi in movement_roi_map[movement]:
-                            if roi in row:
-                                beta_value = row[roi]
-                                t_value = None
-
-                                # Try to match a corresponding t-value row (assuming same ROI column and same order)
-                                if not tval_rows.empty:
-                                    t_row = tval_rows.iloc[0]  # assuming 1-to-1 match
-                                    if roi in t_row:
-                                        t_value = t_row[roi]
-
-                                df_b_t_values_rois = pd.concat([
-                                    df_b_t_values_rois,
-                                    pd.DataFrame([{
-                                        "subject": subject,
-                                        "condition": cond,
-                                        "movement": movement,
-                                        "hemi": hemi,
-                                        "ROI": roi,
-                                        "beta_coef": beta_value,
-                                        "t_value": t_value
-                                    }])
-                                ], ignore_index=True)
+            for hemi, roistats in hemi_stats.items():
+                # Overall (GLT) betas and t-values of this movement
+                overall_rows = roistats[(roistats['movement'] == movement) & roistats['overall']]
+                beta_rows = overall_rows[overall_rows['stat'] == 'Coef']
+                tval_rows = overall_rows[overall_rows['stat'] == 'Tstat']
+                target_rois = [roi for roi in movement_roi_map[movement] if roi in roistats.columns]
+
+                for _, row in beta_rows.iterrows():
+                    for roi in target_rois:
+                        # Corresponding t-value row (assuming same ROI column and 1-to-1 match)
+                        t_value = tval_rows[roi].iloc[0] if not tval_rows.empty else None
+
+                        subject_rows.append({
+                            "subject": subject,
+                            "condition": cond,
+                            "movement": movement,
+                            "hemi": hemi,
+                            "ROI": roi,
+                            "beta_coef": row[roi],
+                            "t_value": t_value
+                        })
+
+    return subject_rows
+
+parser = argparse.ArgumentParser(description='Collect beta and t-values of the selected ROIs for every subject.')
+parser.add_argument('--incremental', action='store_true',
+                    help='only recompute subjects whose ROI stats changed and merge them into the existing CSV')
+args = parser.parse_args()
 
-# Save results
 output_fname = 'df_b_t_values_selectedROIs.csv'
-df_b_t_values_rois.to_csv(group_analysis_dir / output_fname, index=False)
+output_csv = group_analysis_dir / output_fname
+
+# Subjects whose ROI stats changed since the last run
+manifest = Manifest(manifest_path(output_csv))
+incremental = args.incremental and output_csv.exists()
+if incremental:
+    stale_subjects = [subject for subject in subjects if not manifest.is_current(subject, get_stats_files(subject))]
+    print(f"Recomputing {len(stale_subjects)} of {len(subjects)} subjects")
+else:
+    stale_subjects = subjects
+
+# Collect all beta and t-values
+records = []
+for subject in stale_subjects:
+    records.extend(extract_subject(subject))
+df_b_t_values_rois = pd.DataFrame(records)
+
+# Merge the new rows with the rows of unchanged subjects from the previous run
+if incremental:
+    df_b_t_values_rois, _ = merge_rows(pd.read_csv(output_csv), df_b_t_values_rois, subjects, stale_subjects)
+
+# Save results
+df_b_t_values_rois.to_csv(output_csv, index=False)
 print(f'The file {output_fname} was saved')
+
+for subject in stale_subjects:
+    manifest.update(subject, get_stats_files(subject))
+manifest.save()
@@ -1,8 +1,14 @@
-import matplotlib.pyplot as plt
+import argparse
 from pathlib import Path
 import pandas as pd
 import numpy as np
-from scipy.stats import gaussian_kde
+from kde import binned_kde
+from histogram_plots import histogram_job, render_histograms
+
+parser = argparse.ArgumentParser(description='Plot the ROI beta coefficient and t-value histograms.')
+parser.add_argument('--jobs', type=int, default=1, help='number of processes rendering the histograms')
+parser.add_argument('--preview', action='store_true', help='render the histograms at low dpi for a quick check')
+args = parser.parse_args()
 
 # Define paths
 root_fldr = Path('/egor2/egor/MinMo_movements/activemotion_study')
@@ -14,63 +20,53 @@ fig_dir_betas.mkdir(parents=True, exist_ok=True)
 fig_dir_tvals.mkdir(parents=True, exist_ok=True)
 
 # Load extracted data
-df = pd.read_csv(group_analysis_dir / 'df_b_t_values_selectedROIs.csv')
-
-# Define plotting function
-def plot_histograms(df, value_col, out_dir, label):
-    for movement in df["movement"].unique():
-        for roi in df["ROI"].unique():
-            for hemi in df["hemi"].unique():
-                # Filter data
-                data_minmo = df[
-                    (df["movement"] == movement) &
-                    (df["condition"] == "MinMo") &
-                    (df["ROI"] == roi) &
-                    (df["hemi"] == hemi)
-                ][value_col].replace([np.inf, -np.inf], np.nan).dropna()
+df = pd.read_csv(group_analysis_dir / 'df_b_t_values_selectedROIs.csv',
+                 dtype={'subject': 'category', 'condition': 'category', 'movement': 'category',
+                        'ROI': 'category', 'hemi': 'category'})
 
-                data_nominmo = df[
-                    (df["movement"] == movement) &
-                    (df["condition"] == "NoMinMo") &
-                    (df["ROI"] == roi) &
-                    (df["hemi"] == hemi)
-                ][value_col].replace([np.inf, -np.inf], np.nan).dropna()
+# Function to describe the histograms of one value column as figure jobs
+def histogram_jobs(df, value_col, out_dir, label):
+    jobs = []
 
-                if data_minmo.empty and data_nominmo.empty:
-                    continue
+    # Finite values of every movement x ROI x hemi x condition, from one pass over the frame
+    values = df[value_col].replace([np.inf, -np.inf], np.nan)
+    groups = {key: group.dropna().to_numpy()
+              for key, group in values.groupby([df["movement"], df["ROI"], df["hemi"], df["condition"]], observed=True)}
+    empty = np.empty(0)
 
-                combined_series = pd.concat([data_nominmo, data_minmo])
-                bin_edges = np.arange(combined_series.min(), combined_series.max() + 0.5, 0.5)
+    for movement, roi, hemi in dict.fromkeys(key[:3] for key in groups):
+        data_minmo = groups.get((movement, roi, hemi, "MinMo"), empty)
+        data_nominmo = groups.get((movement, roi, hemi, "NoMinMo"), empty)
 
-                # Plot histograms
-                plt.figure(figsize=(10, 6))
-                plt.hist(data_nominmo, bins=bin_edges, alpha=0.6, color='blue', label='NoMinMo', edgecolor='black')
-                plt.hist(data_minmo, bins=bin_edges, alpha=0.6, color='orange', label='MinMo', edgecolor='black')
+        if data_minmo.size == 0 and data_nominmo.size == 0:
+            continue
 
-                # KDE smoothing
-                x_vals = np.linspace(bin_edges.min(), bin_edges.max(), 1000)
-                if len(data_nominmo) > 1:
-                    kde_nominmo = gaussian_kde(data_nominmo)
-                    plt.plot(x_vals, kde_nominmo(x_vals) * len(data_nominmo) * (bin_edges[1] - bin_edges[0]),
-                             color='blue', lw=2)
+        combined_series = np.concatenate([data_nominmo, data_minmo])
+        bin_edges = np.arange(combined_series.min(), combined_series.max() + 0.5, 0.5)
 
-                if len(data_minmo) > 1:
-                    kde_minmo = gaussian_kde(data_minmo)
-                    plt.plot(x_vals, kde_minmo(x_vals) * len(data_minmo) * (bin_edges[1] - bin_edges[0]),
-                             color='orange', lw=2)
+        # Histogram counts
+        nominmo_counts, _ = np.histogram(data_nominmo, bins=bin_edges)
+        minmo_counts, _ = np.histogram(data_minmo, bins=bin_edges)
 
-                plt.title(f"{label}: {movement} | ROI: {roi} | {hemi}")
-                plt.xlabel(label)
-                plt.ylabel("Count")
-                plt.legend()
-                plt.tight_layout()
+        # KDE smoothing on the histogram grid
+        kde_curves = []
+        for data in (data_nominmo, data_minmo):
+            if len(data) > 1:
+                x_vals, density = binned_kde(data, bin_edges)
+                kde_curves.append((x_vals, density * len(data) * (bin_edges[1] - bin_edges[0])))
+            else:
+                kde_curves.append(None)
 
-                outname = f"histogram_{label}_{movement}_{roi}_{hemi}.png".replace("/", "-")
-                plt.savefig(out_dir / outname, dpi=300)
-                plt.close()
+        outname = f"histogram_{label}_{movement}_{roi}_{hemi}.png".replace("/", "-")
+        jobs.append(histogram_job(
+            'overlap', bin_edges, [nominmo_counts, minmo_counts], ['NoMinMo', 'MinMo'], out_dir / outname,
+            alpha=0.6, edgecolor='black', curves=kde_curves, curve_stroke=False,
+            title=f"{label}: {movement} | ROI: {roi} | {hemi}", xlabel=label,
+            grid=False, tight_layout=True, bbox_inches=None))
+    return jobs
 
 # Run plotting for both beta values and t-values
-plot_histograms(df, 'beta_coef', fig_dir_betas, 'Beta Coefficient')
-plot_histograms(df, 't_value', fig_dir_tvals, 'T-Value')
+jobs = histogram_jobs(df, 'beta_coef', fig_dir_betas, 'Beta Coefficient') + histogram_jobs(df, 't_value', fig_dir_tvals, 'T-Value')
+render_histograms(jobs, args.jobs, args.preview)
 
 print("All histograms saved for beta coefficients and t-values.")
\ No newline at end of file
@@ -1,5 +1,9 @@
+import argparse
 from pathlib import Path
 import pandas as pd
+from manifest import Manifest, manifest_path, merge_rows
+from roistats import read_roistats
+from catalog import load_catalog
 
 # Paths
 root_fldr = Path('/egor2/egor/MinMo_movements/activemotion_study')
@@ -17,14 +21,17 @@ movements = [
 conditions = ["MinMo", "NoMinMo"]
 
 # Load subjects
-subjects = sorted([folder.name for folder in deriv_fldr.iterdir()
-            if folder.is_dir() and folder.name.startswith("sub-")
-            and folder.name.endswith("_nii") and folder.name != "sub-dummydata_nii"])
+subjects = load_catalog(root_fldr, deriv_fldr).subject_folders()
 
-# Initialize output
-df_fvalues = pd.DataFrame()
+# Function to get the ROI stats files of a subject
+def get_stats_files(subject):
+    return [deriv_fldr / subject / f"{subject}_task-mvts_cond-{cond}" /
+            f"{subject}_task-mvts_cond-{cond}.results" / f"roistats_cond-{cond}_outter.csv" for cond in conditions]
+
+# Function to collect the F-values of one subject
+def extract_subject(subject):
+    subject_rows = []
 
-for subject in subjects:
     print(f'{subject} processing...')
     for cond in conditions:
         stats_file = deriv_fldr / subject / f"{subject}_task-mvts_cond-{cond}" / \
@@ -34,39 +41,65 @@ for subject in subjects:
             print(f"Missing file: {stats_file}")
             continue
 
-        roistats = pd.read_csv(stats_file, delimiter="\t")
-        roistats.columns = roistats.columns.str.strip()
+        roistats = read_roistats(stats_file)
+        fstats = roistats[roistats['stat'] == 'Fstat']
 
         # Extract Full_Fstat (row 0)
-        f_row_full = roistats[roistats['Sub-brick'].str.contains(r"\[Full_Fstat\]", na=False)]
+        f_row_full = fstats[fstats['movement'] == 'Full']
         if not f_row_full.empty:
-            df_fvalues = pd.concat([
-                df_fvalues,
-                pd.DataFrame([{
+            subject_rows.append({
+                "subject": subject,
+                "condition": cond,
+                "movement": "ALL",
+                "ROI": "outside_brain",
+                "f_value": f_row_full["Mean_1"].values[0]
+            })
+
+        # Extract movement-wise Fstats (first one of each movement, the stimulus F comes before the GLT F)
+        movement_fvalues = fstats.drop_duplicates('movement').set_index('movement')["Mean_1"]
+        for movement in movements:
+            if movement in movement_fvalues.index:
+                subject_rows.append({
                     "subject": subject,
                     "condition": cond,
-                    "movement": "ALL",
+                    "movement": movement,
                     "ROI": "outside_brain",
-                    "f_value": f_row_full["Mean_1"].values[0]
-                }])
-            ], ignore_index=True)
+                    "f_value": movement_fvalues[movement]
+                })
 
-        # Extract movement-wise Fstats
-        for movement in movements:
-            f_row = roistats[roistats['Sub-brick'].str.contains(fr"{movement}.*Fstat", regex=True, na=False)]
-            if not f_row.empty:
-                df_fvalues = pd.concat([
-                    df_fvalues,
-                    pd.DataFrame([{
-                        "subject": subject,
-                        "condition": cond,
-                        "movement": movement,
-                        "ROI": "outside_brain",
-                        "f_value": f_row["Mean_1"].values[0]
-                    }])
-                ], ignore_index=True)
+    return subject_rows
+
+parser = argparse.ArgumentParser(description='Collect outside-brain F-values for every subject.')
+parser.add_argument('--incremental', action='store_true',
+                    help='only recompute subjects whose ROI stats changed and merge them into the existing CSV')
+args = parser.parse_args()
 
-# Save results
 output_fname = 'df_f_values_outsidebrain.csv'
-df_fvalues.to_csv(group_analysis_dir / output_fname, index=False)
+output_csv = group_analysis_dir / output_fname
+
+# Subjects whose ROI stats changed since the last run
+manifest = Manifest(manifest_path(output_csv))
+incremental = args.incremental and output_csv.exists()
+if incremental:
+    stale_subjects = [subject for subject in subjects if not manifest.is_current(subject, get_stats_files(subject))]
+    print(f"Recomputing {len(stale_subjects)} of {len(subjects)} subjects")
+else:
+    stale_subjects = subjects
+
+# Initialize output
+records = []
+for subject in stale_subjects:
+    records.extend(extract_subject(subject))
+df_fvalues = pd.DataFrame(records)
+
+# Merge the new rows with the rows of unchanged subjects from the previous run
+if incremental:
+    df_fvalues, _ = merge_rows(pd.read_csv(output_csv), df_fvalues, subjects, stale_subjects)
+
+# Save results
+df_fvalues.to_csv(output_csv, index=False)
 print(f'The file {output_fname} was saved')
+
+for subject in stale_subjects:
+    manifest.update(subject, get_stats_files(subject))
+manifest.save()
@@ -1,9 +1,15 @@
+import argparse
 import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import numpy as np
-import matplotlib.patheffects as path_effects
 from pathlib import Path
+from histogram_plots import histogram_job, render_histograms
+
+parser = argparse.ArgumentParser(description='Plot the F-value distributions outside the brain.')
+parser.add_argument('--jobs', type=int, default=1, help='number of processes rendering the histograms')
+parser.add_argument('--preview', action='store_true', help='render the figures at low dpi for a quick check')
+args = parser.parse_args()
 
 # Define paths
 root_fldr = Path('/egor2/egor/MinMo_movements/activemotion_study')
@@ -16,6 +22,7 @@ fig_dir_violin.mkdir(parents=True, exist_ok=True)
 
 # Load data
 df = pd.read_csv(deriv_fldr / 'df_f_values_outsidebrain.csv')
+histogram_jobs = []
 
 # Loop through each movement (including "ALL")
 for movement in sorted(df["movement"].unique()):
@@ -30,32 +37,17 @@ for movement in sorted(df["movement"].unique()):
     # Shared binning
     combined = pd.concat([data_nominmo, data_minmo])
     bin_edges = np.arange(combined.min(), combined.max() + 0.5, 0.5)
-    bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
-    bar_width = (bin_edges[1] - bin_edges[0]) * 0.4
 
     # Histogram counts
     counts_nominmo, _ = np.histogram(data_nominmo, bins=bin_edges)
     counts_minmo, _ = np.histogram(data_minmo, bins=bin_edges)
 
     # Grouped bar plot
-    plt.figure(figsize=(10, 6))
-    plt.bar(bin_centers - bar_width / 2, counts_nominmo, width=bar_width, color='blue', label='NoMinMo')
-    plt.bar(bin_centers + bar_width / 2, counts_minmo, width=bar_width, color='orange', label='MinMo')
-
-    plt.plot(bin_centers, counts_nominmo, color='blue', lw=2,
-             path_effects=[path_effects.withStroke(linewidth=3, foreground='black')])
-    plt.plot(bin_centers, counts_minmo, color='orange', lw=2,
-             path_effects=[path_effects.withStroke(linewidth=3, foreground='black')])
-
-    plt.title(f'Distribution of F-values for {movement}')
-    plt.xlabel('F-statistic')
-    plt.ylabel('Count')
-    plt.legend()
-    plt.grid(True)
-    plt.tight_layout()
-    plt.savefig(fig_dir_grouped / f'grouped_fstats_{movement}.png', dpi=300, bbox_inches='tight')
-    plt.close()
-    print(f"Saved grouped bar plot: {fig_dir_grouped / f'grouped_fstats_{movement}.png'}")
+    grouped_path = fig_dir_grouped / f'grouped_fstats_{movement}.png'
+    histogram_jobs.append(histogram_job(
+        'grouped', bin_edges, [counts_nominmo, counts_minmo], ['NoMinMo', 'MinMo'], grouped_path,
+        peak_lines=True, title=f'Distribution of F-values for {movement}', xlabel='F-statistic', tight_layout=True,
+        message=f"Saved grouped bar plot: {grouped_path}"))
 
     # Violin + strip plot
     subset = df[df["movement"] == movement]
@@ -68,6 +60,9 @@ for movement in sorted(df["movement"].unique()):
     plt.xlabel("")
     plt.grid(True)
     plt.tight_layout()
-    plt.savefig(fig_dir_violin / f"violin_fstats_{movement}.png", dpi=300)
+    plt.savefig(fig_dir_violin / f"violin_fstats_{movement}.png", dpi=72 if args.preview else 300)
     plt.close()
     print(f"Saved violin plot: {fig_dir_violin / f'violin_fstats_{movement}.png'}")
+
+# Render all grouped histograms in one batch
+render_histograms(histogram_jobs, args.jobs, args.preview)
@@ -1,10 +1,13 @@
+import argparse
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
-import matplotlib.patheffects as path_effects
 from pathlib import Path
-import re
+from histogram_plots import histogram_job, render_histograms
+from manifest import Manifest, manifest_path, merge_rows
+from roistats import read_roistats
+from catalog import load_catalog
 
 # === Setup ===
 root_fldr = Path('/egor2/egor/MinMo_movements/activemotion_study')
@@ -27,16 +30,17 @@ movements = [
 ]
 
 # === Load subjects ===
-subjects = sorted([
-    folder.name for folder in (deriv_fldr).iterdir()
-    if folder.is_dir() and folder.name.startswith("sub-")
-    and folder.name.endswith("_nii") and folder.name != "sub-dummydata_nii"
-])
+subjects = load_catalog(root_fldr, deriv_fldr).subject_folders()
 
-# === Step 1: Extract T-values ===
-df_tvals = pd.DataFrame()
+# Function to get the ROI stats files of a subject
+def get_stats_files(subject):
+    return [deriv_fldr / subject / f"{subject}_task-mvts_cond-{cond}" /
+            f"{subject}_task-mvts_cond-{cond}.results" / f"roistats_cond-{cond}_outter.csv" for cond in conditions]
+
+# Function to collect the T-values of one subject
+def extract_subject(subject):
+    subject_rows = []
 
-for subject in subjects:
     for cond in conditions:
         stats_file = deriv_fldr / subject / f"{subject}_task-mvts_cond-{cond}" / \
                      f"{subject}_task-mvts_cond-{cond}.results" / f"roistats_cond-{cond}_outter.csv"
@@ -45,33 +49,61 @@ for subject in subjects:
             print(f"Missing file: {stats_file}")
             continue
 
-        roistats = pd.read_csv(stats_file, delimiter="\t")
-        roistats.columns = roistats.columns.str.strip()
+        roistats = read_roistats(stats_file)
+
+        # Tent T-values of each movement (movement#X_Tstat), infinite values dropped
+        tent_tstats = roistats[(roistats['stat'] == 'Tstat') & ~roistats['overall'] & roistats['tent'].notna()]
+        t_vals = tent_tstats["Mean_1"].replace([np.inf, -np.inf], np.nan)
+        avg_t_vals = t_vals.groupby(tent_tstats['movement']).mean()
 
         for movement in movements:
-            # Match movement#X_Tstat
-            regex = re.compile(fr"{movement}#\d+_Tstat")
-            matching_rows = roistats[roistats['Sub-brick'].apply(lambda x: bool(regex.search(str(x))))]
-
-            t_vals = matching_rows["Mean_1"].replace([float('inf'), float('-inf')], pd.NA).dropna()
-            if not t_vals.empty:
-                avg_t = t_vals.mean()
-                df_tvals = pd.concat([
-                    df_tvals,
-                    pd.DataFrame([{
-                        "subject": subject,
-                        "condition": cond,
-                        "movement": movement,
-                        "t_value": avg_t
-                    }])
-                ], ignore_index=True)
+            if pd.notna(avg_t_vals.get(movement)):
+                subject_rows.append({
+                    "subject": subject,
+                    "condition": cond,
+                    "movement": movement,
+                    "t_value": avg_t_vals[movement]
+                })
+
+    return subject_rows
+
+parser = argparse.ArgumentParser(description='Collect outside-brain T-values and plot their distributions.')
+parser.add_argument('--incremental', action='store_true',
+                    help='only recompute subjects whose ROI stats changed and merge them into the existing CSV')
+parser.add_argument('--jobs', type=int, default=1, help='number of processes rendering the histograms')
+parser.add_argument('--preview', action='store_true', help='render the figures at low dpi for a quick check')
+args = parser.parse_args()
 
-# Save extracted T-values
 tvals_path = group_analysis_dir / "df_t_values_outsidebrain.csv"
+
+# === Step 1: Extract T-values ===
+manifest = Manifest(manifest_path(tvals_path))
+incremental = args.incremental and tvals_path.exists()
+if incremental:
+    stale_subjects = [subject for subject in subjects if not manifest.is_current(subject, get_stats_files(subject))]
+    print(f"Recomputing {len(stale_subjects)} of {len(subjects)} subjects")
+else:
+    stale_subjects = subjects
+
+records = []
+for subject in stale_subjects:
+    records.extend(extract_subject(subject))
+df_tvals = pd.DataFrame(records)
+
+# Merge the new rows with the rows of unchanged subjects from the previous run
+if incremental:
+    df_tvals, _ = merge_rows(pd.read_csv(tvals_path), df_tvals, subjects, stale_subjects)
+
+# Save extracted T-values
 df_tvals.to_csv(tvals_path, index=False)
 print(f"Saved T-values to: {tvals_path}")
 
+for subject in stale_subjects:
+    manifest.update(subject, get_stats_files(subject))
+manifest.save()
+
 # === Step 2: Plotting ===
+histogram_jobs = []
 for movement in sorted(df_tvals["movement"].unique()):
     data_minmo = df_tvals[(df_tvals["movement"] == movement) & (df_tvals["condition"] == "MinMo")]["t_value"].dropna()
     data_nominmo = df_tvals[(df_tvals["movement"] == movement) & (df_tvals["condition"] == "NoMinMo")]["t_value"].dropna()
@@ -81,30 +113,16 @@ for movement in sorted(df_tvals["movement"].unique()):
 
     combined = pd.concat([data_minmo, data_nominmo])
     bin_edges = np.arange(combined.min(), combined.max() + 0.05, 0.05)
-    bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
-    bar_width = (bin_edges[1] - bin_edges[0]) * 0.4
 
     counts_minmo, _ = np.histogram(data_minmo, bins=bin_edges)
     counts_nominmo, _ = np.histogram(data_nominmo, bins=bin_edges)
 
     # --- Grouped Histogram ---
-    plt.figure(figsize=(10, 6))
-    plt.bar(bin_centers - bar_width / 2, counts_nominmo, width=bar_width, color='blue', label='NoMinMo')
-    plt.bar(bin_centers + bar_width / 2, counts_minmo, width=bar_width, color='orange', label='MinMo')
-    plt.plot(bin_centers, counts_nominmo, color='blue', lw=2,
-             path_effects=[path_effects.withStroke(linewidth=3, foreground='black')])
-    plt.plot(bin_centers, counts_minmo, color='orange', lw=2,
-             path_effects=[path_effects.withStroke(linewidth=3, foreground='black')])
-
-    plt.title(f"Distribution of T-values for {movement}")
-    plt.xlabel("T-statistic")
-    plt.ylabel("Count")
-    plt.legend()
-    plt.grid(True)
-    plt.tight_layout()
-    plt.savefig(fig_dir_grouped / f'grouped_tstats_{movement}.png', dpi=300)
-    plt.close()
-    print(f"Saved grouped bar plot: grouped_tstats_{movement}.png")
+    histogram_jobs.append(histogram_job(
+        'grouped', bin_edges, [counts_nominmo, counts_minmo], ['NoMinMo', 'MinMo'],
+        fig_dir_grouped / f'grouped_tstats_{movement}.png', peak_lines=True,
+        title=f"Distribution of T-values for {movement}", xlabel="T-statistic", tight_layout=True, bbox_inches=None,
+        message=f"Saved grouped bar plot: grouped_tstats_{movement}.png"))
 
     # --- Violin Plot ---
     subset = df_tvals[df_tvals["movement"] == movement]
@@ -116,6 +134,9 @@ for movement in sorted(df_tvals["movement"].unique()):
     plt.xlabel("")
     plt.grid(True)
     plt.tight_layout()
-    plt.savefig(fig_dir_violin / f"violin_tstats_{movement}.png", dpi=300)
+    plt.savefig(fig_dir_violin / f"violin_tstats_{movement}.png", dpi=72 if args.preview else 300)
     plt.close()
     print(f"Saved violin plot: violin_tstats_{movement}.png")
+
+# Render all grouped histograms in one batch
+render_histograms(histogram_jobs, args.jobs, args.preview)
@@ -0,0 +1,78 @@
+import time
+import numpy as np
+import pandas as pd
+
+# Benchmark of the row accumulation used by the ROI extractors (15, 17, 19):
+# one-row pd.concat per row (old) vs a record list turned into a DataFrame once (current).
+# Rows are generated with the shape of 15: subjects x conditions x movements x hemispheres x ROIs,
+# before the timing starts, so only the accumulation is timed.
+
+conditions = ["MinMo", "NoMinMo"]
+movements = [
+    "cough", "crosslegsleftontop", "crosslegsrightontop",
+    "lefthandtorightthigh", "righthandtoleftthigh",
+    "raiselefthip", "raiserighthip",
+    "sayHellotheremum", "scratchleftcheek", "scratchrightcheek"
+]
+hemis = ["lh", "rh"]
+rois = ['3b_face', '3a_face', '1_face', '4_face']
+
+rng = np.random.default_rng(0)
+
+
+# Function to generate the rows of n_subjects subjects
+def make_rows(n_subjects):
+    rows = []
+    for subj_i in range(n_subjects):
+        for cond in conditions:
+            for movement in movements:
+                for hemi in hemis:
+                    for roi in rois:
+                        rows.append({
+                            "subject": f"sub-{subj_i:02d}_nii",
+                            "condition": cond,
+                            "movement": movement,
+                            "hemi": hemi,
+                            "ROI": roi,
+                            "beta_coef": rng.normal(),
+                            "t_value": rng.normal()
+                        })
+    return rows
+
+
+# Function to accumulate rows with one pd.concat per row
+def accumulate_concat(rows):
+    df = pd.DataFrame()
+    for row in rows:
+        df = pd.concat([df, pd.DataFrame([row])], ignore_index=True)
+    return df
+
+
+# Function to accumulate rows in a list and build the frame once
+def accumulate_records(rows):
+    records = []
+    for row in rows:
+        records.append(row)
+    return pd.DataFrame(records)
+
+
+# Function to time one accumulation
+def time_accumulation(accumulate, rows):
+    start = time.perf_counter()
+    df = accumulate(rows)
+    return time.perf_counter() - start, len(df)
+
+
+print(f"{'subjects':>8} {'rows':>8} {'concat us/row':>14} {'records us/row':>15}")
+for n_subjects in [1, 2, 5, 10, 20, 40]:
+    rows = make_rows(n_subjects)
+    elapsed_records, n_rows = time_accumulation(accumulate_records, rows)
+
+    # The quadratic version is only run on the smaller sizes
+    if n_subjects <= 20:
+        elapsed_concat, _ = time_accumulation(accumulate_concat, rows)
+        concat_per_row = f"{elapsed_concat / n_rows * 1e6:14.1f}"
+    else:
+        concat_per_row = f"{'-':>14}"
+
+    print(f"{n_subjects:8d} {n_rows:8d} {concat_per_row} {elapsed_records / n_rows * 1e6:15.1f}")
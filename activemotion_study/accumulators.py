@@ -0,0 +1,131 @@
+import numpy as np
+import pandas as pd
+
+
+class RunningStats:
+    """
+    Online count, mean and M2 (sum of squared deviations) per key, so that group statistics can be
+    computed without keeping the samples. Batches are combined with the exact pairwise update of
+    Chan et al., which also merges the accumulators of parallel workers.
+    Keys are kept in the order they were first seen.
+    """
+
+    def __init__(self):
+        self.stats = {}
+
+    def __len__(self):
+        return len(self.stats)
+
+    def __contains__(self, key):
+        return key in self.stats
+
+    def add_moments(self, key, count, mean, m2):
+        """
+        Merge a batch given by its count, mean and M2 into the statistics of key.
+        """
+        if count == 0:
+            return
+        if key not in self.stats:
+            self.stats[key] = (count, mean, m2)
+            return
+
+        count_a, mean_a, m2_a = self.stats[key]
+        total = count_a + count
+        delta = mean - mean_a
+        self.stats[key] = (total,
+                           mean_a + delta * count / total,
+                           m2_a + m2 + delta ** 2 * count_a * count / total)
+
+    def add(self, key, values):
+        """
+        Merge a batch of samples into the statistics of key.
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        if values.size == 0:
+            return
+        mean = values.mean()
+        self.add_moments(key, values.size, mean, np.sum((values - mean) ** 2))
+
+    def merge(self, other):
+        """
+        Merge the statistics of another RunningStats (e.g. from another worker) into this one.
+        """
+        for key, (count, mean, m2) in other.stats.items():
+            self.add_moments(key, count, mean, m2)
+        return self
+
+    def to_frame(self, key_names):
+        """
+        One row per key: the key fields (named key_names) and count, mean, m2.
+        """
+        keys = list(self.stats)
+        moments = np.array(list(self.stats.values()), dtype=float).reshape(len(keys), 3)
+
+        df = pd.DataFrame(keys, columns=list(key_names))
+        df['count'] = moments[:, 0].astype(int)
+        df['mean'] = moments[:, 1]
+        df['m2'] = moments[:, 2]
+        return df
+
+
+class NanRunningStats:
+    """
+    Elementwise running count, mean and M2 over batches of equally shaped arrays (e.g. time x channels),
+    ignoring NaNs like nanmean/nanstd. Batches and other accumulators are merged with the same
+    pairwise update as RunningStats, so all samples never have to be held at once.
+    """
+
+    def __init__(self):
+        self.count = None
+        self.mean = None
+        self.m2 = None
+
+    def add_moments(self, count, mean, m2):
+        """
+        Merge elementwise counts, means and M2 (means are ignored where the count is 0).
+        """
+        if self.count is None:
+            self.count = np.zeros(np.shape(mean), dtype=np.int64)
+            self.mean = np.zeros(np.shape(mean))
+            self.m2 = np.zeros(np.shape(mean))
+
+        total = self.count + count
+        delta = np.where(count > 0, mean, 0) - self.mean
+        weight = np.divide(count, total, out=np.zeros(total.shape), where=total > 0)
+
+        self.mean = self.mean + delta * weight
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * weight
+        self.count = total
+
+    def add(self, batch):
+        """
+        Merge a batch of samples stacked along the first axis; NaN samples are skipped.
+        """
+        batch = np.asarray(batch, dtype=float)
+        finite = ~np.isnan(batch)
+        count = finite.sum(axis=0)
+        mean = np.divide(np.where(finite, batch, 0).sum(axis=0), count, out=np.zeros(count.shape), where=count > 0)
+        m2 = np.where(finite, (batch - mean) ** 2, 0).sum(axis=0)
+        self.add_moments(count, mean, m2)
+
+    def merge(self, other):
+        """
+        Merge another NanRunningStats (e.g. from another worker) into this one.
+        """
+        if other.count is not None:
+            self.add_moments(other.count, other.mean, other.m2)
+        return self
+
+    def nanmean(self):
+        return np.where(self.count > 0, self.mean, np.nan)
+
+    def nanstd(self, ddof=0):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.count > ddof, np.sqrt(self.m2 / (self.count - ddof)), np.nan)
+
+    def sem(self, ddof=0):
+        """
+        Standard error of the mean as nanstd / sqrt(count), ddof=0 by default like np.nanstd.
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.nanstd(ddof) / np.sqrt(self.count)
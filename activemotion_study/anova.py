@@ -0,0 +1,202 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import f as f_dist
+
+
+# Function to reshape a long table into a subjects x levels_a x levels_b x metrics array
+def cell_array(df, dv, subject, within, metric, metrics=None):
+    """
+    Mean of dv in every subject x within[0] x within[1] cell of every metric (in the order of metrics,
+    all metrics of df by default), from one pivot_table. Missing cells are NaN.
+    Returns the array and the subject, level and metric labels of its axes.
+    """
+    a, b = within
+    wide = df.pivot_table(index=subject, columns=[metric, a, b], values=dv, aggfunc='mean', observed=True)
+
+    levels_a = np.sort(df[a].dropna().unique())
+    levels_b = np.sort(df[b].dropna().unique())
+    if metrics is None:
+        metrics = df[metric].dropna().unique()
+    wide = wide.reindex(columns=pd.MultiIndex.from_product([metrics, levels_a, levels_b]))
+
+    values = wide.to_numpy(dtype=float).reshape(len(wide), len(metrics), len(levels_a), len(levels_b))
+    return values.transpose(0, 2, 3, 1), wide.index.to_numpy(), levels_a, levels_b, metrics
+
+
+# Function to compute the Greenhouse-Geisser epsilon of a repeated factor for every metric
+def gg_epsilon(wide, valid):
+    """
+    Greenhouse-Geisser epsilon (as pingouin.epsilon) of wide (subjects x levels x metrics), using the
+    covariance of the levels over the valid (subjects x metrics) subjects. 1 with two levels or less.
+    """
+    n_levels = wide.shape[1]
+    if n_levels <= 2:
+        return np.ones(wide.shape[2])
+
+    n_s = valid.sum(axis=0)
+    mean = np.where(valid[:, None], wide, 0).sum(axis=0) / n_s
+    centered = np.where(valid[:, None], wide - mean, 0)
+    cov = np.einsum('sim,sjm->mij', centered, centered) / (n_s - 1)[:, None, None]
+
+    mean_var = np.diagonal(cov, axis1=1, axis2=2).mean(axis=1)
+    cov_mean = cov.mean(axis=(1, 2))
+    ss_mat = (cov ** 2).sum(axis=(1, 2))
+    ss_rows = (cov.mean(axis=2) ** 2).sum(axis=1)
+
+    num = (n_levels * (mean_var - cov_mean)) ** 2
+    den = (n_levels - 1) * (ss_mat - 2 * n_levels * ss_rows + n_levels ** 2 * cov_mean ** 2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.minimum(num / den, 1)
+
+
+# Function to run a two-way repeated-measures ANOVA on every metric at once
+def rm_anova2(values, effsize='ng2'):
+    """
+    Two-way within-subject ANOVA (as pingouin.rm_anova with two within factors) of every metric of
+    values (subjects x levels_a x levels_b x metrics). Subjects with a missing cell are left out of that
+    metric only (listwise deletion, as pingouin). All sums of squares are computed in one vectorized pass.
+
+    Returns a dict of (3 x metrics) arrays, rows a, b and a * b: SS, ddof1, ddof2, MS, F, p-unc,
+    p-GG-corr, the effect size (ng2, n2 or np2) and eps.
+    """
+    values = np.asarray(values, dtype=float)
+    n_a, n_b = values.shape[1], values.shape[2]
+    valid = ~np.isnan(values).any(axis=(1, 2))
+    x = np.where(valid[:, None, None], values, 0)
+    n_s = valid.sum(axis=0)
+
+    # Grand mean and the means of subjects, factors and their combinations
+    mu = x.sum(axis=(0, 1, 2)) / (n_s * n_a * n_b)
+    grp_s = x.mean(axis=(1, 2))
+    grp_a = x.sum(axis=(0, 2)) / (n_s * n_b)
+    grp_b = x.sum(axis=(0, 1)) / (n_s * n_a)
+    grp_ab = x.sum(axis=0) / n_s
+    grp_as = x.mean(axis=2)
+    grp_bs = x.mean(axis=1)
+
+    # Sums of squares
+    ss_tot = np.sum(valid[:, None, None] * (x - mu) ** 2, axis=(0, 1, 2))
+    ss_s = n_a * n_b * np.sum(valid * (grp_s - mu) ** 2, axis=0)
+    ss_a = n_b * n_s * np.sum((grp_a - mu) ** 2, axis=0)
+    ss_b = n_a * n_s * np.sum((grp_b - mu) ** 2, axis=0)
+    ss_ab = n_s * np.sum((grp_ab - mu) ** 2, axis=(0, 1)) - ss_a - ss_b
+    ss_as = n_b * np.sum(valid[:, None] * (grp_as - mu) ** 2, axis=(0, 1)) - ss_s - ss_a
+    ss_bs = n_a * np.sum(valid[:, None] * (grp_bs - mu) ** 2, axis=(0, 1)) - ss_s - ss_b
+    ss_abs = ss_tot - ss_a - ss_b - ss_s - ss_ab - ss_as - ss_bs
+
+    # Degrees of freedom
+    df_a = np.full(len(n_s), n_a - 1)
+    df_b = np.full(len(n_s), n_b - 1)
+    df_s = n_s - 1
+    df_ab = (n_a * n_b - 1) - df_a - df_b
+    df_as = (n_a * n_s - 1) - df_s - df_a
+    df_bs = (n_b * n_s - 1) - df_s - df_b
+    df_abs = (n_a * n_b * n_s - 1) - df_a - df_b - df_s - df_ab - df_as - df_bs
+
+    ss = np.array([ss_a, ss_b, ss_ab])
+    ddof1 = np.array([df_a, df_b, df_ab])
+    ddof2 = np.array([df_as, df_bs, df_abs])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ms = ss / ddof1
+        f_val = ms / (np.array([ss_as, ss_bs, ss_abs]) / ddof2)
+    p_unc = f_dist.sf(f_val, ddof1, ddof2)
+
+    # Effect sizes
+    if effsize == 'n2':
+        eff = ss / ss_tot
+    elif effsize == 'ng2':
+        eff = ss / (ss + ss_s + ss_as + ss_bs + ss_abs)
+    else:
+        eff = (f_val * ddof1) / (f_val * ddof1 + ddof2)
+
+    # Epsilon of each factor, and of the interaction from the differences between the two levels
+    # of the smaller factor (as pingouin does for (2, N) designs; the full cell matrix otherwise)
+    eps_a = gg_epsilon(grp_as, valid)
+    eps_b = gg_epsilon(grp_bs, valid)
+    if min(n_a, n_b) == 2:
+        diffs = x[:, 1] - x[:, 0] if n_a <= n_b else x[:, :, 1] - x[:, :, 0]
+        eps_ab = gg_epsilon(diffs, valid)
+    else:
+        eps_ab = gg_epsilon(x.reshape(len(x), n_a * n_b, -1), valid)
+    eps = np.array([eps_a, eps_b, eps_ab])
+
+    # Greenhouse-Geisser corrected p-values
+    p_gg = f_dist.sf(f_val, np.maximum(ddof1 * eps, 1.0), np.maximum(ddof2 * eps, 1.0))
+
+    return {'SS': ss, 'ddof1': ddof1, 'ddof2': ddof2, 'MS': ms, 'F': f_val, 'p-unc': p_unc,
+            'p-GG-corr': p_gg, effsize: eff, 'eps': eps}
+
+
+# Function to run rm_anova2 and return pingouin's table for every metric
+def rm_anova2_table(values, within, metrics, effsize='ng2'):
+    """
+    rm_anova2 results as the concatenation of pingouin.rm_anova tables (Source rows a, b, a * b),
+    one block per metric with a metric column.
+    """
+    a, b = within
+    results = rm_anova2(values, effsize)
+    n_metrics = len(metrics)
+
+    table = pd.DataFrame({'Source': np.tile([a, b, f'{a} * {b}'], n_metrics)})
+    for column, result in results.items():
+        table[column] = result.T.ravel()
+    table['metric'] = np.repeat(np.asarray(metrics, dtype=object), 3)
+    return table
+
+
+# Function to run a one-way between-subject ANOVA on every metric at once
+def anova_oneway(values, groups):
+    """
+    One-way ANOVA (as pingouin.anova with one between factor) of every column of values
+    (observations x metrics) across the groups labels of the observations. NaN observations are
+    dropped per metric.
+
+    Returns a dict of metric arrays: ssbetween, sserror, ddof1, ddof2, F, p-unc and np2.
+    """
+    values = np.asarray(values, dtype=float)
+    _, group_id = np.unique(np.asarray(groups), return_inverse=True)
+    valid = ~np.isnan(values)
+    x = np.where(valid, values, 0)
+
+    # Per group (groups x metrics) counts and means, as one-hot products
+    one_hot = np.eye(group_id.max() + 1)[group_id]
+    counts = one_hot.T @ valid
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = (one_hot.T @ x) / counts
+    n_total = valid.sum(axis=0)
+    mu = x.sum(axis=0) / n_total
+
+    ssbetween = np.nansum(counts * (means - mu) ** 2, axis=0)
+    sserror = np.sum(valid * (x - np.nan_to_num(means)[group_id]) ** 2, axis=0)
+
+    ddof1 = (counts > 0).sum(axis=0) - 1
+    ddof2 = n_total - ddof1 - 1
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f_val = (ssbetween / ddof1) / (sserror / ddof2)
+    return {'ssbetween': ssbetween, 'sserror': sserror, 'ddof1': ddof1, 'ddof2': ddof2, 'F': f_val,
+            'p-unc': f_dist.sf(f_val, ddof1, ddof2), 'np2': ssbetween / (ssbetween + sserror)}
+
+
+# Function to run anova_oneway and return pingouin's detailed table for every metric
+def anova_oneway_table(values, groups, between, metrics):
+    """
+    anova_oneway results as the concatenation of pingouin.anova(detailed=True) tables
+    (Source rows between and Within), one block per metric with a metric column.
+    """
+    results = anova_oneway(values, groups)
+    n_metrics = len(metrics)
+    nan = np.full(n_metrics, np.nan)
+
+    def interleave(between_row, within_row):
+        return np.column_stack([between_row, within_row]).ravel()
+
+    return pd.DataFrame({
+        'Source': np.tile([between, 'Within'], n_metrics),
+        'SS': interleave(results['ssbetween'], results['sserror']),
+        'DF': interleave(results['ddof1'], results['ddof2']),
+        'MS': interleave(results['ssbetween'] / results['ddof1'], results['sserror'] / results['ddof2']),
+        'F': interleave(results['F'], nan),
+        'p-unc': interleave(results['p-unc'], nan),
+        'np2': interleave(results['np2'], nan),
+        'metric': np.repeat(np.asarray(metrics, dtype=object), 2),
+    })
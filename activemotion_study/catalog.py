@@ -0,0 +1,167 @@
+import json
+import os
+import pandas as pd
+from pathlib import Path
+
+
+# Function to read a subject list (one id per line, # comments)
+def read_subject_list(path):
+    with open(path, 'r') as file:
+        return [line.split('#')[0].strip() for line in file if line.split('#')[0].strip()]
+
+
+# Function to get the results folder of a subject/task/condition
+def results_folder(deriv_fldr, subj_id, task, cond):
+    name = f'sub-{subj_id}_task-{task}_cond-{cond}'
+    return Path(deriv_fldr) / f'sub-{subj_id}' / name / f'{name}.results'
+
+
+# Function to get the modification time of a path (None when it does not exist)
+def source_mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class StudyCatalog:
+    """
+    Index of the study, built once from the sequence file and a single scan of derivatives/: for every
+    subject, its condition order, run order and, for every task and condition, whether the results
+    folder exists. Subjects listed in excluded_subjects.txt (e.g. the dummy data) are flagged.
+    Subjects of the sequence file come first in its order, then the subjects only found in derivatives/.
+
+    The index is cached as JSON together with the mtimes of its sources (sequence file, subject list and
+    every scanned folder), and rebuilt when one of them changed.
+    """
+
+    def __init__(self, root_fldr, deriv_fldr, entries, sources):
+        self.root_fldr = Path(root_fldr)
+        self.deriv_fldr = Path(deriv_fldr)
+        self.entries = entries
+        self.sources = sources
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, subj_id):
+        return subj_id in self.entries
+
+    @classmethod
+    def build(cls, root_fldr, deriv_fldr):
+        """
+        Read the sequence file and the subject list and scan derivatives/ (sub-<id>_nii subject folders,
+        then their task/condition folders).
+        """
+        root_fldr, deriv_fldr = Path(root_fldr), Path(deriv_fldr)
+        sequence_file = root_fldr / 'Sequences of conditions and runs.csv'
+        excluded_file = Path(__file__).with_name('excluded_subjects.txt')
+        excluded = set(read_subject_list(excluded_file)) if excluded_file.exists() else set()
+        sources = {str(path): source_mtime(path) for path in (sequence_file, excluded_file, deriv_fldr)}
+
+        # Subjects of the sequence file (none when the study folder has no sequence file)
+        entries = {}
+        if sequence_file.exists():
+            sequence_df = pd.read_csv(sequence_file, dtype=str)
+            for subj_id, conditions, runs in zip(sequence_df['Subj #'], sequence_df['Conditions'], sequence_df['Runs']):
+                entries[subj_id] = {'conditions': conditions.split(' '), 'runs': list(map(int, runs.split())),
+                                    'excluded': subj_id in excluded, 'folder': False, 'results': {}}
+
+        with os.scandir(deriv_fldr) as subject_dirs:
+            subject_dirs = sorted((entry for entry in subject_dirs if entry.is_dir() and entry.name.startswith('sub-')
+                                   and entry.name.endswith('_nii')), key=lambda entry: entry.name)
+        for subject_dir in subject_dirs:
+            subj_id = subject_dir.name[len('sub-'):]
+            entry = entries.setdefault(subj_id, {'conditions': [], 'runs': [], 'excluded': subj_id in excluded,
+                                                 'folder': False, 'results': {}})
+            entry['folder'] = True
+            sources[subject_dir.path] = source_mtime(subject_dir.path)
+
+            # Task/condition folders (sub-<id>_task-<task>_cond-<cond>) and their results folders
+            with os.scandir(subject_dir.path) as cond_dirs:
+                for cond_dir in cond_dirs:
+                    if not cond_dir.is_dir() or '_task-' not in cond_dir.name or '_cond-' not in cond_dir.name:
+                        continue
+                    task, cond = cond_dir.name.split('_task-', 1)[1].split('_cond-', 1)
+                    entry['results'][f'{task}/{cond}'] = os.path.isdir(os.path.join(cond_dir.path, f'{cond_dir.name}.results'))
+                    sources[cond_dir.path] = source_mtime(cond_dir.path)
+
+        return cls(root_fldr, deriv_fldr, entries, sources)
+
+    def is_current(self):
+        """
+        True when none of the sources changed since the catalog was built.
+        """
+        return all(source_mtime(path) == mtime for path, mtime in self.sources.items())
+
+    def save(self, path):
+        with open(path, 'w') as file:
+            json.dump({'root': str(self.root_fldr), 'derivatives': str(self.deriv_fldr),
+                       'sources': self.sources, 'subjects': self.entries}, file, indent=1)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as file:
+            cache = json.load(file)
+        return cls(cache['root'], cache['derivatives'], cache['subjects'], cache['sources'])
+
+    def subject_ids(self, include_excluded=False):
+        """
+        Ids of the subjects of the sequence file (in its order), without the excluded ones by default.
+        """
+        return [subj_id for subj_id, entry in self.entries.items()
+                if entry['conditions'] and (include_excluded or not entry['excluded'])]
+
+    def subject_folders(self, include_excluded=False):
+        """
+        Names of the subject folders of derivatives/ ('sub-<id>'), sorted, without the excluded ones by default.
+        """
+        return sorted(f'sub-{subj_id}' for subj_id, entry in self.entries.items()
+                      if entry['folder'] and (include_excluded or not entry['excluded']))
+
+    def conditions(self, subj_id):
+        """
+        Condition order of a subject (e.g. ['NoMinMo', 'MinMo']).
+        """
+        return list(self.entries[subj_id]['conditions'])
+
+    def runs(self, subj_id):
+        """
+        Run order of a subject (1-based run numbers, all conditions).
+        """
+        return list(self.entries[subj_id]['runs'])
+
+    def results_folder(self, subj_id, task, cond):
+        return results_folder(self.deriv_fldr, subj_id, task, cond)
+
+    def has_results(self, subj_id, task, cond):
+        """
+        Whether the results folder of a subject/task/condition existed when the catalog was built.
+        """
+        return self.entries.get(subj_id, {}).get('results', {}).get(f'{task}/{cond}', False)
+
+
+# Function to get the study catalog, from its cache when none of its sources changed
+def load_catalog(root_fldr, deriv_fldr=None, rebuild=False):
+    """
+    The catalog of the study in root_fldr (derivatives in root_fldr/derivatives by default), cached
+    in root_fldr/study_catalog.json.
+    """
+    root_fldr = Path(root_fldr)
+    deriv_fldr = root_fldr / 'derivatives' if deriv_fldr is None else Path(deriv_fldr)
+    cache_path = root_fldr / 'study_catalog.json'
+
+    if not rebuild and cache_path.exists():
+        try:
+            catalog = StudyCatalog.load(cache_path)
+            if catalog.deriv_fldr == deriv_fldr and catalog.is_current():
+                return catalog
+        except (OSError, ValueError, KeyError):
+            pass  # Unreadable cache: rebuild it
+
+    catalog = StudyCatalog.build(root_fldr, deriv_fldr)
+    try:
+        catalog.save(cache_path)
+    except OSError:
+        pass  # Read-only study folder: keep working without the cache
+    return catalog
@@ -0,0 +1,139 @@
+import shutil
+import numpy as np
+import nibabel as nib
+from scipy.ndimage import affine_transform
+from scipy.spatial.transform import Rotation as R
+
+
+# Function to build the transform of one motion event
+def motion_transform(rotation_angles, translation):
+    """
+    Build the matrix and offset of a motion event: rotation (degrees, 'xyz') and translation in space.
+    """
+    matrix = R.from_euler('xyz', rotation_angles, degrees=True).as_matrix()
+    offset = np.asarray(translation, dtype=float)
+    return matrix, offset
+
+
+# Function to resample several volumes with the same transform
+def move_volumes(epi, volumes, matrix, offset):
+    """
+    Resample epi[..., volumes] with the transform of one event, one 3D affine_transform call per volume.
+    A single 4D call would also run the cubic spline along time, 4x the interpolation work per voxel.
+    """
+    moved = np.empty(epi.shape[:-1] + (len(volumes),), dtype=epi.dtype, order='F')
+    for block_i, vol_idx in enumerate(volumes):
+        affine_transform(
+            epi[..., vol_idx],
+            matrix=matrix,
+            offset=offset,
+            output=moved[..., block_i],
+            mode='constant',
+            cval=0  # Fill missing data with 0
+        )
+    return moved
+
+
+# Function to iterate over the moved windows of a run
+def iter_motion_windows(stationary_epi, window_starts, window_volumes, rotation_angles, translations):
+    """
+    Yield (volumes, moved block) for each event: window_volumes volumes from the window start (TR index),
+    moved with the parameters of that event. The transform of each event is computed once.
+    """
+    n_vols = stationary_epi.shape[-1]
+
+    for event_i, window_start in enumerate(window_starts):
+        volumes = np.arange(window_start, window_start + window_volumes)
+        volumes = volumes[(volumes >= 0) & (volumes < n_vols)]  # Check bounds
+        if volumes.size == 0:
+            continue
+
+        matrix, offset = motion_transform(rotation_angles[event_i], translations[event_i])
+        yield volumes, move_volumes(stationary_epi, volumes, matrix, offset)
+
+
+# Function to simulate all motion events of a run
+def simulate_run(stationary_epi, window_starts, window_volumes, rotation_angles, translations):
+    """
+    Resample all motion windows of a run from the stationary series; when windows overlap the later event wins.
+    Returns the indices of the moved volumes and the moved volumes (x, y, z, n_moved).
+    """
+    moved = {}
+    for volumes, block in iter_motion_windows(stationary_epi, window_starts, window_volumes,
+                                              rotation_angles, translations):
+        for block_i, vol_idx in enumerate(volumes):
+            moved[vol_idx] = block[..., block_i]
+
+    moved_idx = np.array(sorted(moved), dtype=int)
+    if moved_idx.size == 0:
+        return moved_idx, np.empty(stationary_epi.shape[:-1] + (0,), dtype=stationary_epi.dtype)
+    return moved_idx, np.stack([moved[vol_idx] for vol_idx in moved_idx], axis=-1)
+
+
+# Function to read one volume without loading the whole series
+def load_volume(img, vol_idx, dtype=np.float32):
+    """
+    Read a single volume through the image's array proxy (memory-mapped for uncompressed files).
+    """
+    return np.asarray(img.dataobj[..., vol_idx], dtype=dtype)
+
+
+# Function to open the data of a NIfTI file as a memory map
+def open_nifti_memmap(path, mode='r+'):
+    """
+    Memory-map the data block of an unscaled, single-file NIfTI (Fortran order, so each volume is contiguous).
+    The offset comes from the array proxy: the header of a loaded image has its vox_offset reset to 0.
+    """
+    proxy = nib.load(path).dataobj
+    return np.memmap(path, dtype=proxy.dtype, mode=mode, offset=proxy.offset, shape=proxy.shape, order='F')
+
+
+# Function to preallocate a NIfTI file on disk
+def create_nifti_memmap(path, shape, affine, dtype=np.float32):
+    """
+    Write the header of a (shape, dtype) NIfTI, allocate its data block on disk and return it memory-mapped.
+    """
+    # A zero-strided placeholder gives a complete header without allocating the data
+    header = nib.Nifti1Image(np.broadcast_to(np.zeros((), dtype=dtype), shape), affine).header
+    header.set_data_offset(header.single_vox_offset)  # Data right after the header and its extension flag
+    with open(path, 'wb') as file:
+        header.write_to(file)
+        file.truncate(header.get_data_offset() + int(np.prod(shape)) * np.dtype(dtype).itemsize)
+    return open_nifti_memmap(path)
+
+
+# Function to generate the noisy volumes of a stationary run
+def iter_stationary_volumes(single_vol, n_vols, noise_mean, noise_std, rng):
+    """
+    Yield n_vols copies of single_vol with Gaussian noise, drawn from rng one volume at a time, so the
+    in-memory and the on-disk runs get the same noise and leave rng in the same state.
+    """
+    for _ in range(n_vols):
+        yield single_vol + rng.normal(loc=noise_mean, scale=noise_std, size=single_vol.shape)
+
+
+# Function to stream a noisy stationary run to disk
+def write_stationary_run(path, single_vol, n_vols, affine, noise_mean, noise_std, rng):
+    """
+    Write the volumes of iter_stationary_volumes as float32, one at a time.
+    """
+    out = create_nifti_memmap(path, single_vol.shape + (n_vols,), affine)
+    for vol_i, volume in enumerate(iter_stationary_volumes(single_vol, n_vols, noise_mean, noise_std, rng)):
+        out[..., vol_i] = volume
+    out.flush()
+
+
+# Function to stream a moving run to disk
+def write_moving_run(path, stationary_path, window_starts, window_volumes, rotation_angles, translations):
+    """
+    Copy of the stationary run on disk with the motion windows resampled in place, one event at a time.
+    """
+    stationary_epi = open_nifti_memmap(stationary_path, mode='r')
+    with open(stationary_path, 'rb') as src, open(path, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+
+    out = open_nifti_memmap(path)
+    for volumes, block in iter_motion_windows(stationary_epi, window_starts, window_volumes,
+                                              rotation_angles, translations):
+        out[..., volumes] = block
+    out.flush()
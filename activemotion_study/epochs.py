@@ -0,0 +1,77 @@
+import numpy as np
+
+
+# Function to convert onset times (seconds) to sample indices
+def onset_indices(onset_times, sampling_interval=0.8):
+    """
+    Convert onset times in seconds to TR indices (truncated, as int(onset / sampling_interval)).
+    """
+    return (np.asarray(onset_times, dtype=float) / sampling_interval).astype(int)
+
+
+# Function to gather all trial windows in one go
+def extract_epochs(motion_data, onset_idx, n_pre, n_post):
+    """
+    Build a (n_trials x window x n_columns) array of epochs around each onset index.
+
+    The window covers samples onset_idx - n_pre ... onset_idx + n_post - 1. Samples that fall
+    outside of the motion data are NaN and flagged as False in the returned (n_trials x window) mask.
+    """
+    motion_data = np.asarray(motion_data, dtype=float)
+    if motion_data.ndim == 1:
+        motion_data = motion_data[:, np.newaxis]
+    onset_idx = np.asarray(onset_idx, dtype=int)
+
+    # Index matrix: one row per trial, one column per sample of the window
+    idx = onset_idx[:, np.newaxis] + np.arange(-n_pre, n_post)[np.newaxis, :]
+    valid = (idx >= 0) & (idx < motion_data.shape[0])
+
+    # Clip indices to gather in a single fancy-index, then blank the padded samples
+    epochs = motion_data[np.clip(idx, 0, motion_data.shape[0] - 1)]
+    epochs[~valid] = np.nan
+
+    return epochs, valid
+
+
+# Function to compute all summary statistics of the epochs at once
+def summarize_epochs(epochs, valid):
+    """
+    Compute per-trial, per-column statistics along the window axis.
+
+    Returns a dict of (n_trials x n_columns) arrays: N, avg, avg_abs, med, max, min.
+    """
+    n_samples = np.broadcast_to(valid.sum(axis=1)[:, np.newaxis], (epochs.shape[0], epochs.shape[2]))
+
+    # Without padding the plain reductions are equivalent and faster
+    if valid.all():
+        mean, median, maximum, minimum = np.mean, np.median, np.max, np.min
+    else:
+        mean, median, maximum, minimum = np.nanmean, np.nanmedian, np.nanmax, np.nanmin
+
+    return {
+        "N": n_samples,
+        "avg": mean(epochs, axis=1),
+        "avg_abs": mean(np.abs(epochs), axis=1),
+        "med": median(epochs, axis=1),
+        "max": maximum(epochs, axis=1),
+        "min": minimum(epochs, axis=1),
+    }
+
+
+# Function to gather the epochs of several event types at once
+def extract_epochs_by_type(motion_data, onset_idx_by_type, n_pre, n_post):
+    """
+    Build the epochs of every event type (dict of onset indices) with a single gather over the motion data.
+    Returns a dict with the (epochs, valid) pair of each event type, in the same order.
+    """
+    counts = [len(onset_idx) for onset_idx in onset_idx_by_type.values()]
+    all_onsets = np.concatenate([np.asarray(onset_idx, dtype=int) for onset_idx in onset_idx_by_type.values()]) \
+        if counts else np.array([], dtype=int)
+
+    epochs, valid = extract_epochs(motion_data, all_onsets, n_pre, n_post)
+
+    # Split the trials back per event type
+    splits = np.cumsum(counts)[:-1]
+    return {event_type: (type_epochs, type_valid)
+            for event_type, type_epochs, type_valid
+            in zip(onset_idx_by_type, np.split(epochs, splits), np.split(valid, splits))}
@@ -0,0 +1,158 @@
+import os
+import numpy as np
+import matplotlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.util import Finalize
+from pathlib import Path
+
+# Figures already built in this process, reused from one job to the next (the oldest is closed
+# beyond _max_cached_figures)
+_figure_cache = {}
+_max_cached_figures = 4
+
+
+# Function to check whether a figure needs to be rendered again
+def is_up_to_date(output_path, input_files):
+    """
+    True when the output PNG exists and is newer than all of its input files.
+    """
+    output_path = Path(output_path)
+    if not output_path.exists():
+        return False
+    output_mtime = output_path.stat().st_mtime_ns
+    return all(Path(path).stat().st_mtime_ns <= output_mtime for path in input_files if Path(path).exists())
+
+
+# Function to describe a per-trial figure as pure data
+def trial_figure_job(trials, time_window, labels, ylabel, suptitle, output_path, input_files=()):
+    """
+    Figure job: one subplot per trial (trials x time x len(labels)), one line per label.
+    """
+    return {
+        'trials': np.asarray(trials),
+        'time_window': np.asarray(time_window),
+        'labels': tuple(labels),
+        'ylabel': ylabel,
+        'suptitle': suptitle,
+        'output_path': str(output_path),
+        'input_files': tuple(str(path) for path in input_files),
+    }
+
+
+# Function to get (or build once) the figure of a given number of trials
+def _trial_figure(num_trials, num_columns, labels, ylabel):
+    """
+    Figure with one decorated subplot per trial and empty lines to fill in; the axes after the last
+    trial are left blank, as when the figure is drawn from scratch.
+    """
+    key = (num_trials, num_columns, labels, ylabel)
+    if key in _figure_cache:
+        return _figure_cache[key]
+
+    import matplotlib.pyplot as plt
+    num_rows = int(np.ceil(num_trials / num_columns))
+    fig, axs = plt.subplots(num_rows, num_columns, figsize=(15, 10))
+    axs = np.atleast_1d(axs).flatten()  # Flattening for easy iteration
+
+    lines = []
+    for i in range(num_trials):
+        lines.append([axs[i].plot([], [], label=label)[0] for label in labels])
+        axs[i].set_title(f'Trial {i + 1}')
+        axs[i].set_xlabel('Time (seconds)')
+        axs[i].set_ylabel(ylabel)
+        axs[i].legend(loc='upper right')
+        axs[i].grid(True)
+
+    if len(_figure_cache) >= _max_cached_figures:
+        plt.close(_figure_cache.pop(next(iter(_figure_cache)))[0])
+    _figure_cache[key] = fig, axs, lines
+    return _figure_cache[key]
+
+
+# Function to close the cached figures of this process
+def close_cached_figures():
+    import matplotlib.pyplot as plt
+    for fig, _, _ in _figure_cache.values():
+        plt.close(fig)
+    _figure_cache.clear()
+
+
+# Function to render one per-trial figure
+def render_trial_figure(job, num_columns=3):
+    """
+    Draw the trials of a job into the cached figure of its trial count and save it.
+    """
+    trials = job['trials']
+    fig, axs, lines = _trial_figure(len(trials), num_columns, job['labels'], job['ylabel'])
+
+    for i, trial in enumerate(trials):
+        for j, line in enumerate(lines[i]):
+            line.set_data(job['time_window'], trial[:, j])
+        axs[i].relim()
+        axs[i].autoscale_view()
+
+    fig.suptitle(job['suptitle'])
+    fig.tight_layout(rect=[0, 0, 1, 0.95])  # Adjust layout to fit the title, once the data is drawn
+
+    # Save the plot
+    os.makedirs(os.path.dirname(job['output_path']), exist_ok=True)
+    fig.savefig(job['output_path'])
+    print(f"File saved: {os.path.basename(job['output_path'])}")  # Print message when file is saved
+    return job['output_path']
+
+
+# Function to set up a rendering worker
+def _init_worker():
+    matplotlib.use('Agg')
+    # Close the cached figures when the worker exits
+    Finalize(None, close_cached_figures, exitpriority=10)
+
+
+class FigureQueue:
+    """
+    Queue of figure jobs rendered on a pool of Agg worker processes (in this process when jobs <= 1).
+    With skip_up_to_date, jobs whose PNG is newer than their input files are dropped. At most
+    4 * jobs figures wait in the pool: submit blocks on the oldest one beyond that, so the trial arrays
+    of the jobs are released as they are rendered. The pool can also run other work (e.g. map_subjects).
+    """
+
+    def __init__(self, jobs=1, skip_up_to_date=False):
+        self.skip_up_to_date = skip_up_to_date
+        self.pool = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker) if jobs > 1 else None
+        self.max_pending = 4 * jobs
+        self.futures = deque()
+        self.n_skipped = 0
+
+    def submit(self, job):
+        if len(job['trials']) == 0:
+            return
+        if self.skip_up_to_date and is_up_to_date(job['output_path'], job['input_files']):
+            self.n_skipped += 1
+            return
+
+        if self.pool is None:
+            render_trial_figure(job)
+        else:
+            self.futures.append(self.pool.submit(render_trial_figure, job))
+            while len(self.futures) > self.max_pending:
+                self.futures.popleft().result()
+
+    def close(self):
+        """
+        Wait for all submitted figures (re-raising worker errors) and shut the pool down.
+        """
+        if self.pool is not None:
+            for future in self.futures:
+                future.result()
+            self.pool.shutdown()
+        else:
+            close_cached_figures()
+        if self.n_skipped:
+            print(f"Skipped {self.n_skipped} up-to-date figures")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,198 @@
+import os
+import numpy as np
+import matplotlib
+import matplotlib.patheffects as path_effects
+from concurrent.futures import ProcessPoolExecutor
+
+# Figure, axes and artists of each layout, reused from one job to the next in this process
+_figure_cache = {}
+
+
+# Function to get the black stroke drawn around histogram lines
+def stroke():
+    return [path_effects.withStroke(linewidth=3, foreground='black')]
+
+
+# Function to describe a histogram figure as pure data
+def histogram_job(style, bin_edges, counts, labels, output_path, colors=('blue', 'orange'), bar_width=0.4,
+                  alpha=None, edgecolor=None, peak_lines=False, curves=None, curve_stroke=True,
+                  title='', xlabel='', ylabel='Count', title_fontsize=None, label_fontsize=None,
+                  tick_fontsize=None, legend_fontsize=None, grid=True, tight_layout=False, bbox_inches='tight',
+                  dpi=300, figsize=(10, 6), message=None):
+    """
+    Histogram figure of one or more groups from precomputed bar heights (counts or densities, one array per group).
+
+    style 'grouped': side-by-side bars, bar_width (fraction of the bin width) wide, around the shared bin centers.
+    style 'overlap': bars spanning their bins as plt.hist draws them; bin_edges may be one array per group.
+    peak_lines joins the bar tops of each group with a stroked line; curves is an optional (x, y) per group
+    (or None) drawn over the bars, e.g. scaled KDEs. message is printed once the figure is saved.
+    """
+    n_groups = len(counts)
+    if style == 'overlap' and np.ndim(bin_edges[0]) == 1:
+        bin_edges = [np.asarray(edges, dtype=float) for edges in bin_edges]
+    else:
+        bin_edges = [np.asarray(bin_edges, dtype=float)] * n_groups
+
+    return {
+        'style': style,
+        'bin_edges': bin_edges,
+        'counts': [np.asarray(group_counts, dtype=float) for group_counts in counts],
+        'labels': list(labels),
+        'colors': list(colors)[:n_groups],
+        'bar_width': bar_width,
+        'alpha': alpha,
+        'edgecolor': edgecolor,
+        'peak_lines': peak_lines,
+        'curves': list(curves) if curves is not None else [None] * n_groups,
+        'curve_stroke': curve_stroke,
+        'title': title,
+        'xlabel': xlabel,
+        'ylabel': ylabel,
+        'title_fontsize': title_fontsize,
+        'label_fontsize': label_fontsize,
+        'tick_fontsize': tick_fontsize,
+        'legend_fontsize': legend_fontsize,
+        'grid': grid,
+        'tight_layout': tight_layout,
+        'bbox_inches': bbox_inches,
+        'dpi': dpi,
+        'figsize': tuple(figsize),
+        'output_path': str(output_path),
+        'message': message,
+    }
+
+
+# Function to get the bar positions (left edges) and widths of one group
+def _bar_geometry(job, group_i):
+    edges = job['bin_edges'][group_i]
+    if job['style'] == 'overlap':
+        return edges[:-1], np.diff(edges)
+
+    # Grouped: the first group left of the bin center, the others right of it
+    bin_centers = (edges[:-1] + edges[1:]) / 2
+    bar_width = (edges[1] - edges[0]) * job['bar_width'] if len(edges) > 1 else job['bar_width']
+    shift = (-1 if group_i == 0 else 1) * bar_width / 2
+    return bin_centers + shift - bar_width / 2, np.full(len(bin_centers), bar_width)
+
+
+# Function to get (or create once) the figure of a layout
+def _figure(figsize, tight_layout):
+    key = (figsize, tight_layout)
+    if key not in _figure_cache:
+        import matplotlib.pyplot as plt
+        fig, ax = plt.subplots(figsize=figsize)
+        _figure_cache[key] = {'fig': fig, 'ax': ax, 'bars': [], 'peak_lines': [], 'curves': []}
+    return _figure_cache[key]
+
+
+# Function to reuse (or create) the line of a group
+def _update_line(ax, lines, group_i, x, y, color, path_effect):
+    if group_i < len(lines):
+        line = lines[group_i]
+        line.set_data(x, y)
+        line.set_color(color)
+        line.set_path_effects(path_effect)
+        line.set_visible(True)
+    else:
+        lines.append(ax.plot(x, y, color=color, lw=2, path_effects=path_effect)[0])
+
+
+# Function to render one histogram figure
+def render_histogram(job):
+    """
+    Draw a histogram job into the cached figure of its layout, updating the bars and lines of the previous
+    figure instead of re-creating the axes, and save it.
+    """
+    state = _figure(job['figsize'], job['tight_layout'])
+    fig, ax = state['fig'], state['ax']
+    n_groups = len(job['counts'])
+
+    for group_i, (heights, label, color) in enumerate(zip(job['counts'], job['labels'], job['colors'])):
+        left, widths = _bar_geometry(job, group_i)
+
+        # Bars: update the rectangles in place when the number of bins is unchanged
+        bars = state['bars']
+        if group_i < len(bars) and len(bars[group_i]) == len(heights):
+            for rect, x, width, height in zip(bars[group_i], left, widths, heights):
+                rect.set_x(x)
+                rect.set_width(width)
+                rect.set_height(height)
+        else:
+            container = ax.bar(left, heights, width=widths, align='edge')
+            if group_i < len(bars):
+                bars[group_i].remove()
+                bars[group_i] = container
+            else:
+                bars.append(container)
+        for rect in bars[group_i]:
+            rect.set_facecolor(color)
+            rect.set_edgecolor(job['edgecolor'] if job['edgecolor'] is not None else 'none')
+            rect.set_alpha(job['alpha'])
+        bars[group_i].set_label(label)
+
+        # Lines joining the bar tops
+        edges = job['bin_edges'][group_i]
+        if job['peak_lines']:
+            _update_line(ax, state['peak_lines'], group_i, (edges[:-1] + edges[1:]) / 2, heights, color, stroke())
+        elif group_i < len(state['peak_lines']):
+            state['peak_lines'][group_i].set_visible(False)
+
+        # Curves drawn over the bars
+        curve = job['curves'][group_i]
+        if curve is not None:
+            _update_line(ax, state['curves'], group_i, curve[0], curve[1], color,
+                         stroke() if job['curve_stroke'] else [])
+        elif group_i < len(state['curves']):
+            state['curves'][group_i].set_visible(False)
+
+    # Drop the artists of groups the previous figure had in excess
+    for container in state['bars'][n_groups:]:
+        container.remove()
+    del state['bars'][n_groups:]
+    for line in state['peak_lines'][n_groups:] + state['curves'][n_groups:]:
+        line.set_visible(False)
+
+    # Text and decorations (set explicitly, a reused axes keeps the previous sizes otherwise)
+    rc = matplotlib.rcParams
+    ax.set_title(job['title'], **({'fontsize': job['title_fontsize']} if job['title_fontsize'] else {}))
+    ax.set_xlabel(job['xlabel'], fontsize=job['label_fontsize'] or rc['axes.labelsize'])
+    ax.set_ylabel(job['ylabel'], fontsize=job['label_fontsize'] or rc['axes.labelsize'])
+    ax.tick_params(axis='x', labelsize=job['tick_fontsize'] or rc['xtick.labelsize'])
+    ax.tick_params(axis='y', labelsize=job['tick_fontsize'] or rc['ytick.labelsize'])
+    ax.legend(handles=state['bars'], fontsize=job['legend_fontsize'])
+    ax.grid(job['grid'])
+
+    ax.relim(visible_only=True)
+    ax.autoscale_view()
+    if job['tight_layout']:
+        fig.tight_layout()
+
+    os.makedirs(os.path.dirname(job['output_path']), exist_ok=True)
+    fig.savefig(job['output_path'], dpi=job['dpi'], bbox_inches=job['bbox_inches'])
+    if job['message']:
+        print(job['message'])
+    return job['output_path']
+
+
+# Function to set up a rendering worker
+def _init_worker():
+    matplotlib.use('Agg')
+
+
+# Function to render a batch of histogram jobs
+def render_histograms(jobs, n_jobs=1, preview=False, preview_dpi=72):
+    """
+    Render histogram jobs, on a pool of n_jobs Agg processes when n_jobs > 1.
+    preview renders every figure at preview_dpi instead of its own dpi, for quick checks.
+    """
+    jobs = list(jobs)
+    if preview:
+        jobs = [dict(job, dpi=preview_dpi) for job in jobs]
+
+    if n_jobs <= 1 or len(jobs) <= 1:
+        return [render_histogram(job) for job in jobs]
+
+    # Chunks keep consecutive (similar) figures on the same worker, so its artists get reused
+    n_workers = min(n_jobs, len(jobs))
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker) as pool:
+        return list(pool.map(render_histogram, jobs, chunksize=max(1, len(jobs) // (4 * n_workers))))
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+
+# Function to hash the content of a file
+def file_hash(path, chunk_size=1 << 20):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+# Function to get the path of the manifest that belongs to an output CSV
+def manifest_path(output_csv):
+    output_csv = Path(output_csv)
+    return output_csv.with_name(f'{output_csv.stem}.manifest.json')
+
+
+class Manifest:
+    """
+    Records, for every key (usually a subject), the input files (size, mtime, sha1) and parameters
+    that produced its rows in the output CSV, so unchanged keys can be skipped on the next run.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        if self.path.exists():
+            with open(self.path, 'r') as file:
+                self.entries = json.load(file)
+        else:
+            self.entries = {}
+
+    def _signatures(self, key, input_files):
+        """
+        Signatures of the existing input files; the hash is only recomputed when size or mtime changed.
+        """
+        recorded = self.entries.get(key, {}).get('files', {})
+        signatures = {}
+        for path in map(Path, input_files):
+            if not path.exists():
+                continue
+            stat = path.stat()
+            previous = recorded.get(str(path))
+            if previous is not None and previous['size'] == stat.st_size and previous['mtime'] == stat.st_mtime_ns:
+                sha1 = previous['sha1']
+            else:
+                sha1 = file_hash(path)
+            signatures[str(path)] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha1': sha1}
+        return signatures
+
+    def is_current(self, key, input_files, params=None):
+        """
+        True when the key was computed from the same set of input files, with the same content and parameters.
+        """
+        entry = self.entries.get(key)
+        if entry is None or entry.get('params') != params:
+            return False
+
+        recorded = entry['files']
+        signatures = self._signatures(key, input_files)
+        return (signatures.keys() == recorded.keys()
+                and all(signatures[path]['sha1'] == recorded[path]['sha1'] for path in signatures))
+
+    def update(self, key, input_files, params=None):
+        self.entries[key] = {'files': self._signatures(key, input_files), 'params': params}
+
+    def save(self):
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w') as file:
+            json.dump(self.entries, file, indent=1)
+        tmp_path.replace(self.path)
+
+
+# Function to merge recomputed rows into an existing output table
+def merge_rows(old_df, new_df, keys, recomputed, key_cols=('subject',)):
+    """
+    Keep the old rows of keys that were not recomputed, add the new rows, and order everything by `keys`
+    (row order within a key is kept). Rows of keys that are no longer listed are dropped.
+
+    Returns the merged frame and, for each of its rows, its position in pd.concat([old_df, new_df]).
+    """
+    def row_keys(df):
+        if df.empty:
+            return []
+        if len(key_cols) == 1:
+            return list(df[key_cols[0]])
+        return list(zip(*(df[col] for col in key_cols)))
+
+    key_order = {key: order for order, key in enumerate(keys)}
+    kept = set(keys) - set(recomputed)
+
+    old_keys, new_keys = row_keys(old_df), row_keys(new_df)
+    source = np.concatenate([
+        np.flatnonzero([key in kept for key in old_keys]),
+        len(old_df) + np.arange(len(new_df)),
+    ]).astype(int)
+    all_keys = old_keys + new_keys
+    source = source[np.argsort([key_order[all_keys[i]] for i in source], kind='stable')]
+
+    merged = pd.concat([old_df, new_df], ignore_index=True).iloc[source].reset_index(drop=True)
+    return merged, source
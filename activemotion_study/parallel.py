@@ -0,0 +1,33 @@
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Function to run a per-subject worker over all subjects
+def map_subjects(worker, subjects, jobs=1, pool=None):
+    """
+    Call worker(subject) for every subject, on a pool of `jobs` processes when jobs > 1 (or on the
+    given pool, e.g. the one of a FigureQueue). Results are yielded in subject order as soon as they
+    are available; at most 2 * jobs subjects are in flight, so only a few results are held at once.
+    """
+    subjects = list(subjects)
+    if pool is None and (jobs <= 1 or len(subjects) <= 1):
+        for subject in subjects:
+            yield worker(subject)
+        return
+
+    if pool is None:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(subjects))) as pool:
+            yield from _map_in_order(pool, worker, subjects, 2 * jobs)
+    else:
+        yield from _map_in_order(pool, worker, subjects, 2 * max(jobs, 1))
+
+
+# Function to submit a worker over subjects with a bounded number of pending results
+def _map_in_order(pool, worker, subjects, max_pending):
+    pending = deque()
+    for subject in subjects:
+        pending.append(pool.submit(worker, subject))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
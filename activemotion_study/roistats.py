@@ -0,0 +1,34 @@
+import pandas as pd
+
+# Sub-brick labels of 3dDeconvolve: '<stim>#<tent>_Coef', '<stim>#<tent>_Tstat', '<stim>_Fstat',
+# '<stim>_overall_GLT#0_Coef' for the GLTs and 'Full_Fstat'
+LABEL_PATTERN = r'^(?P<name>.+?)(?:#(?P<tent>\d+))?_(?P<stat>Coef|Tstat|Fstat)$'
+
+
+# Function to parse the Sub-brick labels of a 3dROIstats table
+def parse_subbrick_labels(sub_bricks):
+    """
+    Split labels such as '12[cough#3_Tstat]' into movement, overall (GLT) flag, GLT suffix (what follows
+    '_overall', '' for '<stim>_overall#0_Coef'), tent index and statistic.
+    Labels that do not follow the 3dDeconvolve naming get NaN fields.
+    """
+    labels = sub_bricks.astype(str).str.strip().str.replace(r'^\d*\[|\]$', '', regex=True)
+    parts = labels.str.extract(LABEL_PATTERN)
+
+    return pd.DataFrame({
+        'movement': parts['name'].str.replace(r'_overall.*$', '', regex=True),
+        'overall': parts['name'].str.contains('_overall', na=False),
+        'glt': parts['name'].str.extract(r'_overall_?(.*)$', expand=False),
+        'tent': pd.to_numeric(parts['tent']).astype('Int64'),
+        'stat': parts['stat'],
+    }, index=sub_bricks.index)
+
+
+# Function to read a 3dROIstats output file
+def read_roistats(stats_file):
+    """
+    Read a 3dROIstats table once and add the parsed Sub-brick columns (movement, overall, glt, tent, stat).
+    """
+    roistats = pd.read_csv(stats_file, delimiter="\t")
+    roistats.columns = roistats.columns.str.strip()
+    return roistats.join(parse_subbrick_labels(roistats['Sub-brick']))
@@ -0,0 +1,125 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import shapiro, normaltest, ttest_ind, mannwhitneyu, f as f_dist, norm
+
+
+# Function to check the normality of a series of any length
+def normality_pvalue(values, max_shapiro=5000):
+    """
+    Shapiro-Wilk p-value up to max_shapiro samples (the range where its p-value is accurate),
+    D'Agostino-Pearson (normaltest) beyond that.
+    """
+    values = np.asarray(values, dtype=float)
+    if len(values) <= max_shapiro:
+        return shapiro(values).pvalue
+    return normaltest(values).pvalue
+
+
+# Function to stack the samples of all pairs into one array
+def _stack_pairs(pairs):
+    """
+    Values of all samples concatenated, with the sample id (2 * pair + 0 for x, + 1 for y) of each value.
+    """
+    samples = [np.asarray(sample, dtype=float).ravel() for pair in pairs for sample in pair]
+    sizes = np.array([len(sample) for sample in samples])
+    return np.concatenate(samples), np.repeat(np.arange(len(samples)), sizes), sizes
+
+
+# Function to run Levene's test on many pairs of samples at once
+def batched_levene(pairs):
+    """
+    p-values of Levene's test (median centered, as scipy.stats.levene by default) for every (x, y) pair.
+    All samples are sorted once for the medians and the sums are grouped reductions.
+    """
+    values, sample_id, sizes = _stack_pairs(pairs)
+    pair_id = sample_id // 2
+    n_pairs = len(pairs)
+
+    # Median of every sample from one sort of all values by (sample, value)
+    sorted_values = values[np.lexsort((values, sample_id))]
+    starts = np.r_[0, np.cumsum(sizes)[:-1]]
+    medians = (sorted_values[starts + (sizes - 1) // 2] + sorted_values[starts + sizes // 2]) / 2
+
+    # Absolute deviations from the sample medians, and their sample and pair means
+    z = np.abs(values - medians[sample_id])
+    z_sample = np.bincount(sample_id, z, len(sizes)) / sizes
+    pair_sizes = np.bincount(pair_id, minlength=n_pairs)
+    z_pair = np.bincount(pair_id, z, n_pairs) / pair_sizes
+
+    # W = (N - k) / (k - 1) * between-sample / within-sample sum of squares, with k = 2
+    between = np.bincount(np.arange(len(sizes)) // 2, sizes * (z_sample - np.repeat(z_pair, 2)) ** 2, n_pairs)
+    within = np.bincount(pair_id, (z - z_sample[sample_id]) ** 2, n_pairs)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        w_stat = (pair_sizes - 2) * between / within
+
+    return f_dist.sf(w_stat, 1, pair_sizes - 2)
+
+
+# Function to run one-tailed Mann-Whitney U tests (x < y) on many pairs of samples at once
+def batched_mannwhitneyu_less(pairs):
+    """
+    p-values of mannwhitneyu(x, y, alternative='less') with the normal approximation (tie correction and
+    continuity correction, as scipy's asymptotic method) for every (x, y) pair. The values of all pairs are
+    ranked in one sort by (pair, value), ties getting their average rank.
+    """
+    values, sample_id, sizes = _stack_pairs(pairs)
+    pair_id = sample_id // 2
+    n_pairs = len(pairs)
+    n_x, n_y = sizes[0::2].astype(float), sizes[1::2].astype(float)
+    n = n_x + n_y
+
+    order = np.lexsort((values, pair_id))
+    sorted_values, sorted_pairs = values[order], pair_id[order]
+
+    # Runs of equal values within a pair, and the average rank (1-based, within the pair) of each run
+    run_starts = np.flatnonzero(np.r_[True, (sorted_values[1:] != sorted_values[:-1]) |
+                                      (sorted_pairs[1:] != sorted_pairs[:-1])])
+    run_lengths = np.diff(np.r_[run_starts, len(values)])
+    pair_starts = np.r_[0, np.cumsum(n)[:-1]].astype(int)
+    run_pairs = sorted_pairs[run_starts]
+    run_ranks = run_starts - pair_starts[run_pairs] + (run_lengths + 1) / 2
+
+    ranks = np.empty(len(values))
+    ranks[order] = np.repeat(run_ranks, run_lengths)
+
+    # U of x, and the tie term sum(t^3 - t) of each pair
+    is_x = sample_id % 2 == 0
+    rank_sum_x = np.bincount(pair_id[is_x], ranks[is_x], n_pairs)
+    u_x = rank_sum_x - n_x * (n_x + 1) / 2
+    tie_term = np.bincount(run_pairs, run_lengths ** 3.0 - run_lengths, n_pairs)
+
+    # alternative='less' tests U of y, large when x tends to be smaller
+    u_y = n_x * n_y - u_x
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sigma = np.sqrt(n_x * n_y / 12 * ((n + 1) - tie_term / (n * (n - 1))))
+        z = (u_y - n_x * n_y / 2 - 0.5) / sigma
+
+    return np.clip(norm.sf(z), 0, 1)
+
+
+# Function to choose and run the one-tailed test of every pair
+def select_and_test(pairs, alpha=0.05, max_shapiro=5000):
+    """
+    For every (x, y) pair, test x < y with a t-test when both samples look normal and their variances
+    equal (all screening p-values > alpha), with Mann-Whitney U otherwise.
+
+    Returns one row per pair: normality_x_p, normality_y_p, levene_p, parametric and pvalue.
+    Pairs with a sample of 8 values or less use scipy's mannwhitneyu, which may choose the exact test.
+    """
+    pairs = [(np.asarray(x, dtype=float), np.asarray(y, dtype=float)) for x, y in pairs]
+
+    results = pd.DataFrame({
+        'normality_x_p': [normality_pvalue(x, max_shapiro) for x, _ in pairs],
+        'normality_y_p': [normality_pvalue(y, max_shapiro) for _, y in pairs],
+        'levene_p': batched_levene(pairs),
+    })
+    results['parametric'] = (results[['normality_x_p', 'normality_y_p', 'levene_p']] > alpha).all(axis=1)
+    results['pvalue'] = batched_mannwhitneyu_less(pairs)
+
+    for i, (x, y) in enumerate(pairs):
+        if results.at[i, 'parametric']:
+            results.at[i, 'pvalue'] = ttest_ind(x, y, alternative='less').pvalue
+        elif min(len(x), len(y)) <= 8:
+            results.at[i, 'pvalue'] = mannwhitneyu(x, y, alternative='less').pvalue
+
+    return results
@@ -0,0 +1,109 @@
+import sys
+import numpy as np
+from functools import lru_cache
+from pathlib import Path
+
+
+class TimingFile:
+    """
+    AFNI timing file (one line per run, events as 'onset' or married 'onset:duration') as a ragged array.
+
+    All events are stored flat in onsets/durations (NaN duration when not married); the events of
+    run i are onsets[run_offsets[i]:run_offsets[i + 1]]. The raw lines are kept for writing subsets back.
+    """
+
+    def __init__(self, onsets, durations, run_offsets, lines):
+        self.onsets = onsets
+        self.durations = durations
+        self.run_offsets = run_offsets
+        self.lines = lines
+
+    @property
+    def n_runs(self):
+        return len(self.run_offsets) - 1
+
+    def run(self, run_idx):
+        """
+        Onsets and durations of one run (0-based).
+        """
+        start, stop = self.run_offsets[run_idx], self.run_offsets[run_idx + 1]
+        return self.onsets[start:stop], self.durations[start:stop]
+
+    def select_runs(self, run_indices):
+        """
+        New TimingFile with the given runs (0-based), in the given order.
+        """
+        run_indices = np.asarray(run_indices, dtype=int)
+        starts = self.run_offsets[run_indices]
+        lengths = self.run_offsets[run_indices + 1] - starts
+
+        run_offsets = np.zeros(len(run_indices) + 1, dtype=int)
+        np.cumsum(lengths, out=run_offsets[1:])
+        idx = np.arange(run_offsets[-1]) + np.repeat(starts - run_offsets[:-1], lengths)
+
+        return TimingFile(self.onsets[idx], self.durations[idx], run_offsets,
+                          tuple(self.lines[run_idx] for run_idx in run_indices))
+
+    def global_onsets(self, run_lengths, sampling_interval=0.8):
+        """
+        Onsets on the time axis of the concatenated runs: run i is shifted by sum(run_lengths[:i]) TRs.
+        """
+        run_starts = np.concatenate([[0], np.cumsum(run_lengths)])[:self.n_runs] * sampling_interval
+        return self.onsets + np.repeat(run_starts, np.diff(self.run_offsets))
+
+
+# Function to parse the content of a timing file
+def parse_timing_lines(lines):
+    """
+    Parse timing file lines in one pass; '*' (no events) and comment lines are handled.
+    """
+    lines = tuple(line.rstrip('\n') for line in lines if not line.startswith('#'))
+    run_events = [[event for event in line.split() if event != '*'] for line in lines]
+
+    run_offsets = np.zeros(len(run_events) + 1, dtype=int)
+    np.cumsum([len(events) for events in run_events], out=run_offsets[1:])
+
+    # Split all 'onset:duration' tokens at once
+    events = np.array([event for events in run_events for event in events], dtype=str)
+    parts = np.char.partition(events, ':').reshape(-1, 3)
+    onsets = parts[:, 0].astype(float)
+    durations = np.full(onsets.shape, np.nan)
+    married = parts[:, 1] == ':'
+    durations[married] = parts[married, 2].astype(float)
+
+    return TimingFile(onsets, durations, run_offsets, lines)
+
+
+@lru_cache(maxsize=None)
+def _read_timing_file(path, mtime_ns):
+    with open(path, 'r') as file:
+        timing = parse_timing_lines(file.readlines())
+
+    # Cached objects are shared between callers, keep them read-only
+    for array in (timing.onsets, timing.durations, timing.run_offsets):
+        array.flags.writeable = False
+    return timing
+
+
+# Function to read a timing file
+def read_timing_file(path):
+    """
+    Read and parse a timing file; parsed files are cached until they change on disk.
+    """
+    path = Path(path)
+    return _read_timing_file(str(path), path.stat().st_mtime_ns)
+
+
+# Function to write a timing file
+def write_timing_file(path, timing):
+    """
+    Write the runs of a TimingFile, one line per run, as they were read.
+    """
+    with open(path, 'w') as file:
+        file.writelines(f'{line}\n' for line in timing.lines)
+
+
+# Usage: python timing_files.py <input.1D> <output.1D> <run> [<run> ...]   (runs are 1-based)
+if __name__ == '__main__':
+    input_file, output_file, *runs = sys.argv[1:]
+    write_timing_file(output_file, read_timing_file(input_file).select_runs([int(run) - 1 for run in runs]))
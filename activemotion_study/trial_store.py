@@ -0,0 +1,71 @@
+import numpy as np
+from pathlib import Path
+
+
+# Function to get the paths of the binary trial store that sits next to a metrics CSV
+def trial_store_paths(csv_path):
+    """
+    Trials are stored as two .npy files next to the CSV: all samples as one float32 vector
+    and an int64 offsets index (row i spans values[offsets[i]:offsets[i + 1]]).
+    """
+    csv_path = Path(csv_path)
+    return (csv_path.with_name(f'{csv_path.stem}_trials.npy'),
+            csv_path.with_name(f'{csv_path.stem}_trial_offsets.npy'))
+
+
+# Function to save the trials of a metrics table
+def save_trials(csv_path, trials):
+    """
+    Save a list of 1D trial arrays, one per CSV row and in the same order as the rows.
+    """
+    values_path, offsets_path = trial_store_paths(csv_path)
+
+    lengths = np.fromiter((len(trial) for trial in trials), dtype=np.int64, count=len(trials))
+    offsets = np.zeros(len(trials) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    values = np.empty(offsets[-1], dtype=np.float32)
+    for trial, start, stop in zip(trials, offsets[:-1], offsets[1:]):
+        values[start:stop] = trial
+
+    np.save(values_path, values)
+    np.save(offsets_path, offsets)
+
+
+# Function to load the trials of a metrics table
+def load_trials(csv_path, mmap_mode='r'):
+    """
+    Load the trial store of a metrics CSV (memory-mapped by default).
+    """
+    values_path, offsets_path = trial_store_paths(csv_path)
+    return TrialStore(np.load(values_path, mmap_mode=mmap_mode), np.load(offsets_path))
+
+
+class TrialStore:
+    """
+    Ragged array of trials: row i of the metrics CSV is values[offsets[i]:offsets[i + 1]].
+    """
+
+    def __init__(self, values, offsets):
+        self.values = values
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        return self.values[self.offsets[row]:self.offsets[row + 1]]
+
+    def concat(self, rows):
+        """
+        Concatenate the trials of the given row positions with a single gather.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = self.offsets[rows]
+        lengths = self.offsets[rows + 1] - starts
+
+        # Shift a running index by each row's start so that every selected sample is read once
+        out_starts = np.cumsum(lengths) - lengths
+        idx = np.arange(lengths.sum()) + np.repeat(starts - out_starts, lengths)
+
+        return np.asarray(self.values[idx], dtype=float)
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import t as t_dist
+
+
+# Function to sort voxels by label and find the segment of each label
+def label_segments(labels):
+    """
+    Stable sort order of the voxels by label, the unique labels and the start/size of each label's segment.
+    """
+    labels = np.asarray(labels)
+    order = np.argsort(labels, kind='stable')
+    sorted_labels = labels[order]
+    starts = np.flatnonzero(np.r_[True, sorted_labels[1:] != sorted_labels[:-1]]) if labels.size else np.array([], dtype=int)
+    counts = np.diff(np.r_[starts, labels.size])
+    return order, sorted_labels[starts], starts, counts
+
+
+# Function to compute the count, mean and M2 of every column within every label
+def grouped_moments(values, labels):
+    """
+    Sufficient statistics of values (voxels x columns) per label: the unique labels, the voxel counts and
+    the (labels x columns) means and M2 (sums of squared deviations from the mean). Voxels are sorted by
+    label once and the sums are segmented reductions, so the cost is one pass over the matrix.
+    """
+    values = np.asarray(values, dtype=float)
+    order, groups, starts, counts = label_segments(labels)
+    if groups.size == 0:
+        empty = np.empty((0, values.shape[1]))
+        return groups, counts, empty, empty
+
+    sorted_values = values[order]
+    mean = np.add.reduceat(sorted_values, starts, axis=0) / counts[:, None]
+
+    # Second pass on the deviations, more accurate than sum of squares minus squared sum
+    deviations = sorted_values - np.repeat(mean, counts, axis=0)
+    m2 = np.add.reduceat(deviations ** 2, starts, axis=0)
+
+    return groups, counts, mean, m2
+
+
+# Function to run one-sample t-tests from sufficient statistics
+def ttest_from_moments(count, mean, m2, popmean=0, alternative='greater'):
+    """
+    t and p of a one-sample t-test (as ttest_1samp) from the count, mean and M2 of the samples.
+    """
+    count = np.asarray(count, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        std_err = np.sqrt(m2 / (count - 1) / count)
+        t_stat = (mean - popmean) / std_err
+
+    df = np.broadcast_to(count - 1, np.shape(t_stat))
+    if alternative == 'greater':
+        p_val = t_dist.sf(t_stat, df)
+    elif alternative == 'less':
+        p_val = t_dist.cdf(t_stat, df)
+    else:
+        p_val = 2 * t_dist.sf(np.abs(t_stat), df)
+
+    return t_stat, p_val
+
+
+# Function to run one-sample t-tests for all labels and columns at once
+def grouped_ttest_1samp(values, labels, popmean=0, alternative='greater'):
+    """
+    One-sample t-test of every column of values (voxels x columns) within every label, as ttest_1samp would
+    give on values[labels == label, col].
+
+    Returns the unique labels, the voxel counts and the (labels x columns) arrays mean, M2, t and p.
+    """
+    groups, counts, mean, m2 = grouped_moments(values, labels)
+    t_stat, p_val = ttest_from_moments(counts[:, None], mean, m2, popmean, alternative)
+    return groups, counts, mean, m2, t_stat, p_val
+
+
+# Function to run the grouped t-tests and return them as a tidy table
+def grouped_ttest_table(values, labels, columns, popmean=0, alternative='greater'):
+    """
+    Tidy version of grouped_ttest_1samp: one row per (label, column), label-major,
+    with the columns label, column, t_stat, p_val, n_voxels, mean and m2.
+    """
+    groups, counts, mean, m2, t_stat, p_val = grouped_ttest_1samp(values, labels, popmean, alternative)
+    n_cols = len(columns)
+
+    return pd.DataFrame({
+        'label': np.repeat(groups, n_cols),
+        'column': np.tile(np.asarray(columns, dtype=object), len(groups)),
+        't_stat': t_stat.ravel(),
+        'p_val': p_val.ravel(),
+        'n_voxels': np.repeat(counts, n_cols),
+        'mean': mean.ravel(),
+        'm2': m2.ravel(),
+    })
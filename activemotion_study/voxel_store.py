@@ -0,0 +1,65 @@
+import sys
+import json
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+
+# Function to get the paths of the binary voxel store that sits next to a voxels_masked dump
+def voxel_store_paths(voxel_file):
+    """
+    The store is three files next to the text dump: the float32 betas (voxels x sub-bricks) and the int16
+    ROI labels as .npy, and the sub-brick names as JSON.
+    """
+    voxel_file = Path(voxel_file)
+    return (voxel_file.with_name(f'{voxel_file.stem}_betas.npy'),
+            voxel_file.with_name(f'{voxel_file.stem}_labels.npy'),
+            voxel_file.with_name(f'{voxel_file.stem}_subbricks.json'))
+
+
+# Function to read a whitespace-separated 3dmaskdump table
+def read_maskdump(dump_file, dtype=np.float32):
+    return pd.read_csv(dump_file, sep=r'\s+', header=None, dtype=dtype, engine='c').values
+
+
+# Function to convert the text dumps of one hemisphere/condition to the binary store
+def convert_voxel_dumps(voxel_file, label_file, roistats_file):
+    """
+    Convert 3dmaskdump outputs once: betas (columns after i, j, k) as float32, the ROI label
+    (last column of the label dump) as int16 and the Sub-brick names of the matching roistats table.
+    """
+    betas_path, labels_path, subbricks_path = voxel_store_paths(voxel_file)
+
+    betas = read_maskdump(voxel_file)[:, 3:]
+    labels = read_maskdump(label_file)[:, -1].astype(np.int16)
+    roistats = pd.read_csv(roistats_file, sep='\t')
+    roistats.columns = roistats.columns.str.strip()
+    subbrick_names = roistats['Sub-brick'].tolist()
+
+    np.save(betas_path, np.ascontiguousarray(betas))
+    np.save(labels_path, labels)
+    with open(subbricks_path, 'w') as file:
+        json.dump(subbrick_names, file)
+
+
+# Function to load the voxels of one hemisphere/condition
+def load_voxels(voxel_file, label_file, roistats_file, mmap_mode='r'):
+    """
+    Load (betas, labels, sub-brick names) from the binary store (betas memory-mapped by default).
+    The store is (re)built from the text dumps when it is missing or older than them.
+    """
+    betas_path, labels_path, subbricks_path = voxel_store_paths(voxel_file)
+
+    sources_mtime = max(Path(path).stat().st_mtime_ns for path in (voxel_file, label_file, roistats_file))
+    if not all(path.exists() and path.stat().st_mtime_ns >= sources_mtime
+               for path in (betas_path, labels_path, subbricks_path)):
+        convert_voxel_dumps(voxel_file, label_file, roistats_file)
+
+    with open(subbricks_path, 'r') as file:
+        subbrick_names = json.load(file)
+    return np.load(betas_path, mmap_mode=mmap_mode), np.load(labels_path), subbrick_names
+
+
+# Usage: python voxel_store.py <voxels_masked.csv> <voxels_labels.csv> <roistats.csv>
+if __name__ == '__main__':
+    convert_voxel_dumps(*sys.argv[1:4])
@@ -1,10 +1,22 @@
+import argparse
+import sys
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
 from pathlib import Path
 from collections import defaultdict
-from scipy.stats import gaussian_kde
-import matplotlib.patheffects as path_effects
+
+# Helpers shared with the active motion study are imported from its folder
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'activemotion_study'))
+from streaming_stats import StreamingHistogram
+from kde import binned_kde
+from histogram_plots import histogram_job, render_histograms
+from motion_catalog import datasets, load_motion_catalog
+from motion_files import load_motion_file
+
+parser = argparse.ArgumentParser(description='Plot the motion parameter distributions of both movie datasets.')
+parser.add_argument('--jobs', type=int, default=1, help='number of processes rendering the histograms')
+parser.add_argument('--preview', action='store_true', help='render the histograms at low dpi for a quick check')
+args = parser.parse_args()
 
 
 # ------------------- Setup ------------------- #
@@ -16,205 +28,146 @@ overlap_dir.mkdir(parents=True, exist_ok=True)
 grouped_dir.mkdir(parents=True, exist_ok=True)
 normalised_dir.mkdir(parents=True, exist_ok=True)
 
-datasets = {
-    'Movie I': Path('derivatives_nndb'),
-    'Movie II': Path('derivatives_btf')
-}
 motion_param_labels = ['roll', 'pitch', 'yaw', 'dS', 'dL', 'dP']
-bad_subjects_movie2 = ['03', '07', '24', '37', '39', '43']  # based on the notes from the operator
-
-# Load run length data and filter NNDB runs with >= 600 TRs
-run_info = pd.read_csv('run_lengths.csv')
-valid_nndb_runs = run_info[(run_info['dataset'] == 'NNdb') & (run_info['n_trs'] >= 600)]
 
-# Convert to a dict: subject_id -> list of valid run indices (1-based)
-valid_run_indices = defaultdict(list)
-valid_run_lengths = defaultdict(list)
-for _, row in valid_nndb_runs.iterrows():
-    subj = str(row['subject']).zfill(2)
-    valid_run_indices[subj].append(int(row['run_i']))
-    valid_run_lengths[subj].append(int(row['n_trs']))
+# Subjects, results folders and motion files of both datasets, bad Movie II subjects (based on the notes
+# from the operator) and runs, TR offsets and NNDB runs with >= 600 TRs of every subject
+catalog = load_motion_catalog()
+run_index = catalog.run_index
 
 
 # ------------------- Data Collection ------------------- #
-displacement = defaultdict(list)
-displacement_delt = defaultdict(list)  # New: delta motion
-motion_params = defaultdict(lambda: defaultdict(list))  # dataset -> param -> list of values
-
-for label, base_path in datasets.items():
-    for subject in sorted(base_path.iterdir()):
-        subj_id = subject.name.replace('sub-', '').zfill(2)
-        if label == 'Movie II' and subj_id in bad_subjects_movie2:
-            print(f"Skipping bad MovieProject2 subject: {subject.name}")
+# Histograms updated file by file, so memory does not grow with the number of subjects and TRs
+# 03_normalize_runs.py writes the normalized files with 3 (mm) or 4 (dfile) decimals, so bins of 1e-4 keep
+# their values exact (the AFNI _delt files are within one bin)
+hist_width = 1e-4
+displacement = defaultdict(lambda: StreamingHistogram(hist_width))
+displacement_delt = defaultdict(lambda: StreamingHistogram(hist_width))  # New: delta motion
+motion_params = defaultdict(lambda: defaultdict(lambda: StreamingHistogram(hist_width)))  # dataset -> param -> histogram
+
+for label in datasets:
+    for subj_id in catalog.subject_ids(label, include_bad=True):
+        if catalog.is_bad(label, subj_id):
+            print(f"Skipping bad MovieProject2 subject: {catalog.subject_folder(label, subj_id).name}")
             continue
 
-        results_path = subject / f"{subject.name}.results"
-        if not results_path.exists():
+        if not catalog.has_results(label, subj_id):
             continue
 
         if label == 'Movie I':
-            if subj_id not in valid_run_indices:
+            if not run_index.valid_runs(subj_id):
                 print(f"Skipping subject with no valid runs: sub-{subj_id}")
                 continue
 
         # Max displacement
-        for file in sorted(results_path.glob('mm.r0[0-9]*_norm_downsampled')):
+        for file in catalog.motion_files(label, subj_id, 'mm.r0[0-9]*_norm_downsampled'):
             run_num = int(file.name.split('.')[1][1:3])
-            if label == 'Movie I' and run_num not in valid_run_indices[subj_id]:
+            if label == 'Movie I' and run_num not in run_index.valid_runs(subj_id):
                 continue
             if '_delt' in file.name or '_norm_norm' in file.name:
                 continue
             try:
-                data = np.loadtxt(file, skiprows=2)
-                displacement[label].extend(np.abs(data))
+                data = load_motion_file(file, skiprows=2)
+                displacement[label].add(np.abs(data))
             except Exception as e:
                 print(f"Could not load {file}: {e}")
 
         # Delta displacement
-        for file in results_path.glob('mm.r0*_delt'):
+        for file in catalog.motion_files(label, subj_id, 'mm.r0*_delt'):
             run_num = int(file.name.split('.')[1][1:3])
-            if label == 'Movie I' and run_num not in valid_run_indices[subj_id]:
+            if label == 'Movie I' and run_num not in run_index.valid_runs(subj_id):
                 continue
             if '_norm' in file.name:
                 continue
             try:
-                data = np.loadtxt(file, skiprows=2)
-                displacement_delt[label].extend(np.abs(data))
+                data = load_motion_file(file, skiprows=2)
+                displacement_delt[label].add(np.abs(data))
             except Exception as e:
                 print(f"Could not load {file}: {e}")
 
         # 6 motion parameters
-        dfile = results_path / 'dfile_rall_norm_downsampled.1D'
-        if dfile.exists():
+        dfile = catalog.results_folder(label, subj_id) / 'dfile_rall_norm_downsampled.1D'
+        if catalog.has_motion_file(label, subj_id, dfile.name):
             try:
-                data = np.loadtxt(dfile, comments='#')
+                data = load_motion_file(dfile)
 
                 if label == 'Movie I':
-                    # Get all run lengths (valid and invalid) for this subject
-                    all_runs = run_info[
-                        (run_info['dataset'] == 'NNdb') & (run_info['subject'] == int(subj_id))].sort_values(by='run_i')
-
-                    valid_runs = valid_run_indices[subj_id]
-                    valid_tr_slices = []
-                    tr_start = 0
-
-                    for _, row in all_runs.iterrows():
-                        tr_count = int(row['n_trs'])
-                        run_i = int(row['run_i'])
+                    for run_i, tr_count in run_index.invalid_runs(subj_id):
+                        print(f"Skipping sub-{subj_id} run-{str(run_i).zfill(2)} with {tr_count} TRs")
 
-                        if run_i in valid_runs:
-                            valid_tr_slices.append((tr_start, tr_start + tr_count))
-                        else:
-                            print(f"Skipping sub-{subj_id} run-{str(run_i).zfill(2)} with {tr_count} TRs")
-
-                        tr_start += tr_count
-
-                    # Concatenate only the TRs from valid runs
-                    valid_data = np.concatenate([data[start:end] for start, end in valid_tr_slices], axis=0)
+                    # Gather only the TRs from valid runs
+                    valid_data = data[run_index.gather_index(subj_id, len(data))]
                 else:
                     valid_data = data
 
                 for i, param in enumerate(motion_param_labels):
-                    motion_params[label][param].extend(np.abs(valid_data[:, i]))
+                    motion_params[label][param].add(np.abs(valid_data[:, i]))
 
             except Exception as e:
                 print(f"Could not load {dfile}: {e}")
 
 
 # ------------------- Plotting Function ------------------- #
-def plot_distributions(param_name, values_dict, unit_label, overlap_path, grouped_path):
-    # Collect values
-    all_vals = np.concatenate([np.array(values_dict[k]) for k in values_dict])
-    bin_edges = np.linspace(0, np.percentile(all_vals, 99), 60)
-    bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
-    bar_width = (bin_edges[1] - bin_edges[0]) * 0.4
-
-    # Histogram counts
-    counts = {}
-    for label in values_dict:
-        counts[label], _ = np.histogram(values_dict[label], bins=bin_edges)
-
-    # ---------- Overlapping Histogram + KDE ---------- #
-    plt.figure(figsize=(10, 6))
-    for label, color in zip(values_dict, ['blue', 'orange']):
-        data = np.array(values_dict[label])
-        plt.hist(data, bins=bin_edges, alpha=0.5, color=color, label=f"{label} (hist)", edgecolor='black')
-        kde = gaussian_kde(data)
-        x_vals = np.linspace(bin_edges.min(), bin_edges.max(), 1000)
-        bin_width = bin_edges[1] - bin_edges[0]
-        plt.plot(
-            x_vals,
-            kde(x_vals) * len(data) * bin_width,
-            color=color,
-            lw=2,
-            path_effects=[path_effects.withStroke(linewidth=3, foreground='black')]
-        )
-
-    plt.title(f'Distribution of {param_name}')
-    plt.xlabel(unit_label)
-    plt.ylabel('Count')
-    plt.legend()
-    plt.grid(True)
-    plt.savefig(overlap_path / f"{param_name}_distribution.png", dpi=300, bbox_inches='tight')
-    plt.close()
-
-    # ---------- Grouped Bar Plot + Peak Lines ---------- #
-    plt.figure(figsize=(10, 6))
-    for idx, (label, color) in enumerate(zip(values_dict, ['blue', 'orange'])):
-        shift = (-1 if idx == 0 else 1) * bar_width / 2
-        plt.bar(bin_centers + shift, counts[label], width=bar_width, color=color, label=label)
-
-    # Connect peaks
-    for label, color in zip(values_dict, ['blue', 'orange']):
-        plt.plot(bin_centers, counts[label], color=color, lw=2,
-                 path_effects=[path_effects.withStroke(linewidth=3, foreground='black')])
-
-    plt.title(f'Distribution of {param_name} metric', fontsize=22)
-    plt.xlabel(unit_label, fontsize=18)
-    plt.ylabel('Count', fontsize=18)
-    plt.xticks(fontsize=16)
-    plt.yticks(fontsize=16)
-    plt.legend(fontsize=16)
-    plt.grid(True)
-    plt.savefig(grouped_path / f"{param_name}_grouped_distribution.png", dpi=300, bbox_inches='tight')
-    plt.close()
-
-    # ---------- Normalised Grouped Plot (Density) ---------- #
-    plt.figure(figsize=(10, 6))
-
-    for idx, (label, color) in enumerate(zip(values_dict, ['blue', 'orange'])):
-        shift = (-1 if idx == 0 else 1) * bar_width / 2
-        norm_counts = counts[label] / np.sum(counts[label])
-        plt.bar(bin_centers + shift, norm_counts, width=bar_width, color=color, label=label)
-
-    for label, color in zip(values_dict, ['blue', 'orange']):
-        norm_counts = counts[label] / np.sum(counts[label])
-        plt.plot(bin_centers, norm_counts, color=color, lw=2,
-                 path_effects=[path_effects.withStroke(linewidth=3, foreground='black')])
-
-    plt.title(f'Distribution of {param_name} metric', fontsize=22)
-    plt.xlabel(unit_label, fontsize=18)
-    plt.ylabel('Density', fontsize=18)
-    plt.xticks(fontsize=16)
-    plt.yticks(fontsize=16)
-    plt.legend(fontsize=16)
-    plt.grid(True)
-    plt.savefig(normalised_dir / f"{param_name}_grouped_normalised.png", dpi=300, bbox_inches='tight')
-    plt.close()
+def distribution_jobs(param_name, hist_dict, unit_label, overlap_path, grouped_path):
+    # Bins up to the 99th percentile of all datasets together
+    pooled = StreamingHistogram(hist_width)
+    for hist in hist_dict.values():
+        pooled.merge(hist)
+    bin_edges = np.linspace(0, pooled.percentile(99), 60)
+    bin_width = bin_edges[1] - bin_edges[0]
+    labels = list(hist_dict)
+
+    # Histogram counts and KDE curves (scaled to counts), re-binned from the accumulated histograms
+    counts = []
+    kde_curves = []
+    for label in labels:
+        hist = hist_dict[label]
+        counts.append(hist.histogram(bin_edges))
+        x_vals, density = binned_kde(hist.values(), bin_edges, weights=hist.counts)
+        kde_curves.append((x_vals, density * hist.count * bin_width))
+
+        # Summary of the dataset
+        summary.append({'metric': param_name, 'dataset': label, 'n': hist.count, 'sum': hist.sum,
+                        'mean': hist.mean, 'min': hist.min, 'max': hist.max,
+                        'p99': hist.percentile(99)})
+    norm_counts = [label_counts / np.sum(label_counts) for label_counts in counts]
+
+    grouped_style = dict(peak_lines=True, title=f'Distribution of {param_name} metric', xlabel=unit_label,
+                         title_fontsize=22, label_fontsize=18, tick_fontsize=16, legend_fontsize=16)
+    return [
+        # ---------- Overlapping Histogram + KDE ---------- #
+        histogram_job('overlap', bin_edges, counts, [f"{label} (hist)" for label in labels],
+                      overlap_path / f"{param_name}_distribution.png", alpha=0.5, edgecolor='black',
+                      curves=kde_curves, title=f'Distribution of {param_name}', xlabel=unit_label),
+        # ---------- Grouped Bar Plot + Peak Lines ---------- #
+        histogram_job('grouped', bin_edges, counts, labels,
+                      grouped_path / f"{param_name}_grouped_distribution.png", **grouped_style),
+        # ---------- Normalised Grouped Plot (Density) ---------- #
+        histogram_job('grouped', bin_edges, norm_counts, labels,
+                      normalised_dir / f"{param_name}_grouped_normalised.png", ylabel='Density', **grouped_style),
+    ]
 
 
 # ------------------- Plot All Metrics ------------------- #
+summary = []
+
 # Max displacement
-plot_distributions('MaxDisplacement', displacement, 'Millimetres',
-                   overlap_path=overlap_dir, grouped_path=grouped_dir)
+histogram_jobs = distribution_jobs('MaxDisplacement', displacement, 'Millimetres',
+                                   overlap_path=overlap_dir, grouped_path=grouped_dir)
 # Delta displacement
-# plot_distributions('MaxDisplacement_Delta', displacement_delt, 'Millimetres',
-#                    overlap_path=overlap_dir, grouped_path=grouped_dir)
+# histogram_jobs += distribution_jobs('MaxDisplacement_Delta', displacement_delt, 'Millimetres',
+#                                     overlap_path=overlap_dir, grouped_path=grouped_dir)
 
 # 6 motion parameters
 for param in motion_param_labels:
     unit = 'Degrees' if param in ['roll', 'pitch', 'yaw'] else 'Millimetres'
-    plot_distributions(param, {ds: motion_params[ds][param] for ds in datasets},
-                       unit_label=unit,
-                       overlap_path=overlap_dir,
-                       grouped_path=grouped_dir)
+    histogram_jobs += distribution_jobs(param, {ds: motion_params[ds][param] for ds in datasets},
+                                        unit_label=unit,
+                                        overlap_path=overlap_dir,
+                                        grouped_path=grouped_dir)
+
+render_histograms(histogram_jobs, args.jobs, args.preview)
+
+# Exact count, sum, mean and range of every metric in each dataset
+pd.DataFrame(summary).to_csv(output_root / 'motion_params_summary.csv', index=False)
+print(f"Summary saved to {output_root / 'motion_params_summary.csv'}")
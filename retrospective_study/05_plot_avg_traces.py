@@ -1,68 +1,64 @@
+import sys
 import numpy as np
-import pandas as pd
 import matplotlib.pyplot as plt
 from pathlib import Path
-from collections import defaultdict
-from scipy.stats import sem
+
+# Helpers shared with the active motion study are imported from its folder
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'activemotion_study'))
+from streaming_stats import RunningTrace
+from motion_catalog import load_motion_catalog
+from motion_files import load_motion_file
 
 # Constants
 motion_param_labels = ['roll', 'pitch', 'yaw', 'dS', 'dL', 'dP']
-datasets = {
-    'Movie I': Path('derivatives_nndb'),
-    'Movie II': Path('derivatives_btf')
-}
-bad_subjects_movie2 = ['03', '07', '24', '37', '39', '43']
-run_info = pd.read_csv('run_lengths.csv')
-valid_nndb_runs = run_info[(run_info['dataset'] == 'NNdb') & (run_info['n_trs'] >= 600)]
+catalog = load_motion_catalog()  # Bad Movie II subjects are left out, based on the notes from the operator
 output_dir = Path("group_analysis/avg_traces/")
 output_dir.mkdir(parents=True, exist_ok=True)
 
-# Compute total TRs per subject for Movie I
-nndb_trs = valid_nndb_runs.groupby('subject')['n_trs'].sum().reset_index()
-nndb_trs['subject'] = nndb_trs['subject'].astype(str).str.zfill(2)
-nndb_total_trs = dict(zip(nndb_trs['subject'], nndb_trs['n_trs']))
+# Compute total TRs (of the runs with >= 600 TRs) per subject for Movie I
+nndb_total_trs = {}
+for subj_id, runs in catalog.run_index.subjects.items():
+    if runs['valid'].any():
+        nndb_total_trs[subj_id] = int(runs['n_trs'][runs['valid']].sum())
+
+# Function to load the motion trace (TR x motion parameter) of a subject, None when it cannot be read
+def load_trace(label, subj_id):
+    dfile = catalog.results_folder(label, subj_id) / "dfile_rall_norm.1D"
+    if not catalog.has_motion_file(label, subj_id, dfile.name):
+        return None
+    try:
+        return load_motion_file(dfile)[:, :len(motion_param_labels)]
+    except Exception:
+        return None
 
-# Determine min length from Movie II
+
+# ------------------- Collect and Average ------------------- #
+# Running per-TR mean and M2 of each dataset (TR x motion parameter), each file loaded once. Subjects are
+# not truncated: every TR averages the subjects whose traces reach it.
+traces = {label: RunningTrace() for label in ['Movie I', 'Movie II']}
+
+# Movie II first: its shortest subject sets the minimum length of the Movie I subjects
 btf_tr_lengths = []
-for subj in (datasets['Movie II']).iterdir():
-    if subj.name.replace('sub-', '') in bad_subjects_movie2:
+for subj_id in catalog.subject_ids('Movie II'):
+    data = load_trace('Movie II', subj_id)
+    if data is None:
         continue
-    dfile = subj / f"{subj.name}.results" / "dfile_rall_norm.1D"
-    if dfile.exists():
-        try:
-            data = np.loadtxt(dfile, comments='#')
-            btf_tr_lengths.append(data.shape[0])
-        except Exception:
-            pass
+    traces['Movie II'].add(data)
+    btf_tr_lengths.append(data.shape[0])
+
 min_len_btf = min(btf_tr_lengths)
 
-# ------------------- Collect and Average ------------------- #
-traces = defaultdict(lambda: defaultdict(list))
+# Movie I subjects with at least min_len_btf TRs in their valid runs and in their motion file
 included_movie1_subjects = set()
+for subj_id in catalog.subject_ids('Movie I'):
+    if subj_id not in nndb_total_trs or nndb_total_trs[subj_id] < min_len_btf:
+        continue
+    included_movie1_subjects.add(subj_id)
 
-for label, base_path in datasets.items():
-    for subject in sorted(base_path.iterdir()):
-        subj_id = subject.name.replace('sub-', '').zfill(2)
-        if label == 'Movie II' and subj_id in bad_subjects_movie2:
-            continue
-        if label == 'Movie I':
-            if subj_id not in nndb_total_trs or nndb_total_trs[subj_id] < min_len_btf:
-                continue
-            included_movie1_subjects.add(subj_id)
-
-        dfile = subject / f"{subject.name}.results" / "dfile_rall_norm.1D"
-        if not dfile.exists():
-            continue
-
-        try:
-            data = np.loadtxt(dfile, comments='#')
-            if data.shape[0] < min_len_btf:
-                continue
-            data = data[:min_len_btf]
-            for i, param in enumerate(motion_param_labels):
-                traces[label][param].append(data[:, i])
-        except Exception:
-            continue
+    data = load_trace('Movie I', subj_id)
+    if data is None or data.shape[0] < min_len_btf:
+        continue
+    traces['Movie I'].add(data)
 
 # Print the number of included Movie I participants
 print(f"Included {len(included_movie1_subjects)} subjects from Movie I with ≥ {min_len_btf} TRs.")
@@ -73,14 +69,13 @@ for param in motion_param_labels:
     plt.figure(figsize=(12, 6))
 
     for label, color in zip(['Movie I', 'Movie II'], ['blue', 'orange']):
-        series = traces[label][param]
-        if not series:
+        if not len(traces[label]):
             continue
-        data = np.stack(series, axis=0)  # shape: (n_subjects, n_timepoints)
-        mean_trace = np.mean(data, axis=0)
-        stderr = sem(data, axis=0)
+        i = motion_param_labels.index(param)
+        mean_trace = traces[label].nanmean()[:, i]
+        stderr = traces[label].sem()[:, i]
         plt.plot(mean_trace, label=label, color=color)
-        plt.fill_between(np.arange(min_len_btf),
+        plt.fill_between(np.arange(len(mean_trace)),
                          mean_trace - stderr,
                          mean_trace + stderr,
                          color=color, alpha=0.3)
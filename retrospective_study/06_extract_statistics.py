@@ -1,118 +1,153 @@
+import argparse
+import sys
 import numpy as np
 import pandas as pd
 from pathlib import Path
-from collections import defaultdict
 import warnings
 
+# Helpers shared with the active motion study are imported from its folder
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'activemotion_study'))
+from manifest import Manifest, manifest_path, merge_rows
+from motion_catalog import datasets, load_motion_catalog
+from motion_files import load_motion_file
+
 warnings.simplefilter("ignore")
 
 motion_param_labels = ['roll', 'pitch', 'yaw', 'dS', 'dL', 'dP']
-datasets = {
-    'Movie I': Path('derivatives_nndb'),
-    'Movie II': Path('derivatives_btf')
-}
-bad_subjects_movie2 = ['03', '07', '24', '37', '39', '43']
-run_info = pd.read_csv('run_lengths.csv')
-valid_nndb_runs = run_info[(run_info['dataset'] == 'NNdb') & (run_info['n_trs'] >= 600)]
-
-# Dict: subject -> valid run indices
-valid_run_indices = defaultdict(list)
-for _, row in valid_nndb_runs.iterrows():
-    subj = str(row['subject']).zfill(2)
-    valid_run_indices[subj].append(int(row['run_i']))
-
-records = []
-
-for label, base_path in datasets.items():
-    for subject in sorted(base_path.iterdir()):
-        subj_id = subject.name.replace('sub-', '').zfill(2)
-        if label == 'Movie II' and subj_id in bad_subjects_movie2:
-            continue
-        if label == 'Movie I' and subj_id not in valid_run_indices:
-            continue
-
-        results_path = subject / f"{subject.name}.results"
-        if not results_path.exists():
-            continue
-
-        # dfile_rall_norm_downsampled
-        dfile = results_path / "dfile_rall_norm_downsampled.1D"
-        if dfile.exists():
-            try:
-                data = np.loadtxt(dfile, comments='#')
-                if label == 'Movie I':
-                    all_runs = run_info[
-                        (run_info['dataset'] == 'NNdb') &
-                        (run_info['subject'] == int(subj_id))
-                    ].sort_values(by='run_i')
-
-                    tr_start = 0
-                    valid_trs = []
-                    for _, row in all_runs.iterrows():
-                        tr_count = int(row['n_trs'])
-                        run_i = int(row['run_i'])
-                        if run_i in valid_run_indices[subj_id]:
-                            end = tr_start + tr_count
-                            if end > len(data): continue
-                            valid_trs.append(data[tr_start:end])
-                        tr_start += tr_count
-
-                    if not valid_trs:
-                        continue
-                    data = np.concatenate(valid_trs, axis=0)
-
-                for i, param in enumerate(motion_param_labels):
-                    param_data = np.abs(data[:, i])
-                    records.append({
-                        'subject': subj_id,
-                        'dataset': label,
-                        'metric': param,
-                        'source': 'dfile',
-                        'mean': round(np.mean(param_data), 4),
-                        'median': round(np.median(param_data), 4),
-                        'max': round(np.max(param_data), 4),
-                        'min': round(np.min(param_data), 4)
-                    })
 
-            except Exception as e:
-                print(f"Error loading {dfile}: {e}")
-
-        # mm
-        for source_type, suffix in [('norm', 'norm_downsampled')]:
-            mm_data = []
-            for file in sorted(results_path.glob(f'mm.r0[0-9]*_{suffix}')):
-                run_num = int(file.name.split('.')[1][1:3])
-                if label == 'Movie I' and run_num not in valid_run_indices[subj_id]:
-                    continue
-                try:
-                    data = np.loadtxt(file, skiprows=2)
-                    data = np.abs(data)
-
-                    if data.ndim == 2 and data.shape[1] == 1:
-                        data = data[:, 0]
-                    elif data.ndim == 1:
-                        pass
-                    else:
-                        print(f"Skipping {file}: Unexpected shape {data.shape}")
-                        continue
-
-                    mm_data.append(data)
-                except Exception as e:
-                    print(f"Error reading {file}: {e}")
-
-            if mm_data:
-                mm_data = np.concatenate(mm_data)
+# Subjects and motion files of both datasets, bad Movie II subjects (based on the notes from the operator)
+# and runs, TR offsets and valid runs (>= 600 TRs) of every NNDB subject
+catalog = load_motion_catalog()
+run_index = catalog.run_index
+
+# Function to list the subjects of the analysis, as (dataset, subject id, subject folder)
+def list_subjects():
+    subjects = []
+    for label in datasets:
+        for subj_id in catalog.subject_ids(label):
+            if label == 'Movie I' and not run_index.valid_runs(subj_id):
+                continue
+            subjects.append((label, subj_id, catalog.subject_folder(label, subj_id)))
+    return subjects
+
+# Function to list the input files of a subject
+def get_input_files(label, subj_id):
+    return ([catalog.results_folder(label, subj_id) / "dfile_rall_norm_downsampled.1D"]
+            + catalog.motion_files(label, subj_id, 'mm.r0[0-9]*_norm_downsampled'))
+
+# Function to get the run selection a Movie I subject was summarized with
+def get_run_params(label, subj_id):
+    if label != 'Movie I':
+        return None
+    return {'valid_runs': run_index.valid_runs(subj_id), 'n_trs': run_index.runs(subj_id)['n_trs'].tolist()}
+
+# Function to summarize the motion parameters of one subject
+def extract_subject(label, subj_id, subject):
+    records = []
+
+    if not catalog.has_results(label, subj_id):
+        return records
+
+    # dfile_rall_norm_downsampled
+    dfile = catalog.results_folder(label, subj_id) / "dfile_rall_norm_downsampled.1D"
+    if catalog.has_motion_file(label, subj_id, dfile.name):
+        try:
+            data = load_motion_file(dfile)
+            if label == 'Movie I':
+                # Valid runs that are complete in the file, gathered in one index
+                data = data[run_index.gather_index(subj_id, len(data), complete_only=True)]
+                if not len(data):
+                    return records
+
+            for i, param in enumerate(motion_param_labels):
+                param_data = np.abs(data[:, i])
                 records.append({
                     'subject': subj_id,
                     'dataset': label,
-                    'metric': f'mm_{source_type}',
-                    'source': f'mm_{source_type}',
-                    'mean': round(np.mean(mm_data), 4),
-                    'median': round(np.median(mm_data), 4),
-                    'max': round(np.max(mm_data), 4),
-                    'min': round(np.min(mm_data), 4)
+                    'metric': param,
+                    'source': 'dfile',
+                    'mean': round(np.mean(param_data), 4),
+                    'median': round(np.median(param_data), 4),
+                    'max': round(np.max(param_data), 4),
+                    'min': round(np.min(param_data), 4)
                 })
 
+        except Exception as e:
+            print(f"Error loading {dfile}: {e}")
+
+    # mm
+    for source_type, suffix in [('norm', 'norm_downsampled')]:
+        mm_data = []
+        for file in catalog.motion_files(label, subj_id, f'mm.r0[0-9]*_{suffix}'):
+            run_num = int(file.name.split('.')[1][1:3])
+            if label == 'Movie I' and run_num not in run_index.valid_runs(subj_id):
+                continue
+            try:
+                data = load_motion_file(file, skiprows=2)
+                data = np.abs(data)
+
+                if data.ndim == 2 and data.shape[1] == 1:
+                    data = data[:, 0]
+                elif data.ndim == 1:
+                    pass
+                else:
+                    print(f"Skipping {file}: Unexpected shape {data.shape}")
+                    continue
+
+                mm_data.append(data)
+            except Exception as e:
+                print(f"Error reading {file}: {e}")
+
+        if mm_data:
+            mm_data = np.concatenate(mm_data)
+            records.append({
+                'subject': subj_id,
+                'dataset': label,
+                'metric': f'mm_{source_type}',
+                'source': f'mm_{source_type}',
+                'mean': round(np.mean(mm_data), 4),
+                'median': round(np.median(mm_data), 4),
+                'max': round(np.max(mm_data), 4),
+                'min': round(np.min(mm_data), 4)
+            })
+
+    return records
+
+parser = argparse.ArgumentParser(description='Summarize the normalized motion parameters of every subject.')
+parser.add_argument('--incremental', action='store_true',
+                    help='only recompute subjects whose input files changed and merge them into the existing CSV')
+args = parser.parse_args()
+
+output_csv = Path("group_analysis/df_motion_param_stats.csv")
+
+# Subjects whose inputs (or valid runs) changed since the last run
+subjects = list_subjects()
+manifest = Manifest(manifest_path(output_csv))
+incremental = args.incremental and output_csv.exists()
+if incremental:
+    stale_subjects = [(label, subj_id, subject) for label, subj_id, subject in subjects
+                      if not manifest.is_current(f'{label}/{subj_id}', get_input_files(label, subj_id),
+                                                 get_run_params(label, subj_id))]
+    print(f"Recomputing {len(stale_subjects)} of {len(subjects)} subjects")
+else:
+    stale_subjects = subjects
+
+records = []
+for label, subj_id, subject in stale_subjects:
+    records.extend(extract_subject(label, subj_id, subject))
+
 # Save to csv file
 df = pd.DataFrame(records)
-df.to_csv("group_analysis/df_motion_param_stats.csv", index=False)
+
+# Merge the new rows with the rows of unchanged subjects from the previous run
+if incremental:
+    df, _ = merge_rows(pd.read_csv(output_csv, dtype={'subject': str}), df,
+                       [(label, subj_id) for label, subj_id, _ in subjects],
+                       [(label, subj_id) for label, subj_id, _ in stale_subjects],
+                       key_cols=('dataset', 'subject'))
+
+df.to_csv(output_csv, index=False)
+
+for label, subj_id, subject in stale_subjects:
+    manifest.update(f'{label}/{subj_id}', get_input_files(label, subj_id), get_run_params(label, subj_id))
+manifest.save()
@@ -1,9 +1,10 @@
+import sys
 import pandas as pd
-import pingouin as pg
 from pathlib import Path
 
-import warnings
-warnings.filterwarnings("ignore", category=FutureWarning, module="pingouin")
+# Helpers shared with the active motion study are imported from its folder
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'activemotion_study'))
+from anova import anova_oneway_table
 
 # Load the CSV
 df = pd.read_csv("group_analysis/df_motion_param_stats.csv")
@@ -12,44 +13,29 @@ df = pd.read_csv("group_analysis/df_motion_param_stats.csv")
 output_dir = Path("group_analysis")
 output_dir.mkdir(exist_ok=True)
 
-# Store all ANOVA results here
-all_results = []
+metrics = ['mm_norm', 'dS', 'dL', 'dP', 'roll', 'pitch', 'yaw']
 
-# Store descriptive stats here
-all_descriptives = []
+# Subject averages of every metric, one row per subject and dataset
+df_avg = df[df['metric'].isin(metrics)].groupby(['metric', 'subject', 'dataset'])['mean'].mean().reset_index()
 
-# Loop through all combinations of source and param
-for metric in ['mm_norm', 'dS', 'dL', 'dP', 'roll', 'pitch', 'yaw']:
-        df_sub = df[(df['metric'] == metric)].copy()
-        df_avg = df_sub.groupby(['subject', 'dataset'])['mean'].mean().reset_index()
+# Descriptive stats per dataset
+df_descr = df_avg.groupby(['metric', 'dataset'])['mean'].agg(['mean', 'std', 'median', 'max']).reset_index()
+df_descr['metric'] = pd.Categorical(df_descr['metric'], categories=metrics)
+df_descr = df_descr.sort_values(['metric', 'dataset'])[['dataset', 'mean', 'std', 'median', 'max', 'metric']]
 
-        # Descriptive stats per dataset
-        desc = df_avg.groupby('dataset')['mean'].agg(['mean', 'std', 'median', 'max']).reset_index()
-        desc['metric'] = metric
-        all_descriptives.append(desc)
+# Wide table: subject x dataset rows, one column per metric
+df_wide = df_avg.pivot_table(index=['subject', 'dataset'], columns='metric', values='mean').reindex(columns=metrics)
 
-        # pivot
-        df_wide = df_avg.pivot_table(index='subject', columns=['dataset'], values='mean')
-        df_wide = df_wide.reset_index()
+# run the one-way ANOVA (dataset) of all metrics at once
+df_all = anova_oneway_table(df_wide.to_numpy(), df_wide.index.get_level_values('dataset'), between='dataset', metrics=metrics)
 
-        # melt into long format
-        df_long = df_wide.melt(id_vars='subject', var_name='dataset', value_name='value')
+# show the ANOVA tables
+for metric, aov in df_all.groupby('metric', sort=False):
+    print(f'\nResults for {metric}:')
+    print(aov.round(4))
 
-        # run ANOVA
-        aov = pg.anova(dv='value', between='dataset', data=df_long, detailed=True)
-
-        # append data to then save to csv
-        aov['metric'] = metric
-        all_results.append(aov)
-
-        # show the ANOVA table
-        print(f'\nResults for {metric}:')
-        print(aov.round(4))
-
-# Combine and save all results
-df_all = pd.concat(all_results, ignore_index=True)
+# Save all results
 df_all.round(4).to_csv(output_dir / "df_anova_motion_param_stats.csv", index=False)
 
 # Save descriptive stats
-df_descr = pd.concat(all_descriptives, ignore_index=True)
-df_descr.round(2).to_csv(output_dir / "df_motion_param_descriptives.csv", index=False)
\ No newline at end of file
+df_descr.round(2).to_csv(output_dir / "df_motion_param_descriptives.csv", index=False)
@@ -1,15 +1,24 @@
+import argparse
+import sys
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 from pathlib import Path
-from scipy.stats import gaussian_kde
-import matplotlib.patheffects as path_effects
+
+# Helpers shared with the active motion study are imported from its folder
+sys.path.append(str(Path(__file__).resolve().parent.parent / 'activemotion_study'))
+from histogram_plots import histogram_job, render_histograms
+from motion_catalog import load_motion_catalog
+from motion_files import load_motion_file
+
+parser = argparse.ArgumentParser(description='Plot the normalised delta motion distributions of both movie datasets.')
+parser.add_argument('--jobs', type=int, default=1, help='number of processes rendering the histograms')
+parser.add_argument('--preview', action='store_true', help='render the histograms at low dpi for a quick check')
+args = parser.parse_args()
 
 # ------------------- Setup ------------------- #
 output_root = Path('/egor2/egor/MinMo_movements/retrospective_study/group_analysis')
 delta_csv = output_root / 'delta_max_per_subject.csv'
-btf_path = Path('derivatives_btf')
-nndb_path = Path('derivatives_nndb')
+catalog = load_motion_catalog()
 
 delta_plot_dir = output_root / 'plots_motion_params_delta'
 delta_max_dir = output_root / 'plots_motion_params_delta_max'
@@ -25,38 +34,20 @@ dataset_labels = {
     'derivatives_nndb': 'Movie I',
     'derivatives_btf': 'Movie II'
 }
-dataset_paths = {
-    'derivatives_nndb': nndb_path,
-    'derivatives_btf': btf_path
-}
 
 # ------------------- Plotting Function ------------------- #
-def plot_normalised_hist(metric, data_dict, output_path, ylabel):
+def normalised_hist_job(metric, data_dict, output_path, ylabel):
     all_vals = np.concatenate(list(data_dict.values()))
     bin_edges = np.linspace(0, np.percentile(all_vals, 99), 60)
-    bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
-    bar_width = (bin_edges[1] - bin_edges[0]) * 0.4
-
-    plt.figure(figsize=(10, 6))
-
-    for idx, (label, color) in enumerate(zip(data_dict, ['blue', 'orange'])):
-        vals = np.array(data_dict[label])
-        shift = (-1 if idx == 0 else 1) * bar_width / 2
-        counts, _ = np.histogram(vals, bins=bin_edges)
-        norm_counts = counts / np.sum(counts)
-
-        plt.bar(bin_centers + shift, norm_counts, width=bar_width, color=color, alpha=0.6, label=label)
-        plt.plot(bin_centers, norm_counts, color=color, lw=2,
-                 path_effects=[path_effects.withStroke(linewidth=3, foreground='black')])
-
-    plt.title(f'Normalised Delta Distribution of {metric}')
-    plt.xlabel(ylabel)
-    plt.ylabel('Density')
-    plt.grid(True)
-    plt.legend()
-    plt.tight_layout()
-    plt.savefig(output_path / f'delta_{metric}_distribution_norm.png', dpi=300)
-    plt.close()
+
+    norm_counts = []
+    for label in data_dict:
+        counts, _ = np.histogram(np.array(data_dict[label]), bins=bin_edges)
+        norm_counts.append(counts / np.sum(counts))
+
+    return histogram_job('grouped', bin_edges, norm_counts, list(data_dict), output_path / f'delta_{metric}_distribution_norm.png',
+                         alpha=0.6, peak_lines=True, title=f'Normalised Delta Distribution of {metric}', xlabel=ylabel,
+                         ylabel='Density', tight_layout=True, bbox_inches=None)
 
 # ------------------- Load Delta MAX Values (from CSV) ------------------- #
 df = pd.read_csv(delta_csv)
@@ -70,24 +61,27 @@ data_max = {
 # ------------------- Load TR-wise Delta from dfile_rall_delta_downsampled.1D ------------------- #
 data_trwise = {metric: {'Movie I': [], 'Movie II': []} for metric in metrics}
 
-for ds_key, ds_label in dataset_labels.items():
-    base_path = dataset_paths[ds_key]
-    for subj_dir in sorted(base_path.glob('sub-*')):
-        dfile = subj_dir / f"{subj_dir.name}.results" / 'dfile_rall_delta_downsampled.1D'
-        if dfile.exists():
+for ds_label in dataset_labels.values():
+    for subj_id in catalog.subject_ids(ds_label, include_bad=True):
+        dfile = catalog.results_folder(ds_label, subj_id) / 'dfile_rall_delta_downsampled.1D'
+        if catalog.has_motion_file(ds_label, subj_id, dfile.name):
             try:
-                data = np.loadtxt(dfile, comments='#')
+                data = load_motion_file(dfile)
                 for i, metric in enumerate(metrics):
                     data_trwise[metric][ds_label].extend(np.abs(data[:, i]))
             except Exception as e:
                 print(f"Could not load {dfile}: {e}")
 
 # ------------------- Plotting ------------------- #
+histogram_jobs = []
 for metric in metrics:
     unit = unit_labels[metric]
 
     # Plot TR-wise delta
-    plot_normalised_hist(metric, data_trwise[metric], delta_plot_dir, unit)
+    histogram_jobs.append(normalised_hist_job(metric, data_trwise[metric], delta_plot_dir, unit))
 
     # Plot subject-wise max delta
-    plot_normalised_hist(metric + '_max', data_max[metric], delta_max_dir, unit)
+    histogram_jobs.append(normalised_hist_job(metric + '_max', data_max[metric], delta_max_dir, unit))
+
+render_histograms(histogram_jobs, args.jobs, args.preview)
+
@@ -0,0 +1,158 @@
+import json
+import os
+import pandas as pd
+from fnmatch import fnmatchcase
+from pathlib import Path
+from catalog import read_subject_list, source_mtime
+from run_index import RunIndex
+
+datasets = {
+    'Movie I': 'derivatives_nndb',
+    'Movie II': 'derivatives_btf'
+}
+
+
+class MotionCatalog:
+    """
+    Index of the retrospective study, built once from run_lengths.csv, bad_subjects_btf.txt and a single
+    scan of the derivatives folders: for every dataset and subject, its folder, whether it is a bad
+    subject, whether its results folder exists and the motion files (mm.* and dfile*) it holds. The
+    runs of the Movie I subjects (ids, TR offsets, valid runs) come with it as a RunIndex.
+
+    Built on the catalog of the active motion study: the index is cached as JSON together with the
+    mtimes of its sources (run table, subject list and every scanned folder), and rebuilt when one of
+    them changed.
+    """
+
+    def __init__(self, root_fldr, entries, runs, sources):
+        self.root_fldr = Path(root_fldr)
+        self.entries = entries
+        self.runs = runs
+        self.sources = sources
+        self.run_index = RunIndex(pd.DataFrame(runs, columns=['dataset', 'subject', 'run_i', 'n_trs']),
+                                  dataset='NNdb', min_trs=600)
+
+    @classmethod
+    def build(cls, root_fldr):
+        """
+        Read the run table and the bad subject list and scan the derivatives folders (sub-<id> subject
+        folders, then their results folders).
+        """
+        root_fldr = Path(root_fldr)
+        run_file = root_fldr / 'run_lengths.csv'
+        bad_file = Path(__file__).with_name('bad_subjects_btf.txt')
+        bad_subjects = set(read_subject_list(bad_file)) if bad_file.exists() else set()
+        sources = {str(path): source_mtime(path) for path in (run_file, bad_file)}
+
+        runs = {'dataset': [], 'subject': [], 'run_i': [], 'n_trs': []}
+        if run_file.exists():
+            run_info = pd.read_csv(run_file)
+            runs = {column: run_info[column].tolist() for column in runs}
+
+        entries = {}
+        for label, deriv_name in datasets.items():
+            deriv_fldr = root_fldr / deriv_name
+            sources[str(deriv_fldr)] = source_mtime(deriv_fldr)
+            entries[label] = {}
+            if not deriv_fldr.is_dir():
+                continue
+
+            with os.scandir(deriv_fldr) as subject_dirs:
+                subject_dirs = sorted((entry for entry in subject_dirs if entry.is_dir() and entry.name.startswith('sub-')),
+                                      key=lambda entry: entry.name)
+            for subject_dir in subject_dirs:
+                subj_id = subject_dir.name.replace('sub-', '').zfill(2)
+                results_path = os.path.join(subject_dir.path, f'{subject_dir.name}.results')
+                sources[subject_dir.path] = source_mtime(subject_dir.path)
+
+                # Motion files of the results folder (the .npy sidecars are left out)
+                files = []
+                if os.path.isdir(results_path):
+                    sources[results_path] = source_mtime(results_path)
+                    with os.scandir(results_path) as result_files:
+                        files = sorted(entry.name for entry in result_files
+                                       if entry.name.startswith(('mm.', 'dfile')) and not entry.name.endswith('.npy'))
+
+                entries[label][subj_id] = {'folder': subject_dir.name,
+                                           'bad': label == 'Movie II' and subj_id in bad_subjects,
+                                           'results': os.path.isdir(results_path), 'files': files}
+
+        return cls(root_fldr, entries, runs, sources)
+
+    def is_current(self):
+        """
+        True when none of the sources changed since the catalog was built.
+        """
+        return all(source_mtime(path) == mtime for path, mtime in self.sources.items())
+
+    def save(self, path):
+        with open(path, 'w') as file:
+            json.dump({'root': str(self.root_fldr), 'sources': self.sources, 'runs': self.runs,
+                       'datasets': self.entries}, file, indent=1)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as file:
+            cache = json.load(file)
+        return cls(cache['root'], cache['datasets'], cache['runs'], cache['sources'])
+
+    def subject_ids(self, label, include_bad=False):
+        """
+        Ids of the subjects of a dataset ('01', ...) in folder order, without the bad ones by default.
+        """
+        return [subj_id for subj_id, entry in self.entries[label].items() if include_bad or not entry['bad']]
+
+    def is_bad(self, label, subj_id):
+        return self.entries[label][subj_id]['bad']
+
+    def subject_folder(self, label, subj_id):
+        return self.root_fldr / datasets[label] / self.entries[label][subj_id]['folder']
+
+    def results_folder(self, label, subj_id):
+        folder = self.entries[label][subj_id]['folder']
+        return self.root_fldr / datasets[label] / folder / f'{folder}.results'
+
+    def has_results(self, label, subj_id):
+        """
+        Whether the results folder of a subject existed when the catalog was built.
+        """
+        return self.entries[label][subj_id]['results']
+
+    def has_motion_file(self, label, subj_id, name):
+        """
+        Whether a motion file (e.g. 'dfile_rall_norm.1D') was in the results folder of a subject.
+        """
+        return name in self.entries[label][subj_id]['files']
+
+    def motion_files(self, label, subj_id, pattern):
+        """
+        Motion files of the results folder of a subject matching a glob pattern (e.g. 'mm.r0*_delt'),
+        sorted by name.
+        """
+        results_path = self.results_folder(label, subj_id)
+        return [results_path / name for name in self.entries[label][subj_id]['files'] if fnmatchcase(name, pattern)]
+
+
+# Function to get the catalog of the retrospective study, from its cache when none of its sources changed
+def load_motion_catalog(root_fldr='.', rebuild=False):
+    """
+    The catalog of the datasets in root_fldr (the current folder by default), cached in
+    root_fldr/motion_catalog.json.
+    """
+    root_fldr = Path(root_fldr)
+    cache_path = root_fldr / 'motion_catalog.json'
+
+    if not rebuild and cache_path.exists():
+        try:
+            catalog = MotionCatalog.load(cache_path)
+            if catalog.root_fldr == root_fldr and catalog.is_current():
+                return catalog
+        except (OSError, ValueError, KeyError):
+            pass  # Unreadable cache: rebuild it
+
+    catalog = MotionCatalog.build(root_fldr)
+    try:
+        catalog.save(cache_path)
+    except OSError:
+        pass  # Read-only study folder: keep working without the cache
+    return catalog
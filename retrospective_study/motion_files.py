@@ -0,0 +1,62 @@
+import numpy as np
+from pathlib import Path
+
+
+# Function to get the binary sidecar of a motion text file
+def sidecar_path(text_path, skiprows=0):
+    """
+    The sidecar is a .npy next to the text file, with the full file name and the number of skipped
+    rows kept (e.g. mm.r01_norm_downsampled.skip2.npy), so reads with another skiprows never share it.
+    """
+    text_path = Path(text_path)
+    return text_path.with_name(f'{text_path.name}.skip{skiprows}.npy')
+
+
+# Function to check whether a sidecar can stand in for its text file
+def sidecar_is_current(text_path, skiprows=0):
+    sidecar = sidecar_path(text_path, skiprows)
+    return sidecar.exists() and sidecar.stat().st_mtime_ns >= Path(text_path).stat().st_mtime_ns
+
+
+# Function to shape values as np.loadtxt returns them from their text form
+def _as_loaded(values):
+    """
+    np.savetxt writes one line per row (one value per line for 1-D data) and np.loadtxt squeezes the
+    lines x columns table it reads back, an empty file giving an empty 1-D array.
+    """
+    if values.size == 0:
+        return np.empty(0)
+    return np.squeeze(values.reshape(len(values), -1))
+
+
+# Function to write a motion text file and its sidecar
+def write_motion_file(text_path, header, data, decimals):
+    """
+    Write data as text (header lines, then the values with decimals digits) and, next to it, the sidecar
+    holding the values exactly as np.loadtxt(text_path, skiprows=len(header)) would read them back.
+    """
+    fmt = f'%.{decimals}f'
+    with open(text_path, 'w') as f:
+        f.writelines(header)
+        np.savetxt(f, data, fmt=fmt)
+
+    # Values parsed back from their text form, so the sidecar and the text never differ in the last digit
+    np.save(sidecar_path(text_path, len(header)), _as_loaded(np.char.mod(fmt, data).astype(float)))
+
+
+# Function to load a motion text file, from its sidecar when possible
+def load_motion_file(text_path, skiprows=0):
+    """
+    Same array as np.loadtxt(text_path, comments='#', skiprows=skiprows). The text is only parsed when
+    the sidecar of this skiprows is missing or older than the text, and the sidecar is then (re)written
+    for the next run.
+    """
+    if sidecar_is_current(text_path, skiprows):
+        return np.load(sidecar_path(text_path, skiprows))
+
+    data = np.loadtxt(text_path, comments='#', skiprows=skiprows)
+    try:
+        np.save(sidecar_path(text_path, skiprows), data)
+    except OSError:
+        pass  # Read-only derivatives: keep working from the text
+    return data
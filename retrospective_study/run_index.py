@@ -0,0 +1,72 @@
+import numpy as np
+
+
+class RunIndex:
+    """
+    The runs of every subject of one dataset of run_lengths.csv, built once: run ids (in run order),
+    lengths in TRs, TR offsets of the runs in the subject's concatenated motion files and whether each
+    run is valid (at least min_trs TRs). Subjects are keyed by their zero-padded id ('01').
+    """
+
+    def __init__(self, run_info, dataset='NNdb', min_trs=600):
+        runs = run_info[run_info['dataset'] == dataset].sort_values(by=['subject', 'run_i'], kind='stable')
+        subjects = runs['subject'].astype(str).str.zfill(2).to_numpy()
+        run_ids = runs['run_i'].to_numpy(dtype=int)
+        n_trs = runs['n_trs'].to_numpy(dtype=int)
+
+        # One slice of the sorted table per subject
+        self.subjects = {}
+        bounds = np.flatnonzero(subjects[1:] != subjects[:-1]) + 1
+        for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(subjects)]):
+            lengths = n_trs[start:end]
+            self.subjects[subjects[start]] = {
+                'run_ids': run_ids[start:end],
+                'n_trs': lengths,
+                'offsets': np.cumsum(lengths) - lengths,
+                'valid': lengths >= min_trs,
+            }
+
+    def __contains__(self, subj_id):
+        return subj_id in self.subjects
+
+    def runs(self, subj_id):
+        """
+        Run ids, lengths, offsets and valid mask of a subject (empty arrays for an unknown subject).
+        """
+        empty = np.zeros(0, dtype=int)
+        return self.subjects.get(subj_id, {'run_ids': empty, 'n_trs': empty, 'offsets': empty,
+                                           'valid': empty.astype(bool)})
+
+    def valid_runs(self, subj_id):
+        """
+        Ids of the valid runs of a subject, as a list.
+        """
+        runs = self.runs(subj_id)
+        return runs['run_ids'][runs['valid']].tolist()
+
+    def invalid_runs(self, subj_id):
+        """
+        (run id, n_trs) of the runs of a subject that are too short.
+        """
+        runs = self.runs(subj_id)
+        return list(zip(runs['run_ids'][~runs['valid']].tolist(), runs['n_trs'][~runs['valid']].tolist()))
+
+    def gather_index(self, subj_id, n_timepoints=None, complete_only=False):
+        """
+        TR indices of the valid runs of a subject in its concatenated motion file, so that
+        data[gather_index(...)] concatenates the valid runs in one fancy-index. With n_timepoints (the
+        length of the file), runs running past the end are cut like a slice would, or left out
+        altogether with complete_only.
+        """
+        runs = self.runs(subj_id)
+        starts = runs['offsets'][runs['valid']]
+        ends = starts + runs['n_trs'][runs['valid']]
+        if n_timepoints is not None:
+            if complete_only:
+                starts, ends = starts[ends <= n_timepoints], ends[ends <= n_timepoints]
+            else:
+                ends = np.minimum(ends, n_timepoints)
+        lengths = np.maximum(ends - starts, 0)
+
+        # Start of each run repeated over its TRs, plus the position of the TR within the run
+        return np.repeat(starts - (np.cumsum(lengths) - lengths), lengths) + np.arange(lengths.sum())
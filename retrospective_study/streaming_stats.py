@@ -0,0 +1,153 @@
+import numpy as np
+
+
+class StreamingHistogram:
+    """
+    Fixed-width histogram of a stream of values, updated batch by batch with bincount so the samples
+    never have to be kept. Bins are centered on multiples of width and the bin range grows on demand,
+    so memory depends on the value range only, not on the number of samples. The count, sum, min and
+    max are tracked exactly; percentiles and re-binned counts are exact when every value is a multiple
+    of width (e.g. width=1e-4 for files written with at most 4 decimals), within one width otherwise.
+    """
+
+    def __init__(self, width):
+        self.width = width
+        self.start = 0  # Bin index of counts[0]
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.count = 0
+        self.sum = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def _grow(self, first, last):
+        """
+        Extend the bin range to cover the bin indices first..last.
+        """
+        if len(self.counts) == 0:
+            self.start = first
+            self.counts = np.zeros(last - first + 1, dtype=np.int64)
+            return
+        end = self.start + len(self.counts) - 1
+        pad_left = max(self.start - first, 0)
+        pad_right = max(last - end, 0)
+        if pad_left or pad_right:
+            self.counts = np.pad(self.counts, (pad_left, pad_right))
+            self.start -= pad_left
+
+    def add(self, values):
+        """
+        Add a batch of values (NaNs are ignored).
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return
+
+        bins = np.rint(values / self.width).astype(np.int64)
+        self._grow(bins.min(), bins.max())
+        self.counts += np.bincount(bins - self.start, minlength=len(self.counts))
+
+        self.count += values.size
+        self.sum += values.sum()
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+
+    def merge(self, other):
+        """
+        Merge another StreamingHistogram of the same width (e.g. another dataset) into this one.
+        """
+        if other.count == 0:
+            return self
+        self._grow(other.start, other.start + len(other.counts) - 1)
+        offset = other.start - self.start
+        self.counts[offset:offset + len(other.counts)] += other.counts
+
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else np.nan
+
+    def values(self):
+        """
+        Value (center) of every bin, to go with self.counts.
+        """
+        return (self.start + np.arange(len(self.counts))) * self.width
+
+    def percentile(self, q):
+        """
+        q-th percentile with the linear interpolation of np.percentile.
+        """
+        position = (self.count - 1) * q / 100
+        below = int(np.floor(position))
+        cumulative = np.cumsum(self.counts)
+        lower, upper = self.values()[np.searchsorted(cumulative, [below, min(below + 1, self.count - 1)], side='right')]
+        return lower + (position - below) * (upper - lower)
+
+    def histogram(self, bin_edges):
+        """
+        Counts on other bin edges, as np.histogram(values, bins=bin_edges) would give.
+        """
+        counts, _ = np.histogram(self.values(), bins=bin_edges, weights=self.counts)
+        return counts.astype(np.int64)
+
+
+class RunningTrace:
+    """
+    Per-timepoint running count, mean and M2 of traces (time x channels) of different lengths, updated
+    one trace at a time (Welford) so the traces never have to be stacked or truncated. Each timepoint
+    averages the traces long enough to reach it; NaNs are skipped like nanmean.
+    """
+
+    def __init__(self):
+        self.count = np.zeros((0, 0), dtype=np.int64)
+        self.mean = np.zeros((0, 0))
+        self.m2 = np.zeros((0, 0))
+
+    def __len__(self):
+        return len(self.count)
+
+    def _grow(self, n_timepoints, n_channels):
+        """
+        Extend the accumulators to n_timepoints (channels are fixed by the first trace).
+        """
+        if self.count.size == 0:
+            self.count = np.zeros((0, n_channels), dtype=np.int64)
+            self.mean = np.zeros((0, n_channels))
+            self.m2 = np.zeros((0, n_channels))
+        extra = n_timepoints - len(self.count)
+        if extra > 0:
+            self.count = np.pad(self.count, ((0, extra), (0, 0)))
+            self.mean = np.pad(self.mean, ((0, extra), (0, 0)))
+            self.m2 = np.pad(self.m2, ((0, extra), (0, 0)))
+
+    def add(self, trace):
+        """
+        Add one trace (time x channels, or time only for a single channel).
+        """
+        trace = np.asarray(trace, dtype=float)
+        if trace.ndim == 1:
+            trace = trace[:, None]
+        n = len(trace)
+        self._grow(n, trace.shape[1])
+
+        finite = ~np.isnan(trace)
+        count = self.count[:n] + finite
+        delta = np.where(finite, trace - self.mean[:n], 0)
+        self.mean[:n] += np.divide(delta, count, out=np.zeros(delta.shape), where=count > 0)
+        self.m2[:n] += delta * np.where(finite, trace - self.mean[:n], 0)
+        self.count[:n] = count
+
+    def nanmean(self):
+        return np.where(self.count > 0, self.mean, np.nan)
+
+    def sem(self, ddof=1):
+        """
+        Standard error of the mean, ddof=1 by default like scipy.stats.sem.
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.count > ddof, np.sqrt(self.m2 / (self.count - ddof) / self.count), np.nan)